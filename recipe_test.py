@@ -3,17 +3,44 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import altair as alt
+import os
+import sys
+import time
+import threading
+import functools
+import inspect
+import hashlib
+import gzip
+import json
+import re
+import unicodedata
+import queue
+import sqlite3
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+from contextlib import contextmanager
 
-# Set page configuration
-st.set_page_config(
-    page_title="PDQ CS Recipe Dashboard",
-    page_icon="🚀",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:  # the on-disk frame store and Parquet shipment input are optional
+    pa = None
+
+def render_page_header():
+    """Page configuration, brand styling and title (the first Streamlit calls of every dashboard run)"""
+    # Set page configuration
+    st.set_page_config(
+        page_title="PDQ CS Recipe Dashboard",
+        page_icon="🚀",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
 
-# Custom styling with PDQ brand colors
-st.markdown("""
+    # Custom styling with PDQ brand colors
+    st.markdown("""
 <style>
     /* PDQ Color Palette */
     :root {
@@ -326,93 +353,900 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# App title and description
-st.markdown('<h1 class="dashboard-title">CS Recipe Dashboard</h1>', unsafe_allow_html=True)
-st.markdown('<p>Helping CS teams identify and recommend high-impact checkout optimizations</p>', unsafe_allow_html=True)
+    # App title and description
+    st.markdown('<h1 class="dashboard-title">CS Recipe Dashboard</h1>', unsafe_allow_html=True)
+    st.markdown('<p>Helping CS teams identify and recommend high-impact checkout optimizations</p>', unsafe_allow_html=True)
 
-# Modified to use generated data instead of Snowflake queries
-def generate_segments_data(merchant_name):
-    """Generate realistic demo recipe segments data"""
-    np.random.seed(hash(merchant_name) % 100)  # For reproducible results
-    
-    # Create segment pairs
-    segment_pairs = [
-        ("Without Coupon", "With Coupon"),
-        ("First Time User without Coupon", "First Time User with Coupon"),
-        ("Below Threshold", "Above Threshold"),
-        ("Below Threshold without Coupon", "Above Threshold without Coupon"),
-        ("Returning User without Coupon", "Returning User with Coupon"),
-        ("First Time User Below Threshold", "First Time User Above Threshold"),
-        ("Returning User Below Threshold", "Returning User Above Threshold")
+# Cache settings (override with environment variables)
+CACHE_TTL_SECONDS = int(os.environ.get("RECIPE_CACHE_TTL_SECONDS", 600))
+CACHE_MAX_BYTES = int(os.environ.get("RECIPE_CACHE_MAX_MB", 256)) * 1024 * 1024
+
+def _estimate_nbytes(value):
+    """Approximate in-memory size of a cached value"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    return getattr(value, "nbytes", None) or sys.getsizeof(value)
+
+class FrameCache:
+    """Thread-safe cache with a TTL and an LRU memory budget, plus hit/miss counters"""
+
+    def __init__(self, ttl=CACHE_TTL_SECONDS, max_bytes=CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, nbytes, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (hit, value), refreshing the entry's LRU position on a hit"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[2]
+
+    def put(self, key, value):
+        nbytes = _estimate_nbytes(value)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, nbytes, value)
+            self._bytes += nbytes
+            # Evict least recently used entries until we are back under budget
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, predicate=None):
+        """Drop every entry, or only those whose key matches the predicate"""
+        with self._lock:
+            for key in [k for k in self._entries if predicate is None or predicate(k)]:
+                self._drop(key)
+
+    def matching(self, predicate):
+        """Live (key, value) pairs whose key matches, without touching LRU order or hit counters"""
+        now = time.monotonic()
+        with self._lock:
+            return [(key, entry[2]) for key, entry in self._entries.items() if entry[0] >= now and predicate(key)]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def _drop(self, key):
+        _, nbytes, _ = self._entries.pop(key)
+        self._bytes -= nbytes
+
+@st.cache_resource
+def get_frame_cache():
+    """Process-wide frame cache shared across reruns, tabs and sessions"""
+    return FrameCache()
+
+def cached_frame(func):
+    """Memoize a data function in the shared frame cache, keyed by its name and arguments"""
+    signature = inspect.signature(func)
+    
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Key on the bound arguments so positional, keyword and defaulted calls share an entry
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (func.__name__, tuple(bound.arguments.values()))
+        cache = get_frame_cache()
+        hit, value = cache.get(key)
+        if not hit:
+            value = func(*args, **kwargs)
+            cache.put(key, value)
+        # Hand out copies so callers can't mutate the cached frame
+        return value.copy() if isinstance(value, pd.DataFrame) else value
+    return wrapper
+
+# Persistent frame store settings (set RECIPE_FRAME_STORE_DIR to "" to disable)
+FRAME_STORE_DIR = os.environ.get(
+    "RECIPE_FRAME_STORE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".frame_store")
+)
+FRAME_STORE_MAX_AGE_SECONDS = int(os.environ.get("RECIPE_FRAME_STORE_MAX_AGE_SECONDS", 24 * 3600))
+FRAME_STORE_MAX_BYTES = int(os.environ.get("RECIPE_FRAME_STORE_MAX_MB", 512)) * 1024 * 1024
+FRAME_STORE_PRUNE_SECONDS = int(os.environ.get("RECIPE_FRAME_STORE_PRUNE_SECONDS", 60))
+SCHEMA_VERSION = 12  # bump when a stored frame's schema changes (frame store and snapshot)
+ANALYSIS_WINDOW_DAYS = 30
+
+def get_analysis_window(days=ANALYSIS_WINDOW_DAYS):
+    """First and last day (inclusive) of the analysis window ending today, which is what the data sources store"""
+    today = datetime.now().date()
+    return today - timedelta(days=days - 1), today
+
+class FrameStore:
+    """Per-merchant frames persisted as Arrow IPC files and loaded memory-mapped.
+
+    Layout: <root>/v<version>/<kind>/<merchant>/<start>_<end>_<params digest>.arrow
+    Files expire max_age seconds after they were written, and the least recently used ones
+    are evicted once the store (including older schema versions) grows past max_bytes. Pruning
+    scans the whole store, so writes run it at most once every prune_interval seconds.
+    """
+
+    def __init__(self, root, max_age=FRAME_STORE_MAX_AGE_SECONDS, max_bytes=FRAME_STORE_MAX_BYTES,
+                 prune_interval=FRAME_STORE_PRUNE_SECONDS):
+        self.base = root
+        self.root = os.path.join(root, f"v{SCHEMA_VERSION}")
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.prune_interval = prune_interval
+        self._next_prune = 0.0
+
+    def load(self, kind, merchant, window, params=()):
+        """Return the stored frame, or None if it isn't there, has expired or can't be read"""
+        path = self._path(kind, merchant, window, params)
+        try:
+            written_at = os.path.getmtime(path)
+        except OSError:
+            return None
+        if time.time() - written_at > self.max_age:
+            self._remove(path)
+            return None
+        try:
+            df = feather.read_table(path, memory_map=True).to_pandas()
+        except (OSError, pa.ArrowException):
+            # Corrupt or truncated file: drop it and recompute
+            self._remove(path)
+            return None
+        # Record the use in the access time (the write time stays in mtime for expiry)
+        try:
+            os.utime(path, (time.time(), written_at))
+        except OSError:
+            pass
+        return df
+
+    def save(self, kind, merchant, window, df, params=()):
+        path = self._path(kind, merchant, window, params)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            feather.write_feather(pa.Table.from_pandas(df, preserve_index=True), tmp_path, compression="uncompressed")
+            os.replace(tmp_path, path)  # atomic, so readers never see a partial file
+        except (OSError, pa.ArrowException):
+            self._remove(tmp_path)
+        if time.monotonic() >= self._next_prune:
+            self._next_prune = time.monotonic() + self.prune_interval
+            self.prune()
+
+    def prune(self):
+        """Delete expired files, then least recently used ones until the store fits in max_bytes"""
+        now = time.time()
+        files = []
+        for dirpath, _, filenames in os.walk(self.base):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                if now - info.st_mtime > self.max_age:
+                    self._remove(path)
+                elif not name.endswith(".tmp"):  # leave in-progress writes alone
+                    files.append((info.st_atime, info.st_size, path))
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            total -= size
+            removed += self._remove(path)
+        return removed
+
+    def invalidate(self, merchant=None, kind=None):
+        """Delete stored frames for a merchant and/or kind (everything if neither is given)"""
+        removed = 0
+        if not os.path.isdir(self.root):
+            return removed
+        kinds = [kind] if kind else os.listdir(self.root)
+        for stored_kind in kinds:
+            kind_dir = os.path.join(self.root, stored_kind)
+            merchant_dirs = [self._slug(merchant)] if merchant else os.listdir(kind_dir) if os.path.isdir(kind_dir) else []
+            for merchant_dir in merchant_dirs:
+                merchant_path = os.path.join(kind_dir, merchant_dir)
+                if not os.path.isdir(merchant_path):
+                    continue
+                for name in os.listdir(merchant_path):
+                    removed += self._remove(os.path.join(merchant_path, name))
+        return removed
+
+    def _path(self, kind, merchant, window, params):
+        params_digest = hashlib.blake2b(repr(params).encode("utf-8"), digest_size=8).hexdigest()
+        filename = f"{window[0]}_{window[1]}_{params_digest}.arrow"
+        return os.path.join(self.root, kind, self._slug(merchant), filename)
+
+    @staticmethod
+    def _slug(merchant):
+        return re.sub(r"[^A-Za-z0-9._-]", "_", merchant)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return 1
+        except OSError:
+            return 0
+
+@st.cache_resource
+def get_frame_store():
+    """Shared on-disk frame store, or None when pyarrow is missing or the store is disabled"""
+    if pa is None or not FRAME_STORE_DIR:
+        return None
+    # Frames from different data sources never share files
+    return FrameStore(os.path.join(FRAME_STORE_DIR, FrameStore._slug(DATA_SOURCE)))
+
+def persisted_frame(kind):
+    """Back a per-merchant data function with the on-disk frame store.
+
+    Frames are keyed by merchant, analysis window, arguments and the version of the data
+    serving the merchant, so neither a refreshed snapshot nor an edited live source reads
+    frames stored from the old data.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(merchant, *args, **kwargs):
+            store = get_frame_store()
+            if store is None:
+                return func(merchant, *args, **kwargs)
+            window = get_analysis_window()
+            params = (args, tuple(sorted(kwargs.items())), data_version(merchant))
+            df = store.load(kind, merchant, window, params)
+            if df is None:
+                df = func(merchant, *args, **kwargs)
+                store.save(kind, merchant, window, df, params)
+            return df
+        return wrapper
+    return decorator
+
+def invalidate_merchant_data(merchant=None):
+    """Drop cached frames for a merchant (or all merchants) from memory and disk"""
+    get_frame_cache().invalidate(lambda key: merchant is None or key[1][:1] == (merchant,))
+    store = get_frame_store()
+    return store.invalidate(merchant) if store is not None else 0
+
+# Segment pairs compared by the recipe analysis: (segment, opposite segment)
+SEGMENT_PAIRS = [
+    ("Without Coupon", "With Coupon"),
+    ("First Time User without Coupon", "First Time User with Coupon"),
+    ("Below Threshold", "Above Threshold"),
+    ("Below Threshold without Coupon", "Above Threshold without Coupon"),
+    ("Returning User without Coupon", "Returning User with Coupon"),
+    ("First Time User Below Threshold", "First Time User Above Threshold"),
+    ("Returning User Below Threshold", "Returning User Above Threshold")
+]
+
+# Columns a segments data source stores; everything else is derived after the fetch (add_segment_estimates,
+# prepare_segments_frame)
+SEGMENT_SOURCE_COLUMNS = [
+    'SHOP_NAME', 'TOP_DELIVERY_COUNTRY', 'SEGMENT', 'OPPOSITE_SEGMENT', 'CVR', 'OPPOSITE_CVR',
+    'DELTA_CVR_ROUND', 'SEGMENT_CHECKOUTS', 'OPPOSITE_CHECKOUTS', 'CHECKOUT_PERCENTAGE_ROUND', 'AOV_SEGMENT',
+    'ASR_SEGMENT', 'DAILY_POTENTIAL_CHECKOUTS', 'Revenue Potential (Annual)', 'SUGGESTION_TEMPLATE',
+]
+
+SEGMENT_COLUMNS = SEGMENT_SOURCE_COLUMNS + [
+    'P_VALUE', 'Q_VALUE', 'PROB_CVR_LOWER', 'CVR_SHRUNK', 'DELTA_CVR_SHRUNK', 'REVENUE_POTENTIAL_SHRUNK',
+    'REVENUE_P10', 'REVENUE_P50', 'REVENUE_P90', 'COUPON_STATE', 'THRESHOLD_SIDE', 'USER_TYPE', 'DEVICE', 'RECIPE_RULE'
+]
+
+# Compact in-memory schema for segment frames (names as categorical codes, 32-bit metrics)
+SEGMENT_DTYPES = {
+    'SHOP_NAME': "category",
+    'TOP_DELIVERY_COUNTRY': "category",
+    'SEGMENT': "category",
+    'OPPOSITE_SEGMENT': "category",
+    'CVR': np.float32,
+    'OPPOSITE_CVR': np.float32,
+    'DELTA_CVR_ROUND': np.float32,
+    'SEGMENT_CHECKOUTS': np.int32,
+    'OPPOSITE_CHECKOUTS': np.int32,
+    'CHECKOUT_PERCENTAGE_ROUND': np.float32,
+    'AOV_SEGMENT': np.float32,
+    'ASR_SEGMENT': np.float32,
+    'DAILY_POTENTIAL_CHECKOUTS': np.float32,
+    'Revenue Potential (Annual)': np.float32,
+    'SUGGESTION_TEMPLATE': np.int8,
+    'P_VALUE': np.float32,
+    'Q_VALUE': np.float32,
+    'PROB_CVR_LOWER': np.float32,
+    'CVR_SHRUNK': np.float32,
+    'DELTA_CVR_SHRUNK': np.float32,
+    'REVENUE_POTENTIAL_SHRUNK': np.float32,
+    'REVENUE_P10': np.float32,
+    'REVENUE_P50': np.float32,
+    'REVENUE_P90': np.float32,
+}
+
+# Optimization suggestions are stored as an index into this list and rendered on demand
+SUGGESTION_TEMPLATES = [
+    "Improving the conversion rate of the {segment} segment is recommended, as it is {delta_pct:.1f}% lower than "
+    "the {opposite} segment and accounts for {checkout_pct:.1f}% of total checkouts. "
+    "The potential annual revenue for this improvement is ${revenue:,.0f}",
+    "{segment} segment is optimized for conversion vs. the {opposite} segment. Consider a price-sensitivity test!",
+]
+SUGGESTION_IMPROVE_CVR, SUGGESTION_PRICE_SENSITIVITY = range(len(SUGGESTION_TEMPLATES))
+
+def render_suggestions(df):
+    """Optimization suggestion text for the given rows (only render what is displayed)"""
+    return pd.Series([
+        SUGGESTION_TEMPLATES[template].format(
+            segment=segment,
+            opposite=opposite,
+            delta_pct=abs(delta_cvr) * 100,
+            checkout_pct=checkout_pct * 100,
+            revenue=revenue
+        )
+        for template, segment, opposite, delta_cvr, checkout_pct, revenue in zip(
+            df['SUGGESTION_TEMPLATE'], df['SEGMENT'], df['OPPOSITE_SEGMENT'],
+            df['DELTA_CVR_ROUND'], df['CHECKOUT_PERCENTAGE_ROUND'], df['Revenue Potential (Annual)']
+        )
+    ], index=df.index, dtype=object)
+
+# Typed attributes encoded in segment names, attached as categorical columns at ingestion
+SEGMENT_ATTRIBUTE_CATEGORIES = {
+    'COUPON_STATE': ["with", "without"],
+    'THRESHOLD_SIDE': ["below", "above"],
+    'USER_TYPE': ["first_time", "returning"],
+    'DEVICE': ["desktop", "mobile", "tablet"],
+}
+
+def parse_segment_attributes(segment):
+    """Attributes of a segment name, e.g. "First Time User without Coupon" -> first_time / without"""
+    name = segment.lower()
+    return {
+        'COUPON_STATE': "without" if "without coupon" in name else "with" if "with coupon" in name else None,
+        'THRESHOLD_SIDE': "below" if "below threshold" in name else "above" if "above threshold" in name else None,
+        'USER_TYPE': "first_time" if "first time user" in name else "returning" if "returning user" in name else None,
+        'DEVICE': next((device for device in SEGMENT_ATTRIBUTE_CATEGORIES['DEVICE'] if device in name.split()), None),
+    }
+
+def segment_filter(segment):
+    """The attribute values a segment name pins down, e.g. {'USER_TYPE': "first_time", 'COUPON_STATE': "without"}"""
+    return {attribute: value for attribute, value in parse_segment_attributes(segment).items() if value}
+
+# Name fragments per attribute value, in the order they appear in a segment name
+SEGMENT_NAME_PARTS = {
+    'DEVICE': {"desktop": "Desktop", "mobile": "Mobile", "tablet": "Tablet"},
+    'USER_TYPE': {"first_time": "First Time User", "returning": "Returning User"},
+    'THRESHOLD_SIDE': {"below": "Below Threshold", "above": "Above Threshold"},
+    'COUPON_STATE': {"with": "with Coupon", "without": "without Coupon"},
+}
+
+def segment_name(attributes):
+    """Segment name for attribute values (inverse of parse_segment_attributes), e.g. Mobile Returning User with Coupon"""
+    name = " ".join(parts[attributes[attribute]] for attribute, parts in SEGMENT_NAME_PARTS.items() if attributes.get(attribute))
+    return name[:1].upper() + name[1:]
+
+def add_segment_attributes(df):
+    """Attach the attribute columns, parsing each distinct segment name only once"""
+    segment_codes, segment_names = pd.factorize(df['SEGMENT'])
+    parsed = [parse_segment_attributes(name) for name in segment_names]
+    for column, categories in SEGMENT_ATTRIBUTE_CATEGORIES.items():
+        # Trailing -1 maps missing segments (factorize code -1) to a missing attribute
+        codes = np.array([categories.index(p[column]) if p[column] else -1 for p in parsed] + [-1])
+        df[column] = pd.Categorical.from_codes(codes[segment_codes], categories=categories)
+    return df
+
+# Recipe rules, checked in order: the first rule whose attributes all match picks the action for a segment.
+# 'action' is the pitch-ready wording, 'card_action' the short form shown on the opportunity cards.
+# 'margin' (1 = no discount cost), 'delivery' (shipping related) and 'test_cost' (effort) score the recipe for ranking.
+RECIPE_RULES = [
+    {
+        'when': {'COUPON_STATE': "without"},
+        'action': "Add targeted discount options for {segment} customers who abandon checkout",
+        'card_action': "add targeted discount options for this segment",
+        'margin': 0.0, 'delivery': 0.0, 'test_cost': 0.6,
+    },
+    {
+        'when': {'COUPON_STATE': "with"},
+        'action': "Test different discount levels for {segment} customers",
+        'card_action': "test different discount levels",
+        'margin': 0.5, 'delivery': 0.0, 'test_cost': 0.6,
+    },
+    {
+        'when': {'THRESHOLD_SIDE': "below"},
+        'action': "Add upsell prompts showing benefits of reaching free shipping threshold",
+        'card_action': "add upsell prompts showing free shipping benefits",
+        'margin': 1.0, 'delivery': 1.0, 'test_cost': 0.3,
+    },
+    {
+        'when': {'THRESHOLD_SIDE': "above"},
+        'action': "Highlight shipping savings for {segment} customers",
+        'card_action': "highlight shipping savings",
+        'margin': 1.0, 'delivery': 1.0, 'test_cost': 0.2,
+    },
+    {
+        'when': {'USER_TYPE': "first_time"},
+        'action': "Add trust signals and simplified checkout for {segment}",
+        'card_action': "add trust signals and simplified checkout",
+        'margin': 1.0, 'delivery': 0.5, 'test_cost': 0.5,
+    },
+    {
+        'when': {'USER_TYPE': "returning"},
+        'action': "Implement one-click checkout for {segment}",
+        'card_action': "implement one-click checkout",
+        'margin': 1.0, 'delivery': 0.0, 'test_cost': 0.8,
+    },
+    # Fallback for segments no other rule matches
+    {
+        'when': {},
+        'action': "Optimize the checkout experience for {segment}",
+        'card_action': "optimize checkout experience",
+        'margin': 1.0, 'delivery': 0.0, 'test_cost': 0.5,
+    },
+]
+
+def assign_recipe_rules(df):
+    """Index of the first matching RECIPE_RULES entry for every row, evaluated column-wise"""
+    conditions = [
+        np.logical_and.reduce([(df[column] == value).to_numpy() for column, value in rule['when'].items()])
+        for rule in RECIPE_RULES[:-1]
     ]
+    return np.select(conditions, np.arange(len(conditions)), default=len(RECIPE_RULES) - 1).astype(np.int8)
+
+def recipe_action(rule, segment, short=False):
+    """Action text of a recipe rule for one segment"""
+    return RECIPE_RULES[rule]['card_action' if short else 'action'].format(segment=segment)
+
+# Significance statistics, attached where a merchant's full set of segment pairs is known (see add_significance)
+SEGMENT_STAT_COLUMNS = ['P_VALUE', 'Q_VALUE', 'PROB_CVR_LOWER']
+
+# False discovery rate the "significant opportunities" filter allows (Benjamini-Hochberg q-value cutoff)
+FDR_ALPHA = float(os.environ.get("RECIPE_FDR_ALPHA", 0.05))
+
+def normal_sf(z):
+    """Standard normal upper tail P(Z > z), accurate to ~1e-7 relative even far in the tail"""
+    x = np.abs(z) / np.sqrt(2)
+    # Chebyshev-fitted erfc (Numerical Recipes erfcc)
+    t = 1 / (1 + 0.5 * x)
+    poly = -1.26551223 + t * (1.00002368 + t * (0.37409196 + t * (0.09678418 + t * (-0.18628806 + t * (0.27886807
+        + t * (-1.13520398 + t * (1.48851587 + t * (-0.82215223 + t * 0.17087277))))))))
+    erfc = t * np.exp(-x * x + poly)
+    return np.where(z >= 0, erfc / 2, 1 - erfc / 2)
+
+def benjamini_hochberg(p_values, groups):
+    """Benjamini-Hochberg q-values, with each group (e.g. a shop) as its own family of tests"""
+    order = np.lexsort((p_values, groups))
+    sorted_p, sorted_groups = p_values[order], groups[order]
+    group_start = np.searchsorted(sorted_groups, sorted_groups, side="left")
+    group_size = np.bincount(sorted_groups)[sorted_groups]
+    raw = sorted_p * group_size / (np.arange(len(sorted_p)) - group_start + 1)
+    # Step-up: running minimum from the largest p-value down, within each group
+    stepped = pd.Series(raw[::-1]).groupby(sorted_groups[::-1]).cummin().to_numpy()[::-1]
+    q_values = np.empty_like(raw)
+    q_values[order] = np.minimum(stepped, 1.0)
+    return q_values
+
+def beta_posterior(cvr, checkouts):
+    """Mean and variance of the Beta(1 + conversions, 1 + non-conversions) posterior on a CVR"""
+    alpha, beta = 1 + cvr * checkouts, 1 + (1 - cvr) * checkouts
+    total = alpha + beta
+    return alpha / total, alpha * beta / (total * total * (total + 1))
+
+def add_significance(df):
+    """Two-proportion z-test p-values, per-shop BH q-values and Beta posterior P(CVR < opposite CVR) for every row"""
+    n1 = df['SEGMENT_CHECKOUTS'].to_numpy(dtype=np.float64)
+    n2 = df['OPPOSITE_CHECKOUTS'].to_numpy(dtype=np.float64)
+    p1 = df['CVR'].to_numpy(dtype=np.float64)
+    p2 = df['OPPOSITE_CVR'].to_numpy(dtype=np.float64)
+    
+    # Pooled two-sided z-test; a side without checkouts carries no evidence (p = 1)
+    tested = (n1 > 0) & (n2 > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pooled = (p1 * n1 + p2 * n2) / (n1 + n2)
+        se = np.sqrt(pooled * (1 - pooled) * (1 / n1 + 1 / n2))
+        z = np.where(tested & (se > 0), (p1 - p2) / se, 0.0)
+    p_values = 2 * normal_sf(np.abs(z))
+    
+    # Beta posteriors of the two CVRs, compared through a normal approximation
+    mean1, var1 = beta_posterior(p1, n1)
+    mean2, var2 = beta_posterior(p2, n2)
+    
+    df['P_VALUE'] = p_values
+    df['Q_VALUE'] = benjamini_hochberg(p_values, pd.factorize(df['SHOP_NAME'])[0])
+    df['PROB_CVR_LOWER'] = normal_sf((mean1 - mean2) / np.sqrt(var1 + var2))
+    return df
+
+# Columns shrunk toward fleet-wide priors (see shrink_segments)
+SEGMENT_SHRINKAGE_COLUMNS = ['CVR_SHRUNK', 'DELTA_CVR_SHRUNK', 'REVENUE_POTENTIAL_SHRUNK']
+
+# Cap on a prior's weight in pseudo-checkouts, reached when merchants differ no more than sampling noise explains
+MAX_PRIOR_STRENGTH = float(os.environ.get("RECIPE_MAX_PRIOR_STRENGTH", 10000))
+
+def fit_segment_priors(df):
+    """Beta prior on CVR per segment type, fitted across the frame's shops by the method of moments.
+
+    The spread of merchants' CVRs minus the binomial noise each one carries is the
+    prior's variance. A segment type seen in a single shop gets a flat (zero-weight) prior.
+    """
+    codes, names = pd.factorize(df['SEGMENT'])
+    n = df['SEGMENT_CHECKOUTS'].to_numpy(dtype=np.float64)
+    cvr = df['CVR'].to_numpy(dtype=np.float64)
+    observed = n > 0
+    codes, n, cvr = codes[observed], n[observed], cvr[observed]
+    
+    size = len(names)
+    return segment_priors_from_moments(
+        names,
+        np.bincount(codes, minlength=size),
+        np.bincount(codes, cvr, minlength=size),
+        np.bincount(codes, cvr * cvr, minlength=size),
+        np.bincount(codes, cvr * (1 - cvr) / n, minlength=size),
+    )
+
+def segment_priors_from_moments(names, count, cvr_sum, cvr_square_sum, noise_sum):
+    """Beta priors from per-segment sums over shops with checkouts (see fit_segment_priors).
+
+    Sums are enough, so a database can aggregate them without returning any rows.
+    """
+    count = np.asarray(count, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.asarray(cvr_sum, dtype=np.float64) / count
+        spread = (np.asarray(cvr_square_sum, dtype=np.float64) - count * mean * mean) / (count - 1)
+        noise = np.asarray(noise_sum, dtype=np.float64) / count
+        strength = mean * (1 - mean) / (spread - noise) - 1
+    strength = np.where(spread - noise > 0, strength, MAX_PRIOR_STRENGTH)
+    strength = np.clip(np.where(count > 1, strength, 0.0), 0.0, MAX_PRIOR_STRENGTH)
+    mean = np.nan_to_num(mean)
+    return pd.DataFrame(
+        {'PRIOR_ALPHA': mean * strength, 'PRIOR_BETA': (1 - mean) * strength},
+        index=pd.Index(np.asarray(names, dtype=object), name='SEGMENT'),
+    )
+
+def shrink_segments(df, priors=None):
+    """Posterior-mean CVRs for both sides of every pair, and the delta and revenue potential they imply.
+
+    priors defaults to a fit on the frame itself; segment types without a prior aren't shrunk.
+    """
+    if priors is None:
+        priors = fit_segment_priors(df)
+    
+    def posterior_cvr(segments, cvr, checkouts):
+        prior = priors.reindex(segments.astype(object)).fillna(0.0)
+        alpha, beta = prior['PRIOR_ALPHA'].to_numpy(), prior['PRIOR_BETA'].to_numpy()
+        n = checkouts.to_numpy(dtype=np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            shrunk = (cvr.to_numpy(dtype=np.float64) * n + alpha) / (n + alpha + beta)
+        return np.where(n + alpha + beta > 0, shrunk, cvr.to_numpy(dtype=np.float64))
+    
+    cvr = posterior_cvr(df['SEGMENT'], df['CVR'], df['SEGMENT_CHECKOUTS'])
+    opposite_cvr = posterior_cvr(df['OPPOSITE_SEGMENT'], df['OPPOSITE_CVR'], df['OPPOSITE_CHECKOUTS'])
+    
+    # Revenue potential scales with the conversion gap, so rescale it by the shrunk gap over the raw one
+    gap = (df['OPPOSITE_CVR'] - df['CVR']).to_numpy(dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = np.where(gap > 0, np.maximum(opposite_cvr - cvr, 0.0) / gap, 0.0)
+    
+    df['CVR_SHRUNK'] = cvr
+    df['DELTA_CVR_SHRUNK'] = cvr - opposite_cvr
+    df['REVENUE_POTENTIAL_SHRUNK'] = df['Revenue Potential (Annual)'].to_numpy(dtype=np.float64) * scale
+    return df
+
+# Revenue bands quoted alongside the point estimate, as (column, standard normal quantile)
+REVENUE_BANDS = [('REVENUE_P10', -1.2815515655446004), ('REVENUE_P50', 0.0), ('REVENUE_P90', 1.2815515655446004)]
+
+def add_revenue_bands(df):
+    """P10/P50/P90 of every row's revenue potential under the sampling uncertainty of its conversion gap.
+
+    Revenue potential is linear in the gap, so its quantiles are the gap's (normal, from the
+    Beta posteriors of both CVRs, floored at no uplift) rescaled by revenue over the observed gap.
+    """
+    mean, var = beta_posterior(df['CVR'].to_numpy(dtype=np.float64), df['SEGMENT_CHECKOUTS'].to_numpy(dtype=np.float64))
+    opposite_mean, opposite_var = beta_posterior(
+        df['OPPOSITE_CVR'].to_numpy(dtype=np.float64), df['OPPOSITE_CHECKOUTS'].to_numpy(dtype=np.float64)
+    )
+    gap = (df['OPPOSITE_CVR'] - df['CVR']).to_numpy(dtype=np.float64)
+    revenue = df['Revenue Potential (Annual)'].to_numpy(dtype=np.float64)
+    
+    # All rows and quantiles in one broadcast: (rows, 1) gaps against (1, bands) quantiles
+    quantiles = np.array([z for _, z in REVENUE_BANDS])
+    gaps = np.maximum(gap[:, None] + np.sqrt(var + opposite_var)[:, None] * quantiles[None, :], 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bands = np.where((gap > 0)[:, None], revenue[:, None] * gaps / gap[:, None], 0.0)
+    for position, (column, _) in enumerate(REVENUE_BANDS):
+        df[column] = bands[:, position]
+    return df
+
+def add_segment_estimates(df, priors=None):
+    """Everything derived from a merchant's raw segment pairs: significance, shrinkage and revenue bands"""
+    return add_revenue_bands(shrink_segments(add_significance(df), priors))
+
+def prepare_segments_frame(df):
+    """Ingest a segments frame from any source: attribute columns plus the compact schema"""
+    df = add_segment_attributes(df.astype(SEGMENT_DTYPES))
+    df['RECIPE_RULE'] = assign_recipe_rules(df)
+    return df
+
+def revenue_potential(delta_cvr, checkouts, aov, asr, window_days=ANALYSIS_WINDOW_DAYS):
+    """Daily potential checkouts and annual revenue potential of closing each negative conversion gap"""
+    daily_potential = np.where(delta_cvr < 0, np.round(np.abs(delta_cvr) * checkouts / window_days, 2), 0.0)
+    return daily_potential, np.round(daily_potential * (aov + asr) * 365, 0)
+
+def merchant_seed(merchant_name):
+    """Stable 64-bit seed for a merchant (same in every process, unlike hash())"""
+    digest = hashlib.blake2b(merchant_name.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+def merchant_rng(merchant_name):
+    """Fresh random Generator for a merchant, so generation never touches global NumPy state"""
+    return np.random.default_rng(merchant_seed(merchant_name))
+
+def _uniform(u, low, high):
+    """Scale [0, 1) draws exactly like Generator.uniform does"""
+    return low + (high - low) * u
+
+# Modified to use generated data instead of Snowflake queries
+def generate_fleet_segments_data(merchants, priors=None):
+    """Generate demo recipe segments for many merchants in one vectorized pass.
+
+    Rows come out merchant by merchant, pair by pair (segment row, then its
+    opposite). CVRs are shrunk toward priors, by default fitted on these merchants.
+    Suggestion text isn't rendered here; see render_suggestions.
+    """
+    merchants = list(merchants)
+    if not merchants:
+        return prepare_segments_frame(pd.DataFrame(columns=list(SEGMENT_DTYPES)))
     
-    data = []
+    n_merchants, n_pairs = len(merchants), len(SEGMENT_PAIRS)
+    
+    # Each merchant draws 4 uniforms per pair (checkout %, delta cvr, aov, asr) from its own Generator
+    draws = np.stack([merchant_rng(merchant).random((n_pairs, 4)) for merchant in merchants])
     
     # Create realistic conversion rates
     base_cvr = 0.75  # 75% base conversion rate
     
-    for segment, opposite in segment_pairs:
-        # Create realistic segment data with negative delta CVR
-        checkout_pct = round(np.random.uniform(0.2, 0.8), 2)
-        segment_checkouts = int(10000 * checkout_pct)
-        delta_cvr = round(np.random.uniform(-0.18, -0.04), 2)  # always negative for opportunities
-        cvr = base_cvr + delta_cvr
-        opposite_cvr = base_cvr
-        aov = round(np.random.uniform(80, 200), 2)
-        asr = round(np.random.uniform(5, 30), 2)
-        daily_potential = round(abs(delta_cvr) * segment_checkouts / 30, 2)
-        revenue_potential = round(daily_potential * (aov + asr) * 365, 0)
-        
-        suggestion = f"Improving the conversion rate of the {segment} segment is recommended, as it is {abs(delta_cvr)*100}% lower than the {opposite} segment and accounts for {checkout_pct*100}% of total checkouts. The potential annual revenue for this improvement is ${revenue_potential:,.0f}"
-        
-        data.append({
-            'SHOP_NAME': merchant_name,
-            'TOP_DELIVERY_COUNTRY': 'US',
-            'SEGMENT': segment,
-            'OPPOSITE_SEGMENT': opposite,
-            'CVR': cvr,
-            'OPPOSITE_CVR': opposite_cvr,
-            'DELTA_CVR_ROUND': delta_cvr,
-            'SEGMENT_CHECKOUTS': segment_checkouts,
-            'CHECKOUT_PERCENTAGE_ROUND': checkout_pct,
-            'AOV_SEGMENT': aov,
-            'ASR_SEGMENT': asr,
-            'DAILY_POTENTIAL_CHECKOUTS': daily_potential,
-            'Revenue Potential (Annual)': revenue_potential,
-            'OPTIMIZATION_SUGGESTION': suggestion
-        })
-        
-        # Also create the opposite relationship with positive delta CVR (price sensitivity test)
-        checkout_pct_opp = round(1 - checkout_pct, 2)
-        segment_checkouts_opp = int(10000 * checkout_pct_opp)
-        delta_cvr_opp = abs(delta_cvr)  # positive delta
-        cvr_opp = base_cvr + delta_cvr_opp
-        
-        suggestion_opp = f"{opposite} segment is optimized for conversion vs. the {segment} segment. Consider a price-sensitivity test!"
-        
-        data.append({
-            'SHOP_NAME': merchant_name,
-            'TOP_DELIVERY_COUNTRY': 'US',
-            'SEGMENT': opposite,
-            'OPPOSITE_SEGMENT': segment,
-            'CVR': cvr_opp,
-            'OPPOSITE_CVR': cvr,
-            'DELTA_CVR_ROUND': delta_cvr_opp,
-            'SEGMENT_CHECKOUTS': segment_checkouts_opp,
-            'CHECKOUT_PERCENTAGE_ROUND': checkout_pct_opp,
-            'AOV_SEGMENT': aov * 1.1,  # slightly higher
-            'ASR_SEGMENT': asr * 0.9,  # slightly lower
-            'DAILY_POTENTIAL_CHECKOUTS': 0, # no potential for price sensitivity
-            'Revenue Potential (Annual)': 0, # no potential for price sensitivity
-            'OPTIMIZATION_SUGGESTION': suggestion_opp
-        })
+    # Segment side: negative delta CVR (conversion opportunity)
+    checkout_pct = np.round(_uniform(draws[..., 0], 0.2, 0.8), 2)
+    segment_checkouts = (10000 * checkout_pct).astype(np.int64)
+    delta_cvr = np.round(_uniform(draws[..., 1], -0.18, -0.04), 2)  # always negative for opportunities
+    cvr = base_cvr + delta_cvr
+    aov = np.round(_uniform(draws[..., 2], 80, 200), 2)
+    asr = np.round(_uniform(draws[..., 3], 5, 30), 2)
+    daily_potential, revenue = revenue_potential(delta_cvr, segment_checkouts, aov, asr)
+    
+    # Opposite side: positive delta CVR (price sensitivity test)
+    checkout_pct_opp = np.round(1 - checkout_pct, 2)
+    segment_checkouts_opp = (10000 * checkout_pct_opp).astype(np.int64)
+    cvr_opp = base_cvr + np.abs(delta_cvr)
+    
+    def interleave(segment_values, opposite_values):
+        shape = (n_merchants, n_pairs)
+        pair_values = [np.broadcast_to(segment_values, shape), np.broadcast_to(opposite_values, shape)]
+        return np.stack(pair_values, axis=-1).reshape(-1)
+    
+    # Names are stored as categorical codes, so no per-row strings are materialized
+    shop_codes, shop_names = pd.factorize(pd.Series(merchants))
+    pair_names = [pair[0] for pair in SEGMENT_PAIRS] + [pair[1] for pair in SEGMENT_PAIRS]
+    pair_codes, segment_names = pd.factorize(pd.Series(pair_names))
+    segment_codes, opposite_codes = pair_codes[:n_pairs], pair_codes[n_pairs:]
+    zeros = np.zeros((n_merchants, n_pairs))
+    
+    df = pd.DataFrame({
+        'SHOP_NAME': pd.Categorical.from_codes(np.repeat(shop_codes, 2 * n_pairs), categories=shop_names),
+        'TOP_DELIVERY_COUNTRY': 'US',
+        'SEGMENT': pd.Categorical.from_codes(interleave(segment_codes, opposite_codes), categories=segment_names),
+        'OPPOSITE_SEGMENT': pd.Categorical.from_codes(interleave(opposite_codes, segment_codes), categories=segment_names),
+        'CVR': interleave(cvr, cvr_opp),
+        'OPPOSITE_CVR': interleave(np.full_like(cvr, base_cvr), cvr),
+        'DELTA_CVR_ROUND': interleave(delta_cvr, np.abs(delta_cvr)),
+        'SEGMENT_CHECKOUTS': interleave(segment_checkouts, segment_checkouts_opp),
+        'OPPOSITE_CHECKOUTS': interleave(segment_checkouts_opp, segment_checkouts),
+        'CHECKOUT_PERCENTAGE_ROUND': interleave(checkout_pct, checkout_pct_opp),
+        'AOV_SEGMENT': interleave(aov, aov * 1.1),  # opposite slightly higher
+        'ASR_SEGMENT': interleave(asr, asr * 0.9),  # opposite slightly lower
+        'DAILY_POTENTIAL_CHECKOUTS': interleave(daily_potential, zeros),  # no potential for price sensitivity
+        'Revenue Potential (Annual)': interleave(revenue, zeros),
+        'SUGGESTION_TEMPLATE': interleave(SUGGESTION_IMPROVE_CVR, SUGGESTION_PRICE_SENSITIVITY),
+    })
     
-    return pd.DataFrame(data)
+    return prepare_segments_frame(add_segment_estimates(df, priors))
+
+@cached_frame
+def fleet_segment_priors():
+    """CVR priors per segment type, fitted across the whole merchant fleet"""
+    return fit_segment_priors(generate_fleet_segments_data(get_merchants()))
+
+def source_segment_priors():
+    """CVR priors per segment type, fitted across every merchant of the live data source"""
+    return get_live_data_source().segment_priors()
+
+@cached_frame
+def generate_segments_data(merchant_name):
+    """Generate realistic demo recipe segments data"""
+    return generate_fleet_segments_data([merchant_name], priors=fleet_segment_priors())
+
+# Days of daily history kept per merchant, ending today; any date range inside it can be analysed
+HISTORY_DAYS = int(os.environ.get("RECIPE_HISTORY_DAYS", 91))
+
+# Relative daily checkout volume by weekday (Monday first)
+WEEKDAY_VOLUME = np.array([0.95, 0.95, 1.0, 1.0, 1.05, 1.1, 0.95])
+
+# Daily measures kept for both sides of every segment pair
+ROLLUP_MEASURES = ['SEGMENT_CHECKOUTS', 'SEGMENT_CONVERSIONS', 'OPPOSITE_CHECKOUTS', 'OPPOSITE_CONVERSIONS']
+
+class SegmentDailyRollup:
+    """Cumulative daily checkouts and conversions for every segment pair of one merchant.
+
+    cumulative[d] holds the totals of all days before day d, so any date range is
+    the difference of two lookups, whatever its length.
+    """
+
+    def __init__(self, segments, first_day, daily):
+        self.segments = pd.Index(segments, name='SEGMENT')
+        self.first_day = first_day
+        self.cumulative = np.concatenate([np.zeros((1,) + daily.shape[1:], dtype=np.int64), daily.cumsum(axis=0)])
+
+    @property
+    def days(self):
+        return len(self.cumulative) - 1
+
+    @property
+    def nbytes(self):
+        return self.cumulative.nbytes
+
+    def span(self, start, end):
+        """Day positions [first, stop) covering the dates start..end (inclusive), clipped to the history"""
+        first = min(max((start - self.first_day).days, 0), self.days)
+        stop = min(max((end - self.first_day).days + 1, first), self.days)
+        return first, stop
+
+    def totals(self, start, end):
+        """Per-segment totals of every measure over the dates start..end (inclusive)"""
+        first, stop = self.span(start, end)
+        return pd.DataFrame(self.cumulative[stop] - self.cumulative[first], index=self.segments, columns=ROLLUP_MEASURES)
+
+def synthesize_segment_history(segments_df, rng, last_day, days=HISTORY_DAYS, window_days=ANALYSIS_WINDOW_DAYS):
+    """Demo daily history with one series per segment, giving both sides of every row that mentions it.
+
+    Each segment's last window_days days add up exactly to its totals in the opportunity
+    (negative delta) row that quotes it, so windowed deltas keep the stored rows' convention.
+    """
+    weekday = np.array([(last_day - timedelta(days=offset)).weekday() for offset in range(days - 1, -1, -1)])
+    volume = WEEKDAY_VOLUME[weekday]
+    recent, earlier = volume[-window_days:], volume[:-window_days]
+    
+    # Both sides of every row as (segment, checkouts, cvr), opportunity rows first so they win on duplicates
+    opportunity = segments_df['DELTA_CVR_ROUND'].to_numpy(dtype=np.float64) < 0
+    sides = pd.DataFrame({
+        'SEGMENT': np.concatenate([segments_df['SEGMENT'].astype(str), segments_df['OPPOSITE_SEGMENT'].astype(str)]),
+        'CHECKOUTS': np.concatenate([segments_df['SEGMENT_CHECKOUTS'], segments_df['OPPOSITE_CHECKOUTS']]).astype(np.int64),
+        'CVR': np.concatenate([segments_df['CVR'], segments_df['OPPOSITE_CVR']]).astype(np.float64),
+        'OPPORTUNITY': np.concatenate([opportunity, opportunity]),
+    })
+    totals = sides.sort_values('OPPORTUNITY', ascending=False, kind="stable").drop_duplicates('SEGMENT')
+    checkouts = totals['CHECKOUTS'].to_numpy()
+    conversions = np.round(totals['CVR'].to_numpy() * checkouts).astype(np.int64)
+    rate = np.divide(conversions, checkouts, out=np.zeros(len(checkouts)), where=checkouts > 0)
+    
+    # The analysis window splits the known totals across its days...
+    window_checkouts = rng.multinomial(checkouts, recent / recent.sum())
+    window_conversions = np.array([
+        rng.multivariate_hypergeometric(day_checkouts, total) for day_checkouts, total in zip(window_checkouts, conversions)
+    ]).reshape(window_checkouts.shape)
+    # ...and the days before it continue at the same volume and conversion rate
+    earlier_checkouts = rng.poisson(checkouts[:, None] / window_days * earlier[None, :])
+    earlier_conversions = rng.binomial(earlier_checkouts, rate[:, None])
+    series = np.stack([
+        np.concatenate([earlier_checkouts, window_checkouts], axis=1).T,
+        np.concatenate([earlier_conversions, window_conversions], axis=1).T,
+    ], axis=-1)  # (days, segments, checkouts/conversions)
+    
+    positions = pd.Index(totals['SEGMENT']).get_indexer(sides['SEGMENT'])
+    rows = len(segments_df)
+    return np.concatenate([series[:, positions[:rows]], series[:, positions[rows:]]], axis=-1)
+
+def window_segments_frame(segments_df, totals, window_days):
+    """A segments frame with its window metrics recomputed from rollup totals (indexed by SEGMENT)"""
+    df = segments_df.copy()
+    totals = totals.reindex(df['SEGMENT'].astype(str)).fillna(0)
+    checkouts = totals['SEGMENT_CHECKOUTS'].to_numpy(dtype=np.float64)
+    opposite_checkouts = totals['OPPOSITE_CHECKOUTS'].to_numpy(dtype=np.float64)
+    cvr = np.divide(totals['SEGMENT_CONVERSIONS'].to_numpy(dtype=np.float64), checkouts, out=np.zeros(len(df)), where=checkouts > 0)
+    opposite_cvr = np.divide(
+        totals['OPPOSITE_CONVERSIONS'].to_numpy(dtype=np.float64), opposite_checkouts, out=np.zeros(len(df)), where=opposite_checkouts > 0
+    )
+    pair_checkouts = checkouts + opposite_checkouts
+    delta_cvr = np.round(cvr - opposite_cvr, 2) + 0.0  # no -0.0
+    
+    df['CVR'] = cvr
+    df['OPPOSITE_CVR'] = opposite_cvr
+    df['DELTA_CVR_ROUND'] = delta_cvr
+    df['SEGMENT_CHECKOUTS'] = checkouts
+    df['OPPOSITE_CHECKOUTS'] = opposite_checkouts
+    df['CHECKOUT_PERCENTAGE_ROUND'] = np.round(np.divide(checkouts, pair_checkouts, out=np.zeros(len(df)), where=pair_checkouts > 0), 2)
+    df['DAILY_POTENTIAL_CHECKOUTS'], df['Revenue Potential (Annual)'] = revenue_potential(
+        delta_cvr, checkouts, df['AOV_SEGMENT'].to_numpy(dtype=np.float64), df['ASR_SEGMENT'].to_numpy(dtype=np.float64), window_days
+    )
+    df['SUGGESTION_TEMPLATE'] = np.where(delta_cvr < 0, SUGGESTION_IMPROVE_CVR, SUGGESTION_PRICE_SENSITIVITY)
+    return prepare_segments_frame(add_segment_estimates(df, source_segment_priors()))
+
+# Shipping service tiers, strongest first: a title mentioning several tiers gets the first one listed
+SHIPPING_TIERS = ["premium", "economy", "free", "standard"]
+
+# Tier keywords as normalized token sequences (casefolded, accents stripped), across the languages merchants use
+SHIPPING_TIER_KEYWORDS = {
+    "premium": [
+        "express", "priority", "next day", "overnight", "same day", "expedited", "rush", "24h", "48h",
+        "expres", "expresso", "prioritaire", "prioritario", "urgente", "rapido", "rapide", "eilversand",
+        "schnellversand", "express versand", "dia siguiente", "jour suivant", "nachster tag", "naechster tag", "spoed",
+    ],
+    "economy": [
+        "economy", "economic", "eco", "budget", "saver", "economique", "economico", "economica",
+        "sparversand", "ahorro", "lento", "langsam",
+    ],
+    "free": [
+        "free", "gratuit", "gratuite", "gratis", "gratuito", "gratuita", "kostenlos", "kostenloser", "omaggio",
+    ],
+    "standard": [
+        "standard", "regular", "normal", "ground", "standardversand", "estandar", "normale", "standaard",
+    ],
+}
+
+def normalize_shipping_title(title):
+    """Canonical token form of a shipping method title, e.g. "Envío EXPRÉS 24h" -> ("envio", "expres", "24h")"""
+    decomposed = unicodedata.normalize("NFKD", title.casefold())
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return tuple(re.findall(r"[^\W_]+", stripped))
+
+def _build_keyword_trie(keywords):
+    """Token trie mapping keyword token sequences to the strongest tier (as an index into SHIPPING_TIERS)"""
+    trie = {}
+    for tier, phrases in keywords.items():
+        for phrase in phrases:
+            node = trie
+            for token in normalize_shipping_title(phrase):
+                node = node.setdefault(token, {})
+            node[None] = min(node.get(None, len(SHIPPING_TIERS)), SHIPPING_TIERS.index(tier))
+    return trie
+
+SHIPPING_KEYWORD_TRIE = _build_keyword_trie(SHIPPING_TIER_KEYWORDS)
+
+@functools.lru_cache(maxsize=65536)
+def classify_shipping_title(title):
+    """Service tier of a raw shipping method title (titles with no keyword are standard)"""
+    tokens = normalize_shipping_title(title)
+    best = SHIPPING_TIERS.index("standard")
+    # Walk the trie from every token; keywords are a few tokens long, so this stays linear in the title
+    for start in range(len(tokens)):
+        node = SHIPPING_KEYWORD_TRIE
+        for token in tokens[start:]:
+            node = node.get(token)
+            if node is None:
+                break
+            best = min(best, node.get(None, best))
+    return SHIPPING_TIERS[best]
+
+def classify_shipping_titles(titles):
+    """Service tier for a column of titles, classifying each distinct title once"""
+    codes, uniques = pd.factorize(titles)
+    tier_codes = np.array([SHIPPING_TIERS.index(classify_shipping_title(title)) for title in uniques] + [-1], dtype=np.int8)
+    return pd.Categorical.from_codes(tier_codes[codes], categories=SHIPPING_TIERS)
 
 # Generate shipping demo data
+@cached_frame
 def generate_shipping_data(merchant_name):
     """Generate realistic shipping promise data"""
-    np.random.seed(hash(merchant_name) % 100)  # For reproducible results
+    rng = merchant_rng(merchant_name)  # For reproducible results
     
     shipping_methods = [
         "Standard Shipping (3-5 business days)",
@@ -427,27 +1261,28 @@ def generate_shipping_data(merchant_name):
     
     for method in shipping_methods:
         # Customize based on shipping method
-        if "Express" in method or "Priority" in method or "Next Day" in method:
+        tier = classify_shipping_title(method)
+        if tier == "premium":
             # Premium shipping - usually accurate
-            tp80 = round(np.random.uniform(-0.5, 0.5), 1)
-            median = round(np.random.uniform(-0.3, 0.3), 1)
-            records = int(np.random.uniform(100, 500))
-        elif "Free" in method or "Economy" in method:
+            tp80 = round(rng.uniform(-0.5, 0.5), 1)
+            median = round(rng.uniform(-0.3, 0.3), 1)
+            records = int(rng.uniform(100, 500))
+        elif tier in ("free", "economy"):
             # Free/Economy shipping - usually too conservative
-            tp80 = round(np.random.uniform(0.5, 2.0), 1)
-            median = round(np.random.uniform(0.3, 1.0), 1)
-            records = int(np.random.uniform(1000, 3000))
+            tp80 = round(rng.uniform(0.5, 2.0), 1)
+            median = round(rng.uniform(0.3, 1.0), 1)
+            records = int(rng.uniform(1000, 3000))
         else:
             # Standard shipping - slightly conservative
-            tp80 = round(np.random.uniform(0.2, 1.2), 1)
-            median = round(np.random.uniform(0.1, 0.8), 1)
-            records = int(np.random.uniform(800, 2000))
+            tp80 = round(rng.uniform(0.2, 1.2), 1)
+            median = round(rng.uniform(0.1, 0.8), 1)
+            records = int(rng.uniform(800, 2000))
             
-        promises_val = int(np.random.choice([3, 4, 5, 7]))
+        promises_val = int(rng.choice([3, 4, 5, 7]))
         
         data.append({
             'S_SHOP_NAME': merchant_name,
-            'S_SHOP_ID': f"shop_{np.random.randint(10000, 99999)}",
+            'S_SHOP_ID': f"shop_{rng.integers(10000, 99999)}",
             'O_SHIPPING_METHOD_TITLE': method,
             'CALCULATED_PROMISES_VAL': promises_val,
             'TP80_DIFF': tp80,
@@ -459,20 +1294,531 @@ def generate_shipping_data(merchant_name):
     for method in ["Standard Shipping", "Free Standard Shipping", "Shipping"]:
         data.append({
             'S_SHOP_NAME': merchant_name,
-            'S_SHOP_ID': f"shop_{np.random.randint(10000, 99999)}",
+            'S_SHOP_ID': f"shop_{rng.integers(10000, 99999)}",
             'O_SHIPPING_METHOD_TITLE': method,
             'CALCULATED_PROMISES_VAL': None,
             'TP80_DIFF': None,
             'MEDIAN_DIFF': None,
-            'RECORD_COUNT': int(np.random.uniform(500, 2500))
+            'RECORD_COUNT': int(rng.uniform(500, 2500))
         })
+    methods = pd.DataFrame(data)
     
-    return pd.DataFrame(data)
+    # Synthesize the shipments behind these numbers and measure them the way real records are
+    shipping = DeliverySketches().update(synthesize_shipments(methods, rng)).to_frame()
+    shipping.insert(1, 'S_SHOP_ID', shipping['O_SHIPPING_METHOD_TITLE'].map(dict(zip(methods['O_SHIPPING_METHOD_TITLE'], methods['S_SHOP_ID']))))
+    return shipping
+
+def process_pool_context():
+    """Prefer fork so workers start without re-importing the module (spawned workers re-import it, which only loads the engine)"""
+    return multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+
+# Shipping promise rows, as produced by every shipping data source
+SHIPPING_COLUMNS = [
+    'S_SHOP_NAME', 'S_SHOP_ID', 'O_SHIPPING_METHOD_TITLE', 'CALCULATED_PROMISES_VAL',
+    'TP80_DIFF', 'MEDIAN_DIFF', 'RECORD_COUNT', 'ON_TIME_RATE', 'OPTIMAL_PROMISE_VAL'
+]
+
+# Share of shipments a suggested promise has to deliver on time
+PROMISE_ON_TIME_TARGET = float(os.environ.get("RECIPE_PROMISE_ON_TIME_TARGET", 0.80))
+
+# Raw shipment records: one row per delivered order (PROMISED_DAYS is missing when the method has no promise)
+SHIPMENT_COLUMNS = ['S_SHOP_NAME', 'O_SHIPPING_METHOD_TITLE', 'PROMISED_DAYS', 'ACTUAL_DAYS']
+SHIPMENT_TEXT_COLUMNS = ['S_SHOP_NAME', 'O_SHIPPING_METHOD_TITLE']
+
+# Rows read per chunk when streaming record files (bounds ingestion memory)
+INGEST_CHUNK_ROWS = int(os.environ.get("RECIPE_INGEST_CHUNK_ROWS", 1_000_000))
+
+# Delivery sketches bucket lateness (actual - promised days) at a fixed resolution; anything beyond the range
+# lands in the edge buckets, so quantiles are exact to the resolution within +/- SKETCH_RANGE_DAYS
+SKETCH_RESOLUTION_DAYS = 0.1
+SKETCH_RANGE_DAYS = 30
+SKETCH_BINS = int(round(2 * SKETCH_RANGE_DAYS / SKETCH_RESOLUTION_DAYS)) + 1
+SKETCH_MAX_PROMISE_DAYS = 60
+
+# Helpers for count arrays with an axis per key type (delivery sketches, segment cube), where keys arrive chunk by chunk
+def key_positions(index, keys):
+    """Positions of keys in an index dict (key -> position), adding unseen keys at the end"""
+    for key in keys:
+        if key not in index:
+            index[key] = len(index)
+    return np.array([index[key] for key in keys], dtype=np.int64)
+
+def reserve(values, sizes):
+    """values, or a zero-padded copy if any axis is shorter than its size in sizes (None leaves an axis alone).
+
+    Axes grow to at least double their length, so adding keys chunk by chunk copies
+    the array O(log keys) times instead of once per chunk.
+    """
+    padding = [(0, 0 if size is None or size <= length else max(size, 2 * length) - length) for size, length in zip(sizes, values.shape)]
+    return np.pad(values, padding) if any(after for _, after in padding) else values
+
+def add_counts(values, flat, weights=None):
+    """Add weighted counts at flat (raveled) positions of values in one bincount, instead of a Python loop per record"""
+    values += np.bincount(flat, weights=weights, minlength=values.size).reshape(values.shape).astype(values.dtype)
+
+def add_block(values, index, block):
+    """values[index] += block for an index with distinct positions on every axis (so plain fancy-index adds are safe)"""
+    values[index] += block
+
+class DeliverySketches:
+    """Per-(shop, method) lateness histograms built from shipment chunks; shards combine with merge()"""
+    
+    def __init__(self):
+        self.index = {}  # (shop, method) -> row in the arrays below
+        # Buffers with spare rows (see reserve); the properties below are the rows in use
+        self._lateness = np.zeros((0, SKETCH_BINS), dtype=np.int64)
+        self._promises = np.zeros((0, SKETCH_MAX_PROMISE_DAYS + 1), dtype=np.int64)
+        self._records = np.zeros(0, dtype=np.int64)
+    
+    @property
+    def lateness(self):
+        return self._lateness[:len(self.index)]
+    
+    @property
+    def promises(self):
+        return self._promises[:len(self.index)]
+    
+    @property
+    def records(self):
+        return self._records[:len(self.index)]
+    
+    def _rows(self, keys):
+        """Array rows for the given (shop, method) keys, adding rows for unseen ones"""
+        rows = key_positions(self.index, keys)
+        size = len(self.index)
+        self._lateness = reserve(self._lateness, (size, None))
+        self._promises = reserve(self._promises, (size, None))
+        self._records = reserve(self._records, (size,))
+        return rows
+    
+    def update(self, chunk):
+        """Add a chunk of shipment records"""
+        if chunk.empty:
+            return self
+        key_codes, keys = pd.MultiIndex.from_arrays(
+            [chunk['S_SHOP_NAME'], chunk['O_SHIPPING_METHOD_TITLE']]
+        ).factorize()
+        rows = self._rows(list(keys))[key_codes]
+        add_counts(self.records, rows)
+        
+        promised = chunk['PROMISED_DAYS'].to_numpy(dtype=np.float64)
+        actual = chunk['ACTUAL_DAYS'].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(promised) & ~np.isnan(actual)
+        rows, promised, actual = rows[valid], promised[valid], actual[valid]
+        
+        bins = np.clip(np.rint((actual - promised + SKETCH_RANGE_DAYS) / SKETCH_RESOLUTION_DAYS), 0, SKETCH_BINS - 1).astype(np.int64)
+        add_counts(self.lateness, rows * SKETCH_BINS + bins)
+        promise_days = np.clip(np.rint(promised), 0, SKETCH_MAX_PROMISE_DAYS).astype(np.int64)
+        add_counts(self.promises, rows * (SKETCH_MAX_PROMISE_DAYS + 1) + promise_days)
+        return self
+    
+    def merge(self, other):
+        """Fold another shard's sketches into this one"""
+        rows = self._rows(list(other.index))
+        add_block(self.lateness, rows, other.lateness)
+        add_block(self.promises, rows, other.promises)
+        add_block(self.records, rows, other.records)
+        return self
+    
+    def quantiles(self, q):
+        """Lateness (days) at quantile q for every key, NaN for keys without promised shipments"""
+        totals = self.lateness.sum(axis=1)
+        cumulative = np.cumsum(self.lateness, axis=1)
+        # First bucket whose cumulative count reaches q of the total
+        buckets = (cumulative < np.ceil(q * totals)[:, None]).sum(axis=1)
+        values = np.round(buckets * SKETCH_RESOLUTION_DAYS - SKETCH_RANGE_DAYS, 1)
+        return np.where(totals > 0, values, np.nan)
+    
+    def on_time_rates(self):
+        """Share of each key's promised shipments delivered within their promise, NaN without data"""
+        totals = self.lateness.sum(axis=1)
+        on_time = self.lateness[:, :int(round(SKETCH_RANGE_DAYS / SKETCH_RESOLUTION_DAYS)) + 1].sum(axis=1)
+        return np.where(totals > 0, on_time / np.maximum(totals, 1), np.nan)
+    
+    def optimal_promises(self, target=PROMISE_ON_TIME_TARGET):
+        """Tightest whole-day promise per key that still delivers `target` of shipments on time, NaN without data"""
+        totals = self.lateness.sum(axis=1)
+        promise = self.promises.argmax(axis=1)
+        cumulative = np.cumsum(self.lateness, axis=1)
+        # On-time rate of every candidate promise for every key at once, read off the lateness CDF:
+        # promising `candidate` days means a shipment is on time when its lateness <= candidate - current promise.
+        # The last bucket also holds everything later than the range, so it never counts as on time
+        candidates = np.arange(1, SKETCH_MAX_PROMISE_DAYS + 1)
+        offsets = candidates[None, :] - promise[:, None]
+        buckets = np.clip(np.rint((offsets + SKETCH_RANGE_DAYS) / SKETCH_RESOLUTION_DAYS).astype(np.int64), 0, SKETCH_BINS - 2)
+        on_time = np.take_along_axis(cumulative, buckets, axis=1) / np.maximum(totals, 1)[:, None]
+        on_time[offsets < -SKETCH_RANGE_DAYS] = 0.0
+        meets_target = on_time >= target
+        return np.where((totals > 0) & meets_target.any(axis=1), candidates[meets_target.argmax(axis=1)], np.nan)
+    
+    def to_frame(self, target=PROMISE_ON_TIME_TARGET):
+        """Shipping promise rows in the same schema as the shipping data sources"""
+        keys = list(self.index)
+        has_promise = self.promises.sum(axis=1) > 0
+        return pd.DataFrame({
+            'S_SHOP_NAME': [shop for shop, _ in keys],
+            'O_SHIPPING_METHOD_TITLE': [method for _, method in keys],
+            # The promise a method is usually sold with
+            'CALCULATED_PROMISES_VAL': np.where(has_promise, self.promises.argmax(axis=1), np.nan),
+            # Days early (promised - actual): 80% of shipments arrive at most TP80_DIFF days early
+            'TP80_DIFF': 0.0 - self.quantiles(0.2),
+            'MEDIAN_DIFF': 0.0 - self.quantiles(0.5),
+            'RECORD_COUNT': self.records,
+            'ON_TIME_RATE': self.on_time_rates(),
+            'OPTIMAL_PROMISE_VAL': self.optimal_promises(target),
+        })
+
+def synthesize_shipments(methods, rng):
+    """Demo shipment records whose days early follow each method's MEDIAN_DIFF and TP80_DIFF"""
+    counts = methods['RECORD_COUNT'].to_numpy()
+    median = methods['MEDIAN_DIFF'].to_numpy(dtype=np.float64)
+    p80 = methods['TP80_DIFF'].to_numpy(dtype=np.float64)
+    # Normal days early through the given median and 80th percentile (z = 0.8416), never degenerate
+    spread = np.maximum(np.abs(p80 - median) / 0.8416, 0.2)
+    promised = np.repeat(methods['CALCULATED_PROMISES_VAL'].to_numpy(dtype=np.float64), counts)
+    early = np.repeat(median, counts) + np.repeat(spread, counts) * rng.standard_normal(counts.sum())
+    return pd.DataFrame({
+        'S_SHOP_NAME': np.repeat(methods['S_SHOP_NAME'].to_numpy(), counts),
+        'O_SHIPPING_METHOD_TITLE': np.repeat(methods['O_SHIPPING_METHOD_TITLE'].to_numpy(), counts),
+        'PROMISED_DAYS': promised,
+        'ACTUAL_DAYS': np.round(promised - early, 1),
+    })
+
+def record_columns(path):
+    """Column names of a CSV or Parquet record file"""
+    if path.endswith(".parquet") and pa is None:
+        raise RuntimeError("reading Parquet record files requires pyarrow")
+    return set(pq.ParquetFile(path).schema_arrow.names if path.endswith(".parquet") else pd.read_csv(path, nrows=0).columns)
+
+def iter_record_chunks(path, columns, text_columns, chunksize=INGEST_CHUNK_ROWS, optional_columns=()):
+    """Read the given columns of a CSV or Parquet record file in bounded-size chunks.
+
+    optional_columns may be absent from the file; they come back as missing values.
+    """
+    available = record_columns(path)
+    missing = [column for column in columns if column not in available]
+    required = [column for column in missing if column not in optional_columns]
+    if required:
+        raise ValueError(f"{path} is missing columns: {', '.join(required)}")
+    present = [column for column in columns if column in available]
+    
+    if path.endswith(".parquet"):
+        chunks = (batch.to_pandas() for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=present))
+    else:
+        # Only numeric columns can be missing; text like "None" or "NA" (a title, Namibia) is kept as written
+        na_values = {column: ["", "NA", "NaN", "nan", "null"] for column in present if column not in text_columns}
+        chunks = pd.read_csv(
+            path, usecols=present, chunksize=chunksize,
+            dtype={column: str for column in present if column in text_columns}, keep_default_na=False, na_values=na_values
+        )
+    for chunk in chunks:
+        yield chunk.reindex(columns=columns) if missing else chunk
+
+def sketch_shipments(path, chunksize=INGEST_CHUNK_ROWS):
+    """Delivery sketches for one shipment file (one shard)"""
+    sketches = DeliverySketches()
+    for chunk in iter_record_chunks(path, SHIPMENT_COLUMNS, SHIPMENT_TEXT_COLUMNS, chunksize):
+        sketches.update(chunk)
+    return sketches
+
+def aggregate_shipments(paths, workers=None, chunksize=INGEST_CHUNK_ROWS):
+    """Shipping promise rows from shipment files, sketching each file in parallel and merging the shards"""
+    sketches = DeliverySketches()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=process_pool_context()) as pool:
+        for shard in pool.map(sketch_shipments, paths, [chunksize] * len(paths)):
+            sketches.merge(shard)
+    return sketches.to_frame()
+
+# Raw checkout events: one row per checkout, tagged with the segment attributes it falls into
+CHECKOUT_EVENT_COLUMNS = [
+    'SHOP_NAME', 'USER_TYPE', 'COUPON_STATE', 'THRESHOLD_SIDE', 'DEVICE', 'DELIVERY_COUNTRY',
+    'CONVERTED', 'ORDER_VALUE', 'SHIPPING_REVENUE'
+]
+CHECKOUT_EVENT_TEXT_COLUMNS = [
+    'SHOP_NAME', 'USER_TYPE', 'COUPON_STATE', 'THRESHOLD_SIDE', 'DEVICE', 'DELIVERY_COUNTRY', 'DISCOUNT_CODE'
+]
+# Older event files predate device tracking
+CHECKOUT_EVENT_OPTIONAL_COLUMNS = ['DEVICE']
+# Untagged event files can carry the raw checkout fields a segment attribute is derived from instead:
+# prior orders of the customer, the discount code applied (blank when none), and the cart value
+# against the shop's free shipping threshold
+CHECKOUT_EVENT_TAG_SOURCES = {
+    'USER_TYPE': ['CUSTOMER_PRIOR_ORDERS'],
+    'COUPON_STATE': ['DISCOUNT_CODE'],
+    'THRESHOLD_SIDE': ['CART_VALUE', 'FREE_SHIPPING_THRESHOLD'],
+}
+
+def checkout_event_columns(path):
+    """Columns to read from an event file and which of them may be missing: each tag, or the raw fields it is derived from"""
+    available = record_columns(path)
+    columns, optional = list(CHECKOUT_EVENT_COLUMNS), list(CHECKOUT_EVENT_OPTIONAL_COLUMNS)
+    for tag, sources in CHECKOUT_EVENT_TAG_SOURCES.items():
+        if tag not in available and all(source in available for source in sources):
+            columns += sources
+            optional.append(tag)
+    return columns, optional
+
+def tag_checkout_events(chunk):
+    """Derive segment attributes from raw checkout fields for events that aren't tagged with them.
+
+    Events whose raw fields are missing (e.g. a shop without a free shipping threshold) stay
+    untagged, and the segment cube skips them.
+    """
+    derived = {}
+    if 'CUSTOMER_PRIOR_ORDERS' in chunk:
+        prior = chunk['CUSTOMER_PRIOR_ORDERS'].to_numpy(dtype=np.float64)
+        derived['USER_TYPE'] = np.where(np.isnan(prior), None, np.where(prior > 0, "returning", "first_time"))
+    if 'DISCOUNT_CODE' in chunk:
+        has_code = chunk['DISCOUNT_CODE'].fillna("").str.strip() != ""
+        derived['COUPON_STATE'] = np.where(has_code, "with", "without")
+    if 'CART_VALUE' in chunk and 'FREE_SHIPPING_THRESHOLD' in chunk:
+        cart = chunk['CART_VALUE'].to_numpy(dtype=np.float64)
+        threshold = chunk['FREE_SHIPPING_THRESHOLD'].to_numpy(dtype=np.float64)
+        derived['THRESHOLD_SIDE'] = np.where(
+            np.isnan(cart) | np.isnan(threshold), None, np.where(cart >= threshold, "above", "below")
+        )
+    for tag, values in derived.items():
+        tagged = chunk[tag].notna().to_numpy()
+        chunk[tag] = np.where(tagged, chunk[tag].to_numpy(dtype=object), values.astype(object))
+    return chunk
+
+# Segment cube axes: shop, every segment attribute, then delivery country (countries are discovered from the events)
+CUBE_DIMENSIONS = list(SEGMENT_ATTRIBUTE_CATEGORIES)
+# Axis labels per dimension. A missing or unrecognized device lands in an "unknown" bucket, which rolls up
+# into every segment that doesn't name a device; events with other unknown attributes are skipped
+CUBE_UNKNOWN = "unknown"
+CUBE_CATEGORIES = {
+    dim: SEGMENT_ATTRIBUTE_CATEGORIES[dim] + ([CUBE_UNKNOWN] if dim in CHECKOUT_EVENT_OPTIONAL_COLUMNS else [])
+    for dim in CUBE_DIMENSIONS
+}
+CUBE_MEASURES = ['CHECKOUTS', 'CONVERSIONS', 'ORDER_VALUE', 'SHIPPING_REVENUE']
+
+class SegmentCube:
+    """Checkout measures for every (shop, attribute values..., country) cell, built from event chunks.
+
+    Rollups and slices over any dimensions are answered from the cube without rescanning
+    events; shards from parallel workers combine with merge().
+    """
+    
+    def __init__(self):
+        self.shops = {}  # shop -> position on the shop axis
+        self.countries = {}  # country -> position on the country axis
+        shape = (0, *(len(CUBE_CATEGORIES[dim]) for dim in CUBE_DIMENSIONS), 0)
+        # Buffers with spare shops and countries (see reserve); measures are the parts in use
+        self._buffers = {
+            'CHECKOUTS': np.zeros(shape, dtype=np.int64),
+            'CONVERSIONS': np.zeros(shape, dtype=np.int64),
+            'ORDER_VALUE': np.zeros(shape),
+            'SHIPPING_REVENUE': np.zeros(shape),
+        }
+    
+    @property
+    def measures(self):
+        return {name: values[:len(self.shops), ..., :len(self.countries)] for name, values in self._buffers.items()}
+    
+    @property
+    def shape(self):
+        return self.measures['CHECKOUTS'].shape
+    
+    def axes(self):
+        """(name, labels) for every axis of the measure arrays"""
+        return (
+            [('SHOP_NAME', np.array(list(self.shops), dtype=object))]
+            + [(dim, np.array(CUBE_CATEGORIES[dim], dtype=object)) for dim in CUBE_DIMENSIONS]
+            + [('DELIVERY_COUNTRY', np.array(list(self.countries), dtype=object))]
+        )
+    
+    def _grow(self):
+        """Make room in the buffers for shops and countries seen since the last update"""
+        sizes = (len(self.shops), *[None] * len(CUBE_DIMENSIONS), len(self.countries))
+        self._buffers = {name: reserve(values, sizes) for name, values in self._buffers.items()}
+    
+    def update(self, chunk):
+        """Add a chunk of checkout events in one grouped pass (see CUBE_CATEGORIES for unknown attribute values)"""
+        # Mixed-radix cell index over the attribute dimensions
+        cells = np.zeros(len(chunk), dtype=np.int64)
+        valid = np.ones(len(chunk), dtype=bool)
+        for dim in CUBE_DIMENSIONS:
+            categories = CUBE_CATEGORIES[dim]
+            codes = pd.Index(categories).get_indexer(chunk[dim])
+            if CUBE_UNKNOWN in categories:
+                codes = np.where(codes >= 0, codes, categories.index(CUBE_UNKNOWN))
+            cells = cells * len(categories) + codes
+            valid &= codes >= 0
+        chunk, cells = chunk[valid], cells[valid]
+        if chunk.empty:
+            return self
+        
+        shop_codes, shops = pd.factorize(chunk['SHOP_NAME'])
+        country_codes, countries = pd.factorize(chunk['DELIVERY_COUNTRY'].fillna(""))
+        rows = key_positions(self.shops, list(shops))[shop_codes]
+        country_positions = key_positions(self.countries, list(countries))[country_codes]
+        self._grow()
+        
+        n_cells = int(np.prod(self.shape[1:-1]))
+        flat = (rows * n_cells + cells) * self.shape[-1] + country_positions
+        converted = chunk['CONVERTED'].fillna(0).to_numpy(dtype=np.float64) > 0
+        weights = {
+            'CHECKOUTS': None,
+            'CONVERSIONS': converted.astype(np.float64),
+            'ORDER_VALUE': np.where(converted, chunk['ORDER_VALUE'].fillna(0).to_numpy(dtype=np.float64), 0.0),
+            'SHIPPING_REVENUE': np.where(converted, chunk['SHIPPING_REVENUE'].fillna(0).to_numpy(dtype=np.float64), 0.0),
+        }
+        for name, values in self.measures.items():
+            add_counts(values, flat, weights[name])
+        return self
+    
+    def merge(self, other):
+        """Fold another shard's cube into this one"""
+        rows = key_positions(self.shops, list(other.shops))
+        countries = key_positions(self.countries, list(other.countries))
+        self._grow()
+        index = np.ix_(rows, *(np.arange(size) for size in self.shape[1:-1]), countries)
+        other_measures = other.measures
+        for name, values in self.measures.items():
+            add_block(values, index, other_measures[name])
+        return self
+    
+    def rolled(self, by=(), where=None):
+        """Measure arrays summed over every axis except the shop axis and `by`, after slicing with where={dim: value(s)}"""
+        where = where or {}
+        axes = self.axes()
+        index = [
+            np.flatnonzero(np.isin(labels, np.atleast_1d(where[name]))) if name in where else np.arange(len(labels))
+            for name, labels in axes
+        ]
+        summed = tuple(position for position, (name, _) in enumerate(axes) if position and name not in by)
+        kept = [(name, labels[positions]) for (name, labels), positions in zip(axes, index) if name == 'SHOP_NAME' or name in by]
+        return kept, {name: values[np.ix_(*index)].sum(axis=summed) for name, values in self.measures.items()}
+    
+    def rollup(self, by=(), where=None):
+        """Per-shop rollup over the `by` dimensions (any of CUBE_DIMENSIONS and DELIVERY_COUNTRY), as a frame"""
+        kept, measures = self.rolled(by, where)
+        df = pd.MultiIndex.from_product([labels for _, labels in kept], names=[name for name, _ in kept]).to_frame(index=False)
+        for name, values in measures.items():
+            df[name] = values.reshape(-1)
+        conversions = np.maximum(df['CONVERSIONS'], 1)
+        df['CVR'] = df['CONVERSIONS'] / np.maximum(df['CHECKOUTS'], 1)
+        df['AOV'] = df['ORDER_VALUE'] / conversions
+        df['ASR'] = df['SHIPPING_REVENUE'] / conversions
+        shop_checkouts = self.measures['CHECKOUTS'].sum(axis=tuple(range(1, len(self.shape))))
+        df['CHECKOUT_SHARE'] = df['CHECKOUTS'] / np.maximum(shop_checkouts, 1)[df['SHOP_NAME'].map(self.shops).to_numpy()]
+        return df
+    
+    def to_frame(self, pairs=SEGMENT_PAIRS, window_days=ANALYSIS_WINDOW_DAYS):
+        """Segment-vs-opposite rows for every shop, in the same schema (and pair order) as the segment data sources"""
+        shop_names = list(self.shops)
+        if not shop_names or not pairs:
+            return prepare_segments_frame(pd.DataFrame(columns=list(SEGMENT_DTYPES)))
+        
+        # Each named segment is a slice of the cube on the attributes its name carries
+        names = list(dict.fromkeys(name for pair in pairs for name in pair))
+        rolled = [self.rolled(['DELIVERY_COUNTRY'], segment_filter(name))[1] for name in names]
+        by_country = {measure: np.stack([values[measure] for values in rolled], axis=1) for measure in CUBE_MEASURES}
+        checkouts, conversions, order_value, shipping_revenue = (by_country[measure].sum(axis=2) for measure in CUBE_MEASURES)
+        top_country = np.array(list(self.countries), dtype=object)[by_country['CHECKOUTS'].argmax(axis=2)]
+        
+        cvr = conversions / np.maximum(checkouts, 1)
+        aov = np.round(order_value / np.maximum(conversions, 1), 2)
+        asr = np.round(shipping_revenue / np.maximum(conversions, 1), 2)
+        shop_checkouts = self.measures['CHECKOUTS'].sum(axis=tuple(range(1, len(self.shape))))
+        checkout_pct = np.round(checkouts / np.maximum(shop_checkouts, 1)[:, None], 2)
+        
+        # Each pair yields a segment row then an opposite row, like the generators
+        order = np.array([names.index(name) for pair in pairs for name in pair])
+        opposite_order = np.array([names.index(name) for pair in pairs for name in reversed(pair)])
+        delta_cvr = np.round(cvr[:, order] - cvr[:, opposite_order], 2) + 0.0  # no -0.0
+        segment_checkouts = checkouts[:, order]
+        daily_potential, revenue = revenue_potential(delta_cvr, segment_checkouts, aov[:, order], asr[:, order], window_days)
+        
+        names = np.array(names, dtype=object)
+        df = pd.DataFrame({
+            'SHOP_NAME': np.repeat(shop_names, len(order)),
+            'TOP_DELIVERY_COUNTRY': top_country[:, order].reshape(-1),
+            'SEGMENT': np.tile(names[order], len(shop_names)),
+            'OPPOSITE_SEGMENT': np.tile(names[opposite_order], len(shop_names)),
+            'CVR': cvr[:, order].reshape(-1),
+            'OPPOSITE_CVR': cvr[:, opposite_order].reshape(-1),
+            'DELTA_CVR_ROUND': delta_cvr.reshape(-1),
+            'SEGMENT_CHECKOUTS': segment_checkouts.reshape(-1),
+            'OPPOSITE_CHECKOUTS': checkouts[:, opposite_order].reshape(-1),
+            'CHECKOUT_PERCENTAGE_ROUND': checkout_pct[:, order].reshape(-1),
+            'AOV_SEGMENT': aov[:, order].reshape(-1),
+            'ASR_SEGMENT': asr[:, order].reshape(-1),
+            'DAILY_POTENTIAL_CHECKOUTS': daily_potential.reshape(-1),
+            'Revenue Potential (Annual)': revenue.reshape(-1),
+            'SUGGESTION_TEMPLATE': np.where(delta_cvr < 0, SUGGESTION_IMPROVE_CVR, SUGGESTION_PRICE_SENSITIVITY).reshape(-1),
+        })
+        return prepare_segments_frame(add_segment_estimates(df))
+
+def cube_event_file(path, chunksize=INGEST_CHUNK_ROWS):
+    """Segment cube for one event file (one shard), tagging events from their raw checkout fields where needed"""
+    cube = SegmentCube()
+    columns, optional = checkout_event_columns(path)
+    for chunk in iter_record_chunks(path, columns, CHECKOUT_EVENT_TEXT_COLUMNS, chunksize, optional):
+        cube.update(tag_checkout_events(chunk))
+    return cube
+
+def build_segment_cube(paths, workers=None, chunksize=INGEST_CHUNK_ROWS):
+    """Segment cube over checkout event files, building each file's cube in parallel and merging the shards"""
+    cube = SegmentCube()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=process_pool_context()) as pool:
+        for shard in pool.map(cube_event_file, paths, [chunksize] * len(paths)):
+            cube.merge(shard)
+    return cube
+
+def mine_segment_pairs(cube, threshold_pct=0.15, k=100, window_days=ANALYSIS_WINDOW_DAYS):
+    """Top-k opportunities across the cube's shops, discovered among segment pairs that differ in one attribute.
+
+    Apriori-style: a context (fixed attribute values) grows by one attribute per level, and a context
+    whose checkout share is below threshold_pct in every shop is dropped along with all its extensions,
+    since adding attributes can only shrink a segment. Only the best k rows are kept between levels,
+    and each row's Q_VALUE controls the false discovery rate among the pairs its level tested.
+    """
+    shop_checkouts = np.maximum(cube.measures['CHECKOUTS'].sum(axis=tuple(range(1, len(cube.shape)))), 1)
+    # Shares are compared before CHECKOUT_PERCENTAGE_ROUND rounds them, so allow for the rounding
+    min_share = threshold_pct - 0.005
+    
+    def frequent(filters):
+        return (cube.rolled(where=filters)[1]['CHECKOUTS'] / shop_checkouts >= min_share).any()
+    
+    best = cube.to_frame(pairs=[])
+    contexts = [{}]
+    while contexts:
+        pairs, extensions = [], []
+        for context in contexts:
+            last = max((CUBE_DIMENSIONS.index(dim) for dim in context), default=-1)
+            for position, dim in enumerate(CUBE_DIMENSIONS):
+                if dim in context:
+                    continue
+                sides = [dict(context, **{dim: value}) for value in SEGMENT_ATTRIBUTE_CATEGORIES[dim]]
+                kept = [frequent(side) for side in sides]
+                pairs += [
+                    (segment_name(sides[i]), segment_name(sides[j]))
+                    for i in range(len(sides)) for j in range(i + 1, len(sides)) if kept[i] or kept[j]
+                ]
+                # Extend only with later dimensions so every context is visited once
+                if position > last:
+                    extensions += [side for side, keep in zip(sides, kept) if keep]
+        
+        if pairs:
+            rows = cube.to_frame(pairs=pairs, window_days=window_days)
+            rows = rows[
+                (rows['CHECKOUT_PERCENTAGE_ROUND'] >= np.array(threshold_pct, dtype=rows['CHECKOUT_PERCENTAGE_ROUND'].dtype))
+                & (rows['DELTA_CVR_ROUND'] < 0) & (rows['REVENUE_POTENTIAL_SHRUNK'] > 0)
+            ]
+            candidates = prepare_segments_frame(pd.concat([best, rows], ignore_index=True))
+            best = candidates.iloc[top_k_positions(candidates['REVENUE_POTENTIAL_SHRUNK'].to_numpy(dtype=np.float64), k)]
+        contexts = extensions
+    
+    return best.reset_index(drop=True)
 
 # Generate test history data
+@cached_frame
+@persisted_frame("test_history")
 def generate_test_history(merchant_name, segment_type=None):
     """Generate realistic test history data"""
-    np.random.seed(hash(merchant_name) % 100)  # Use merchant name as seed for consistency
+    rng = merchant_rng(merchant_name)  # Use merchant name as seed for consistency
     
     # Base segments for tests
     test_segments = [
@@ -497,12 +1843,12 @@ def generate_test_history(merchant_name, segment_type=None):
     
     data = []
     for segment in test_segments:
-        test_start = today - timedelta(days=np.random.randint(30, 90))
-        test_end = test_start + timedelta(days=np.random.randint(10, 25))
-        test_cvr = round(0.65 + np.random.uniform(0.02, 0.08), 2)
+        test_start = today - timedelta(days=int(rng.integers(30, 90)))
+        test_end = test_start + timedelta(days=int(rng.integers(10, 25)))
+        test_cvr = round(0.65 + rng.uniform(0.02, 0.08), 2)
         control_cvr = round(0.65, 2)
         lift_pct = round((test_cvr / control_cvr - 1) * 100, 1)
-        segment_size = round(np.random.uniform(25, 45))
+        segment_size = round(rng.uniform(25, 45))
         
         data.append({
             'Segment': segment,
@@ -517,194 +1863,734 @@ def generate_test_history(merchant_name, segment_type=None):
     
     return pd.DataFrame(data)
 
-# Replace Snowflake query functions with data generation ones
-def fetch_recipe_segments(merchant, threshold_pct=0.15, significance=0.02, country=None, goal=None):
-    """Generate and filter recipe segments data based on parameters"""
-    # Generate base data
-    df = generate_segments_data(merchant)
-    
-    # Apply filters
-    df = df[df['CHECKOUT_PERCENTAGE_ROUND'] >= threshold_pct]
+def filter_segments(df, threshold_pct=0.15, significance=0.02, country=None, goal=None):
+    """Apply the dashboard filters to a segments frame and order it by revenue potential"""
+    # Apply filters (cast to the column dtype so float32 values compare exactly, e.g. 0.57 >= 0.57)
+    pct_type = df['CHECKOUT_PERCENTAGE_ROUND'].dtype.type
+    df = df[df['CHECKOUT_PERCENTAGE_ROUND'] >= pct_type(threshold_pct)]
     
+    # Significant = a practically large difference that also survives false discovery rate control
     if significance > 0:
-        df = df[abs(df['DELTA_CVR_ROUND']) >= significance]
+        delta_type = df['DELTA_CVR_ROUND'].dtype.type
+        df = df[(abs(df['DELTA_CVR_ROUND']) >= delta_type(significance)) & (df['Q_VALUE'] <= np.float32(FDR_ALPHA))]
     
     if country and country != "All":
         df = df[df['TOP_DELIVERY_COUNTRY'] == country]
     
     # Apply goal filters
-    if goal:
-        if goal == "top-line":
-            df = df[df['OPTIMIZATION_SUGGESTION'].str.contains('Improving the conversion rate')]
-        elif goal == "margin":
-            df = df[(df['SEGMENT'].str.contains('with Coupon')) & (df['DELTA_CVR_ROUND'] < 0)]
-        elif goal == "no-discount":
-            df = df[(df['SEGMENT'].str.contains('without Coupon')) & (df['DELTA_CVR_ROUND'] < 0)]
-        elif goal == "fast-delivery":
-            df = df[((df['SEGMENT'].str.contains('Below Threshold')) | 
-                   (df['SEGMENT'].str.contains('First Time User'))) & 
-                  (df['DELTA_CVR_ROUND'] < 0)]
-    
-    # Order by revenue potential
-    df = df.sort_values(by="Revenue Potential (Annual)", ascending=False)
+    if goal in GOAL_FILTERS:
+        df = df[GOAL_FILTERS[goal](df)]
     
-    return df
+    # Order by revenue potential (stable, so a result derived from a broader one orders ties the same way)
+    return df.sort_values(by="Revenue Potential (Annual)", ascending=False, kind="stable")
 
-def fetch_shipping_promises(merchant):
-    """Generate shipping promise data"""
-    return generate_shipping_data(merchant)
+def filters_subsume(broader, narrower):
+    """Whether every row passing the narrower (threshold, significance, country, goal) filters passes the broader ones"""
+    threshold, significance, country, goal = broader
+    narrow_threshold, narrow_significance, narrow_country, narrow_goal = narrower
+    return (
+        threshold <= narrow_threshold
+        and (significance <= 0 or 0 < significance <= narrow_significance)
+        and (not country or country == "All" or country == narrow_country)
+        and (goal not in GOAL_FILTERS or goal == narrow_goal)
+    )
 
-# Function to create actionable recommendations based on segments
-def generate_recommendations(segments_df, goal):
-    """Generate personalized, actionable recommendations"""
-    if segments_df.empty:
-        return []
-    
-    recommendations = []
-    
-    # Sort by revenue potential and get top opportunities
-    segments_df = segments_df.sort_values(by="Revenue Potential (Annual)", ascending=False)
-    top_segments = segments_df.head(3)
-    
-    for _, row in top_segments.iterrows():
-        segment = row['SEGMENT']
-        opposite = row['OPPOSITE_SEGMENT']
-        delta_cvr = row['DELTA_CVR_ROUND']
-        revenue = row['Revenue Potential (Annual)']
-        checkout_pct = row['CHECKOUT_PERCENTAGE_ROUND']
-        
-        # Skip positive conversion segments (price sensitivity tests)
-        if delta_cvr >= 0 or revenue <= 0:
-            continue
-            
-        # Create recommendation
-        rec = {
-            'segment': segment,
-            'revenue': revenue,
-            'delta_cvr': delta_cvr,
-            'checkout_pct': checkout_pct,
-            'opposite': opposite,
-            'explanation': f"The {segment} segment has a {abs(delta_cvr*100):.1f}% lower conversion rate than the {opposite} segment and represents {checkout_pct*100:.1f}% of your checkout traffic."
-        }
-        
-        # Determine specific action based on segment
-        if "Coupon" in segment:
-            if "without Coupon" in segment:
-                rec['specific_action'] = f"Add targeted discount options for {segment} customers who abandon checkout"
-            else:
-                rec['specific_action'] = f"Test different discount levels for {segment} customers"
-        elif "Threshold" in segment:
-            if "Below Threshold" in segment:
-                rec['specific_action'] = f"Add upsell prompts showing benefits of reaching free shipping threshold"
-            else:
-                rec['specific_action'] = f"Highlight shipping savings for {segment} customers"
-        elif "First Time User" in segment:
-            rec['specific_action'] = f"Add trust signals and simplified checkout for {segment}"
-        elif "Returning User" in segment:
-            rec['specific_action'] = f"Implement one-click checkout for {segment}"
-        else:
-            rec['specific_action'] = f"Optimize the checkout experience for {segment}"
-        
-        # Personalization based on merchant goal
-        if goal == "top-line":
-            rec['personalization'] = "This recipe directly increases top-line revenue by improving conversion in a high-volume segment."
-        elif goal == "margin":
-            rec['personalization'] = "This recipe balances conversion optimization with margin preservation, avoiding unnecessary discounting."
-        elif goal == "no-discount":
-            rec['personalization'] = "This recipe improves conversion through UX improvements instead of relying on discounts."
-        elif goal == "fast-delivery":
-            rec['personalization'] = "This recipe enhances delivery experience perception to increase checkout conversion."
-        else:
-            rec['personalization'] = "This recipe provides a balanced approach to improving checkout conversion."
-            
-        # Create seasonality explanation
-        monthly_distribution = [0.07, 0.08, 0.08, 0.08, 0.08, 0.08, 0.08, 0.08, 0.09, 0.09, 0.10, 0.09]
-        rec['seasonality'] = {
-            'Q1': f"${revenue * (monthly_distribution[0] + monthly_distribution[1] + monthly_distribution[2]):.0f}",
-            'Q2': f"${revenue * (monthly_distribution[3] + monthly_distribution[4] + monthly_distribution[5]):.0f}",
-            'Q3': f"${revenue * (monthly_distribution[6] + monthly_distribution[7] + monthly_distribution[8]):.0f}",
-            'Q4': f"${revenue * (monthly_distribution[9] + monthly_distribution[10] + monthly_distribution[11]):.0f}",
-        }
-        
-        # Craft a ready-to-copy message with specific action steps
-        rec['message'] = f"Based on your checkout data, we recommend testing a recipe for the {segment} segment, which could drive ${revenue:,.0f} in annual uplift by improving conversion by {abs(delta_cvr*100):.1f}%. ACTION: {rec['specific_action']}."
+class SegmentWhatIfIndex:
+    """Answers any (threshold, significance) filter over one merchant's segments by binary search.
+
+    Checkout shares and |delta CVR| are rounded, so rows fall into a small grid of buckets;
+    suffix sums over that grid give each filter's counts and revenue with two searchsorted
+    calls. Rows are also kept sorted by checkout share, so a filter's rows are a suffix slice.
+    """
+
+    MEASURES = ['total', 'conversion', 'sensitivity', 'revenue']
+
+    def __init__(self, df):
+        self.df = df
+        self.share = df['CHECKOUT_PERCENTAGE_ROUND'].to_numpy()
+        delta = df['DELTA_CVR_ROUND'].to_numpy()
+        self.magnitude = np.abs(delta)
+        self.significant = df['Q_VALUE'].to_numpy() <= np.float32(FDR_ALPHA)
+        self.share_levels = np.unique(self.share)
+        self.magnitude_levels = np.unique(self.magnitude)
+        self.by_share = np.argsort(self.share, kind="stable")
         
-        recommendations.append(rec)
+        values = [
+            np.ones(len(df)), (delta < 0).astype(np.float64), (delta > 0).astype(np.float64),
+            df['Revenue Potential (Annual)'].to_numpy(dtype=np.float64),
+        ]
+        share_bucket = np.searchsorted(self.share_levels, self.share)
+        magnitude_bucket = np.searchsorted(self.magnitude_levels, self.magnitude)
+        shape = (len(self.share_levels) + 1, len(self.magnitude_levels) + 1)
+        cell = (share_bucket * shape[1] + magnitude_bucket)[self.significant]
         
-    return recommendations
+        # Suffix sums: [i] covers every share >= level i; [i, j] also needs |delta| >= level j and FDR control
+        self.all_rows = np.stack([
+            np.bincount(share_bucket, value, minlength=shape[0])[::-1].cumsum()[::-1] for value in values
+        ])
+        self.significant_rows = np.stack([
+            np.bincount(cell, value[self.significant], minlength=shape[0] * shape[1]).reshape(shape)
+            [::-1, ::-1].cumsum(axis=0).cumsum(axis=1)[::-1, ::-1]
+            for value in values
+        ])
 
-# Function to analyze shipping data and generate recommendations
-def generate_shipping_recommendations(shipping_df):
-    """Generate shipping recommendations based on shipping data"""
-    if shipping_df.empty:
-        return []
-    
-    recommendations = []
-    
-    # Handle methods with promises
-    methods_with_promises = shipping_df[shipping_df['CALCULATED_PROMISES_VAL'].notna()]
-    for _, row in methods_with_promises.iterrows():
-        method = row['O_SHIPPING_METHOD_TITLE']
-        tp80 = row.get('TP80_DIFF', 0)
-        median = row.get('MEDIAN_DIFF', 0)
-        count = row.get('RECORD_COUNT', 0)
-        promise = row.get('CALCULATED_PROMISES_VAL')
-        
-        # Determine specific action based on metrics
-        if tp80 >= 1:
-            action = f"Reduce delivery promise from {promise} days to {max(1, int(promise - 1))} days"
-            explanation = f"Shipments using '{method}' are delivered {tp80:.1f} days faster than promised (80th percentile)."
-            status = "opportunity"
-        elif tp80 > 0:
-            action = f"Consider tightening promise by 0.5 days"
-            explanation = f"Shipments using '{method}' are delivered slightly faster ({tp80:.1f} days) than promised."
-            status = "good"
-        elif tp80 < -1:
-            action = f"Extend delivery promise from {promise} days to {int(promise + 1)} days"
-            explanation = f"Shipments using '{method}' are delivered {abs(tp80):.1f} days slower than promised (80th percentile)."
-            status = "warning"
-        else:
-            action = "Keep current promise"
-            explanation = f"The current promise for '{method}' is accurate."
-            status = "accurate"
-            
-        recommendations.append({
-            'method': method,
-            'tp80_diff': tp80,
-            'median_diff': median,
-            'record_count': count,
-            'calculated_promise': promise,
-            'action': action,
-            'explanation': explanation,
-            'status': status,
-            'has_promise': True
-        })
-    
-    # Handle methods without promises
-    methods_without_promises = shipping_df[shipping_df['CALCULATED_PROMISES_VAL'].isna()]
-    for _, row in methods_without_promises.iterrows():
-        method = row['O_SHIPPING_METHOD_TITLE']
-        count = row.get('RECORD_COUNT', 0)
-        
-        # Suggest adding promise based on method name
-        suggested_days = 0
-        if "Express" in method or "Priority" in method or "Next Day" in method:
-            suggested_days = 2
-        elif "Economy" in method:
-            suggested_days = 5
+    @property
+    def nbytes(self):
+        return int(self.df.memory_usage(deep=True).sum()) + self.all_rows.nbytes + self.significant_rows.nbytes
+
+    def _level(self, levels, value):
+        # Cast to the column dtype so float32 values compare exactly, as in filter_segments
+        return np.searchsorted(levels, levels.dtype.type(value), side="left")
+
+    def summary(self, threshold_pct, significance):
+        """Opportunity counts and total revenue potential of the rows the filter keeps"""
+        share_level = self._level(self.share_levels, threshold_pct)
+        if significance > 0:
+            totals = self.significant_rows[:, share_level, self._level(self.magnitude_levels, significance)]
         else:
-            suggested_days = 3
-            
-        recommendations.append({
-            'method': method,
-            'record_count': count,
-            'action': f"Add a {suggested_days}-day delivery promise",
-            'explanation': f"'{method}' has no delivery promise. Adding one could improve conversion.",
-            'status': "missing",
-            'has_promise': False
-        })
-    
-    return sorted(recommendations, key=lambda x: 0 if not x.get('has_promise', True) else (-1 if x.get('status') == 'opportunity' else 1))
+            totals = self.all_rows[:, share_level]
+        return dict(zip(self.MEASURES, totals.tolist()))
+
+    def segments(self, threshold_pct, significance):
+        """The rows filter_segments keeps for these filters, still ordered by revenue potential"""
+        positions = self.by_share[self._level(self.share[self.by_share], threshold_pct):]
+        if significance > 0:
+            keep = self.significant[positions] & (self.magnitude[positions] >= self.magnitude.dtype.type(significance))
+            positions = positions[keep]
+        return self.df.iloc[np.sort(positions)]
+
+# Merchant goals the dashboard can align recommendations with
+GOAL_OPTIONS = {
+    "all": "all opportunities",
+    "top-line": "increase top-line revenue",
+    "margin": "protect contribution margin",
+    "no-discount": "minimize discount usage",
+    "fast-delivery": "optimize delivery expectations"
+}
+
+# Default sidebar filters (also what the precomputed snapshot is built with)
+DEFAULT_THRESHOLD_PCT = 0.15
+DEFAULT_SIGNIFICANCE = 0.02
+
+# Goal filters as masks over the segment attribute columns
+GOAL_FILTERS = {
+    "top-line": lambda df: df['DELTA_CVR_ROUND'] < 0,
+    "margin": lambda df: (df['COUPON_STATE'] == "with") & (df['DELTA_CVR_ROUND'] < 0),
+    "no-discount": lambda df: (df['COUPON_STATE'] == "without") & (df['DELTA_CVR_ROUND'] < 0),
+    "fast-delivery": lambda df: ((df['THRESHOLD_SIDE'] == "below") | (df['USER_TYPE'] == "first_time")) & (df['DELTA_CVR_ROUND'] < 0),
+}
+
+class GeneratedDataSource:
+    """Demo data source: generates frames in-process and filters them in pandas"""
+
+    def fetch_segments(self, merchant, threshold_pct, significance, country, goal):
+        return filter_segments(generate_segments_data(merchant), threshold_pct, significance, country, goal)
+
+    def fetch_shipping(self, merchant):
+        return generate_shipping_data(merchant)
+
+    def segment_priors(self):
+        return fleet_segment_priors()
+
+    def watermark(self, merchant):
+        """Generated data only changes with the code, and such changes bump SCHEMA_VERSION (retiring every snapshot)"""
+        return "generated"
+
+    def daily_history(self, merchant, segments_df, last_day):
+        """Demo daily history consistent with the merchant's stored analysis-window totals"""
+        rng = np.random.default_rng([merchant_seed(merchant), 1])  # separate stream from the segment generator
+        return synthesize_segment_history(segments_df, rng, last_day)
+
+class SQLiteDataSource:
+    """Warehouse stand-in on SQLite with a pool of reusable connections.
+
+    Only the merchant's raw rows (SEGMENT_SOURCE_COLUMNS) are read; significance, shrinkage
+    and revenue bands need the merchant's full set of pairs, so they and the dashboard
+    filters are applied after the fetch. A database without segments and shipping tables
+    is seeded from the generators; an existing one is never overwritten.
+    """
+
+    # Data tables and the column holding each row's merchant
+    TABLE_COLUMNS = {'segments': SEGMENT_SOURCE_COLUMNS, 'shipping': SHIPPING_COLUMNS}
+    SHOP_COLUMNS = {'segments': "SHOP_NAME", 'shipping': "S_SHOP_NAME"}
+
+    def __init__(self, path, pool_size=4):
+        self.path = path
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._priors = None  # (fleet version, priors)
+        with self.connection() as conn:
+            tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if not tables & set(self.TABLE_COLUMNS):
+            self.seed(get_merchants())
+        else:
+            with self.connection() as conn:
+                for table, required in self.TABLE_COLUMNS.items():
+                    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+                    missing = [column for column in required if column not in columns]
+                    if missing:
+                        raise ValueError(f"{path}: table {table} is missing columns: {', '.join(missing)}")
+        self.epoch = self.track_changes()
+
+    def track_changes(self):
+        """Install triggers that count every change to a merchant's rows, and return the database's epoch.
+
+        The epoch is random per database, so a replaced database never reuses an old watermark.
+        """
+        statements = [
+            "CREATE TABLE IF NOT EXISTS merchant_versions (SHOP_NAME TEXT PRIMARY KEY, VERSION INTEGER NOT NULL)",
+            "CREATE TABLE IF NOT EXISTS source_meta (KEY TEXT PRIMARY KEY, VALUE TEXT NOT NULL)",
+            "INSERT OR IGNORE INTO source_meta VALUES ('epoch', lower(hex(randomblob(8))))",
+        ]
+        for table, shop_column in self.SHOP_COLUMNS.items():
+            for event, rows in [("INSERT", ["NEW"]), ("DELETE", ["OLD"]), ("UPDATE", ["OLD", "NEW"])]:
+                bumps = "".join(
+                    f"INSERT INTO merchant_versions VALUES ({row}.{shop_column}, 1) "
+                    "ON CONFLICT (SHOP_NAME) DO UPDATE SET VERSION = VERSION + 1; "
+                    for row in rows
+                )
+                statements.append(
+                    f"CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_version AFTER {event} ON {table} "
+                    f"BEGIN {bumps}END"
+                )
+        with self.connection() as conn:
+            for statement in statements:
+                conn.execute(statement)
+            conn.commit()
+            return conn.execute("SELECT VALUE FROM source_meta WHERE KEY = 'epoch'").fetchone()[0]
+
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection, opening a new one if the pool is empty"""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            yield conn
+        finally:
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def seed(self, merchants):
+        """Create and load the segments and shipping tables from the demo generators"""
+        segments = generate_fleet_segments_data(merchants)[SEGMENT_SOURCE_COLUMNS]
+        # Store exact decimals rather than widened float32 values
+        float_columns = segments.select_dtypes(np.float32).columns
+        segments[float_columns] = segments[float_columns].astype(np.float64).round(4)
+        shipping = pd.concat([generate_shipping_data(merchant) for merchant in merchants], ignore_index=True)
+        with self.connection() as conn:
+            segments.to_sql("segments", conn, if_exists="fail", index=False)
+            shipping.to_sql("shipping", conn, if_exists="fail", index=False)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_segments_shop ON segments (SHOP_NAME)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_shipping_shop ON shipping (S_SHOP_NAME)")
+            conn.commit()
+
+    def fetch_segments(self, merchant, threshold_pct, significance, country, goal):
+        columns = ", ".join(f'"{column}"' for column in SEGMENT_SOURCE_COLUMNS)
+        with self.connection() as conn:
+            df = pd.read_sql_query(f"SELECT {columns} FROM segments WHERE SHOP_NAME = ? ORDER BY rowid", conn, params=[merchant])
+        df = prepare_segments_frame(add_segment_estimates(df, self.segment_priors()))
+        return filter_segments(df, threshold_pct, significance, country, goal)
+
+    def segment_priors(self):
+        """CVR priors fitted across every shop in the database, aggregated in SQL (refitted only after changes)"""
+        with self.connection() as conn:
+            version = conn.execute("SELECT total(VERSION), count(*) FROM merchant_versions").fetchone()
+        if self._priors is not None and self._priors[0] == version:
+            return self._priors[1]
+        query = (
+            "SELECT SEGMENT, count(*), total(CVR), total(CVR * CVR), total(CVR * (1 - CVR) / SEGMENT_CHECKOUTS) "
+            "FROM segments WHERE SEGMENT_CHECKOUTS > 0 GROUP BY SEGMENT ORDER BY min(rowid)"
+        )
+        with self.connection() as conn:
+            rows = conn.execute(query).fetchall()
+        names, count, cvr_sum, cvr_square_sum, noise_sum = (list(column) for column in zip(*rows)) if rows else ([],) * 5
+        priors = segment_priors_from_moments(names, count, cvr_sum, cvr_square_sum, noise_sum)
+        self._priors = (version, priors)
+        return priors
+
+    def fetch_shipping(self, merchant):
+        with self.connection() as conn:
+            return pd.read_sql_query("SELECT * FROM shipping WHERE S_SHOP_NAME = ?", conn, params=[merchant])
+
+    def watermark(self, merchant):
+        """The merchant's change count (kept by the triggers from track_changes), so checking costs one lookup"""
+        with self.connection() as conn:
+            row = conn.execute("SELECT VERSION FROM merchant_versions WHERE SHOP_NAME = ?", [merchant]).fetchone()
+        return f"{self.epoch}:{row[0] if row else 0}"
+
+# Data source selection: "generated" (default) or "sqlite:<path to database>"
+DATA_SOURCE = os.environ.get("RECIPE_DATA_SOURCE", "generated")
+
+@st.cache_resource
+def get_live_data_source():
+    """Shared live data source for all reruns and sessions (keeps its connection pool alive)"""
+    if DATA_SOURCE.startswith("sqlite:"):
+        return SQLiteDataSource(DATA_SOURCE[len("sqlite:"):])
+    return GeneratedDataSource()
+
+# Replace Snowflake query functions with data generation ones
+@cached_frame
+def fetch_recipe_segments(merchant, threshold_pct=0.15, significance=0.02, country=None, goal=None):
+    """Fetch recipe segments matching the filters, ordered by revenue potential.
+
+    A cached result for broader filters (e.g. a lower threshold, or all goals) is narrowed
+    down in memory instead of querying the data source again.
+    """
+    filters = (threshold_pct, significance, country, goal)
+    broader = get_frame_cache().matching(
+        lambda key: key[0] == "fetch_recipe_segments" and key[1][0] == merchant and filters_subsume(key[1][1:], filters)
+    )
+    if broader:
+        smallest = min((df for _, df in broader), key=len)
+        return filter_segments(smallest, threshold_pct, significance, country, goal)
+    return fetch_source_segments(merchant, threshold_pct, significance, country, goal)
+
+@persisted_frame("segments")
+def fetch_source_segments(merchant, threshold_pct, significance, country, goal):
+    """Fetch segments matching the filters from the data source (only these fetches are stored on disk)"""
+    return get_data_source().fetch_segments(merchant, threshold_pct, significance, country, goal)
+
+@cached_frame
+def get_segment_whatif_index(merchant, country=None, goal=None, start=None, end=None):
+    """What-if index over all of a merchant's segments for a country, goal and date range, built once per merchant"""
+    return SegmentWhatIfIndex(fetch_window_segments(merchant, 0.0, 0.0, country, goal, start, end))
+
+def has_daily_history():
+    """Whether the data source keeps daily history (only the generated source does; the others store one window)"""
+    # Snapshot entries are built from the live source, so its history covers them too
+    return hasattr(get_live_data_source(), 'daily_history')
+
+def get_segment_rollup(merchant):
+    """Daily rollups of a merchant's segments up to today, or None when the data source has no daily history"""
+    return segment_rollup(merchant, get_analysis_window()[1])
+
+@cached_frame
+def segment_rollup(merchant, last_day):
+    """Daily rollups of a merchant's segments for the history ending on last_day"""
+    if not has_daily_history():
+        return None
+    segments_df = fetch_recipe_segments(merchant, 0.0, 0.0, None, None)
+    daily = get_live_data_source().daily_history(merchant, segments_df, last_day)
+    return SegmentDailyRollup(segments_df['SEGMENT'].astype(str), last_day - timedelta(days=HISTORY_DAYS - 1), daily)
+
+@cached_frame
+def windowed_segments_data(merchant, start, end):
+    """All of a merchant's segments with metrics over the dates start..end (inclusive)"""
+    rollup = get_segment_rollup(merchant)
+    first, stop = rollup.span(start, end)
+    segments_df = fetch_recipe_segments(merchant, 0.0, 0.0, None, None)
+    return window_segments_frame(segments_df, rollup.totals(start, end), max(stop - first, 1))
+
+def fetch_window_segments(merchant, threshold_pct, significance, country, goal, start=None, end=None):
+    """Recipe segments matching the filters over a date range (by default the stored analysis window)"""
+    if start is None or (start, end) == get_analysis_window() or not has_daily_history():
+        return fetch_recipe_segments(merchant, threshold_pct, significance, country, goal)
+    return filter_segments(windowed_segments_data(merchant, start, end), threshold_pct, significance, country, goal)
+
+def week_over_week_cvr(merchant, end):
+    """Change in each segment's CVR from the week before to the 7 days ending at end, indexed by SEGMENT (empty without daily history)"""
+    rollup = get_segment_rollup(merchant)
+    if rollup is None:
+        return pd.Series(dtype=np.float64)
+    this_week = rollup.totals(end - timedelta(days=6), end)
+    last_week = rollup.totals(end - timedelta(days=13), end - timedelta(days=7))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (this_week['SEGMENT_CONVERSIONS'] / this_week['SEGMENT_CHECKOUTS']
+                - last_week['SEGMENT_CONVERSIONS'] / last_week['SEGMENT_CHECKOUTS'])
+
+@cached_frame
+@persisted_frame("shipping")
+def fetch_shipping_promises(merchant):
+    """Fetch shipping promise data"""
+    return get_data_source().fetch_shipping(merchant)
+
+# Function to create actionable recommendations based on segments
+# How each merchant goal frames a recipe in the pitch
+GOAL_PERSONALIZATION = {
+    "top-line": "This recipe directly increases top-line revenue by improving conversion in a high-volume segment.",
+    "margin": "This recipe balances conversion optimization with margin preservation, avoiding unnecessary discounting.",
+    "no-discount": "This recipe improves conversion through UX improvements instead of relying on discounts.",
+    "fast-delivery": "This recipe enhances delivery experience perception to increase checkout conversion.",
+}
+DEFAULT_PERSONALIZATION = "This recipe provides a balanced approach to improving checkout conversion."
+
+RECIPE_EXPLANATION_TEMPLATE = (
+    "The {segment} segment has a {delta_pct:.1f}% lower conversion rate than the {opposite} segment "
+    "and represents {checkout_pct:.1f}% of your checkout traffic."
+)
+RECIPE_MESSAGE_TEMPLATE = (
+    "Based on your checkout data, we recommend testing a recipe for the {segment} segment, which could drive "
+    "${revenue:,.0f} in annual uplift (likely ${revenue_low:,.0f} to ${revenue_high:,.0f}) by improving conversion "
+    "by {delta_pct:.1f}%. ACTION: {action}."
+)
+
+# Ranking objectives and how much each merchant goal weighs them (test cost counts against a recipe)
+RANKING_OBJECTIVES = ['revenue', 'margin', 'delivery', 'test_cost']
+GOAL_WEIGHTS = {
+    "top-line": {'revenue': 1.0, 'margin': 0.0, 'delivery': 0.0, 'test_cost': 0.05},
+    "margin": {'revenue': 0.6, 'margin': 0.4, 'delivery': 0.0, 'test_cost': 0.1},
+    "no-discount": {'revenue': 0.5, 'margin': 0.5, 'delivery': 0.0, 'test_cost': 0.1},
+    "fast-delivery": {'revenue': 0.5, 'margin': 0.0, 'delivery': 0.5, 'test_cost': 0.1},
+}
+DEFAULT_GOAL_WEIGHTS = {'revenue': 0.8, 'margin': 0.1, 'delivery': 0.1, 'test_cost': 0.1}
+
+def score_opportunities(segments_df, goal):
+    """Goal-weighted score per row: shrunk revenue share of the best candidate plus the recipe rule's objectives"""
+    weights = GOAL_WEIGHTS.get(goal, DEFAULT_GOAL_WEIGHTS)
+    revenue = segments_df['REVENUE_POTENTIAL_SHRUNK'].to_numpy(dtype=np.float64)
+    rules = segments_df['RECIPE_RULE'].to_numpy()
+    top_revenue = revenue.max() if len(revenue) else 0.0
+    objectives = {
+        'revenue': revenue / top_revenue if top_revenue > 0 else np.zeros_like(revenue),
+        'margin': np.array([rule['margin'] for rule in RECIPE_RULES])[rules],
+        'delivery': np.array([rule['delivery'] for rule in RECIPE_RULES])[rules],
+        'test_cost': -np.array([rule['test_cost'] for rule in RECIPE_RULES])[rules],
+    }
+    return sum(weights[name] * objectives[name] for name in RANKING_OBJECTIVES)
+
+def top_k_positions(scores, k):
+    """Positions of the k highest scores, best first (linear-time selection, then sort only the k)"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    positions = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    return positions[np.argsort(-scores[positions], kind="stable")]
+
+def rank_opportunities(segments_df, goal, k=3):
+    """Exact top-k conversion opportunities for a goal, with their RANK_SCORE"""
+    # Only segments that convert worse than their opposite and still have revenue upside once shrunk are candidates
+    candidates = segments_df[(segments_df['DELTA_CVR_ROUND'] < 0) & (segments_df['REVENUE_POTENTIAL_SHRUNK'] > 0)]
+    scores = score_opportunities(candidates, goal)
+    positions = top_k_positions(scores, k)
+    return candidates.iloc[positions].assign(RANK_SCORE=scores[positions])
+
+def generate_recommendations(segments_df, goal):
+    """Generate personalized, actionable recommendations"""
+    if segments_df.empty:
+        return []
+    
+    recommendations = []
+    
+    # Rank every candidate for the merchant's goal and keep the top opportunities
+    top_segments = rank_opportunities(segments_df, goal, k=3)
+    
+    # Personalization based on merchant goal
+    personalization = GOAL_PERSONALIZATION.get(goal, DEFAULT_PERSONALIZATION)
+    
+    for segment, opposite, delta_cvr, revenue, revenue_low, revenue_high, checkout_pct, rule in zip(
+        top_segments['SEGMENT'], top_segments['OPPOSITE_SEGMENT'], top_segments['DELTA_CVR_ROUND'],
+        top_segments['Revenue Potential (Annual)'], top_segments['REVENUE_P10'], top_segments['REVENUE_P90'],
+        top_segments['CHECKOUT_PERCENTAGE_ROUND'], top_segments['RECIPE_RULE']
+    ):
+        # Create recommendation
+        rec = {
+            'segment': segment,
+            'revenue': revenue,
+            'revenue_low': revenue_low,
+            'revenue_high': revenue_high,
+            'delta_cvr': delta_cvr,
+            'checkout_pct': checkout_pct,
+            'opposite': opposite,
+            'explanation': RECIPE_EXPLANATION_TEMPLATE.format(
+                segment=segment, opposite=opposite, delta_pct=abs(delta_cvr*100), checkout_pct=checkout_pct*100
+            ),
+            'specific_action': recipe_action(rule, segment),
+            'personalization': personalization,
+        }
+        
+        # Create seasonality explanation
+        monthly_distribution = [0.07, 0.08, 0.08, 0.08, 0.08, 0.08, 0.08, 0.08, 0.09, 0.09, 0.10, 0.09]
+        rec['seasonality'] = {
+            'Q1': f"${revenue * (monthly_distribution[0] + monthly_distribution[1] + monthly_distribution[2]):.0f}",
+            'Q2': f"${revenue * (monthly_distribution[3] + monthly_distribution[4] + monthly_distribution[5]):.0f}",
+            'Q3': f"${revenue * (monthly_distribution[6] + monthly_distribution[7] + monthly_distribution[8]):.0f}",
+            'Q4': f"${revenue * (monthly_distribution[9] + monthly_distribution[10] + monthly_distribution[11]):.0f}",
+        }
+        
+        # Craft a ready-to-copy message with specific action steps
+        rec['message'] = RECIPE_MESSAGE_TEMPLATE.format(
+            segment=segment, revenue=revenue, revenue_low=revenue_low, revenue_high=revenue_high,
+            delta_pct=abs(delta_cvr*100), action=rec['specific_action']
+        )
+        
+        recommendations.append(rec)
+        
+    return recommendations
+
+# Shipping recommendation status per method, in display priority order for the sort key below
+SHIPPING_STATUSES = ["opportunity", "warning", "accurate", "missing"]
+
+# Shipping actions are stored as an index into this list and rendered on demand
+SHIPPING_ACTION_TEMPLATES = [
+    {
+        'action': "Reduce delivery promise from {promise} days to {suggested:.0f} days",
+        'explanation': "Shipments using '{method}' are delivered {tp80:.1f} days faster than promised (80th percentile).",
+    },
+    {
+        'action': "Extend delivery promise from {promise} days to {suggested:.0f} days",
+        'explanation': "Only {on_time:.0%} of shipments using '{method}' arrive within the promise (target: {target:.0%}).",
+    },
+    {
+        'action': "Keep current promise",
+        'explanation': "The current promise for '{method}' is accurate.",
+    },
+    {
+        'action': "Add a {suggested:.0f}-day delivery promise",
+        'explanation': "'{method}' has no delivery promise. Adding one could improve conversion.",
+    },
+    {
+        'action': "Extend delivery promise beyond {max_days} days",
+        'explanation': "No promise of up to {max_days} days gets {target:.0%} of '{method}' shipments there on time (or there is no delivery data yet).",
+    },
+]
+SHIPPING_REDUCE, SHIPPING_EXTEND, SHIPPING_KEEP, SHIPPING_ADD, SHIPPING_EXTEND_UNKNOWN = range(len(SHIPPING_ACTION_TEMPLATES))
+
+# Promise to propose for methods without one, by service tier
+SHIPPING_TIER_PROMISE_DAYS = {"premium": 2.0, "economy": 5.0, "free": 3.0, "standard": 3.0}
+
+def suggest_missing_promise_days(methods):
+    """Promise to propose for methods without one, classifying each distinct title once"""
+    tiers = classify_shipping_titles(methods)
+    days = np.array([SHIPPING_TIER_PROMISE_DAYS[tier] for tier in SHIPPING_TIERS] + [np.nan])
+    return days[tiers.codes]
+
+# Function to analyze shipping data and generate recommendations
+def generate_shipping_recommendations(shipping_df):
+    """Generate shipping recommendations based on shipping data.
+
+    Returns the shipping rows with SHIPPING_STATUS, SHIPPING_ACTION and SUGGESTED_PROMISE columns,
+    opportunities first, then missing promises, then everything else.
+    """
+    promise = shipping_df['CALCULATED_PROMISES_VAL'].to_numpy(dtype=np.float64)
+    has_promise = ~np.isnan(promise)
+    # Tightest promise that keeps PROMISE_ON_TIME_TARGET on time, from the delivery-time CDF
+    # (NaN when no promise up to SKETCH_MAX_PROMISE_DAYS does, or there's no delivery data)
+    optimal = shipping_df['OPTIMAL_PROMISE_VAL'].to_numpy(dtype=np.float64)
+    
+    # Determine specific action based on metrics (the first matching condition wins; an optimal current promise is kept)
+    conditions = [~has_promise, np.isnan(optimal), optimal < promise, optimal > promise]
+    actions = np.select(conditions, [SHIPPING_ADD, SHIPPING_EXTEND_UNKNOWN, SHIPPING_REDUCE, SHIPPING_EXTEND], default=SHIPPING_KEEP)
+    statuses = np.select(
+        conditions, [SHIPPING_STATUSES.index(status) for status in ["missing", "warning", "opportunity", "warning"]],
+        default=SHIPPING_STATUSES.index("accurate")
+    )
+    suggested = np.select(conditions[1:], [np.nan, optimal, optimal], default=promise)
+    if not has_promise.all():
+        suggested[~has_promise] = suggest_missing_promise_days(shipping_df['O_SHIPPING_METHOD_TITLE'][~has_promise])
+    
+    recommendations = shipping_df.assign(
+        SHIPPING_STATUS=pd.Categorical.from_codes(statuses, categories=SHIPPING_STATUSES),
+        SHIPPING_ACTION=actions.astype(np.int8),
+        SUGGESTED_PROMISE=suggested,
+    )
+    
+    # Opportunities first, then missing promises, then the rest (stable, so source order is kept within each group)
+    sort_key = np.where(actions == SHIPPING_REDUCE, -1, np.where(has_promise, 1, 0))
+    return recommendations.iloc[np.argsort(sort_key, kind="stable")].reset_index(drop=True)
+
+def render_shipping_text(recommendations, field):
+    """'action' or 'explanation' text for the given recommendation rows (only render what is displayed)"""
+    return pd.Series([
+        SHIPPING_ACTION_TEMPLATES[action][field].format(
+            method=method,
+            promise=promise,
+            suggested=suggested,
+            tp80=tp80,
+            on_time=on_time,
+            target=PROMISE_ON_TIME_TARGET,
+            max_days=SKETCH_MAX_PROMISE_DAYS
+        )
+        for action, method, promise, suggested, tp80, on_time in zip(
+            recommendations['SHIPPING_ACTION'], recommendations['O_SHIPPING_METHOD_TITLE'],
+            recommendations['CALCULATED_PROMISES_VAL'], recommendations['SUGGESTED_PROMISE'],
+            recommendations['TP80_DIFF'], recommendations['ON_TIME_RATE']
+        )
+    ], index=recommendations.index, dtype=object)
+
+# Precomputed snapshot written by the batch command (python recipe_test.py precompute)
+SNAPSHOT_PATH = os.environ.get(
+    "RECIPE_SNAPSHOT_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "recipe_snapshot.json.gz")
+)
+
+def precompute_merchant(merchant, previous_watermark=None, threshold_pct=DEFAULT_THRESHOLD_PCT, significance=DEFAULT_SIGNIFICANCE):
+    """Compute one merchant's snapshot entry from the live data source.
+
+    Returns None when the merchant's inputs still match previous_watermark.
+    """
+    source = get_live_data_source()
+    watermark = source.watermark(merchant)
+    if watermark == previous_watermark:
+        return None
+    
+    segments_df = source.fetch_segments(merchant, 0.0, 0.0, None, None)
+    shipping_df = source.fetch_shipping(merchant)
+    
+    recommendations = {}
+    for goal in GOAL_OPTIONS:
+        goal_df = filter_segments(segments_df, threshold_pct, significance, None, goal if goal != "all" else None)
+        recommendations[goal] = generate_recommendations(goal_df, goal)
+    
+    return {
+        'watermark': watermark,
+        'segments': segments_df,
+        'recommendations': recommendations,
+        'shipping': shipping_df,
+        'shipping_recommendations': generate_shipping_recommendations(shipping_df),
+    }
+
+def _init_precompute_worker():
+    # Forked workers must not share the parent's pooled connections
+    get_live_data_source.clear()
+
+def build_snapshot(merchants, workers=None, threshold_pct=DEFAULT_THRESHOLD_PCT, significance=DEFAULT_SIGNIFICANCE, previous=None):
+    """Precompute merchants across a process pool, reusing unchanged entries from a previous snapshot"""
+    merchants = list(merchants)
+    params = {'threshold_pct': threshold_pct, 'significance': significance}
+    # Entries built with different filters or an older schema can't be reused
+    reusable = previous is not None and previous.get('schema_version') == SCHEMA_VERSION and previous['params'] == params
+    previous_entries = previous['merchants'] if reusable else {}
+    previous_watermarks = [previous_entries.get(merchant, {}).get('watermark') for merchant in merchants]
+    
+    compute = functools.partial(precompute_merchant, threshold_pct=threshold_pct, significance=significance)
+    chunksize = max(1, len(merchants) // (4 * (workers or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=process_pool_context(), initializer=_init_precompute_worker) as pool:
+        entries = list(pool.map(compute, merchants, previous_watermarks, chunksize=chunksize))
+    
+    # Merge: changed merchants get fresh entries, unchanged ones keep theirs, removed ones drop out
+    recomputed = [merchant for merchant, entry in zip(merchants, entries) if entry is not None]
+    return {
+        'schema_version': SCHEMA_VERSION,
+        'created_at': datetime.now().isoformat(timespec="seconds"),
+        'params': params,
+        'merchants': {
+            merchant: entry if entry is not None else previous_entries[merchant]
+            for merchant, entry in zip(merchants, entries)
+        },
+        'refresh': {'recomputed': len(recomputed), 'reused': len(merchants) - len(recomputed), 'merchants': recomputed},
+    }
+
+def _encode_snapshot_value(value):
+    # JSON has no frames or numpy scalars: frames keep their dtypes and categories alongside the values
+    if isinstance(value, pd.DataFrame):
+        return {'__frame__': {
+            'index': value.index.tolist(),
+            'columns': {column: value[column].tolist() for column in value.columns},
+            'dtypes': {column: str(dtype) for column, dtype in value.dtypes.items()},
+            'categories': {column: value[column].cat.categories.tolist()
+                           for column in value.columns if isinstance(value[column].dtype, pd.CategoricalDtype)},
+        }}
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"can't store {type(value).__name__} in a snapshot")
+
+def _decode_snapshot_value(value):
+    frame = value.get('__frame__')
+    if frame is None:
+        return value
+    df = pd.DataFrame(frame['columns'], index=frame['index'], columns=list(frame['dtypes']))
+    for column, dtype in frame['dtypes'].items():
+        if column in frame['categories']:
+            df[column] = pd.Categorical(df[column], categories=frame['categories'][column])
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+def write_snapshot(snapshot, path=SNAPSHOT_PATH):
+    """Write the snapshot as gzipped JSON (never pickle, so reading it can't run code), atomically replacing any previous one"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(snapshot, f, default=_encode_snapshot_value)
+    os.replace(tmp_path, path)
+
+def read_snapshot(path=SNAPSHOT_PATH):
+    """Read a snapshot written by write_snapshot, or None if it can't be read"""
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return json.load(f, object_hook=_decode_snapshot_value)
+    except (OSError, ValueError):
+        return None
+
+def _snapshot_mtime(path=SNAPSHOT_PATH):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+@st.cache_resource(max_entries=1)
+def _load_snapshot(path, mtime):
+    # A new snapshot replaces the data behind every frame cached in memory
+    get_frame_cache().invalidate()
+    return read_snapshot(path)
+
+def load_snapshot(path=SNAPSHOT_PATH):
+    """Latest snapshot on disk (reloaded when the file changes), or None if there isn't a current one"""
+    mtime = _snapshot_mtime(path)
+    if mtime is None:
+        return None
+    snapshot = _load_snapshot(path, mtime)
+    return snapshot if snapshot is not None and snapshot.get('schema_version') == SCHEMA_VERSION else None
+
+def data_version(merchant):
+    """Watermark of the data serving a merchant: its snapshot entry's, or the live source's change counter"""
+    snapshot = load_snapshot()
+    entry = snapshot['merchants'].get(merchant) if snapshot is not None else None
+    return entry['watermark'] if entry is not None else get_live_data_source().watermark(merchant)
+
+class SnapshotDataSource:
+    """Serves merchants from the precomputed snapshot, falling back to the live source for the rest"""
+
+    def __init__(self, snapshot, fallback):
+        self.snapshot = snapshot
+        self.fallback = fallback
+
+    def fetch_segments(self, merchant, threshold_pct, significance, country, goal):
+        entry = self.snapshot['merchants'].get(merchant)
+        if entry is None:
+            return self.fallback.fetch_segments(merchant, threshold_pct, significance, country, goal)
+        return filter_segments(entry['segments'], threshold_pct, significance, country, goal)
+
+    def fetch_shipping(self, merchant):
+        entry = self.snapshot['merchants'].get(merchant)
+        if entry is None:
+            return self.fallback.fetch_shipping(merchant)
+        return entry['shipping'].copy()
+
+def get_data_source():
+    """Data source for the dashboard: the snapshot when one exists, otherwise the live source"""
+    snapshot = load_snapshot()
+    if snapshot is None:
+        return get_live_data_source()
+    return SnapshotDataSource(snapshot, get_live_data_source())
+
+def get_recommendations(merchant, segments_df, goal, threshold_pct, significance, country, default_window=True):
+    """Precomputed recommendations when the snapshot matches the current filters, otherwise computed live"""
+    snapshot = load_snapshot()
+    entry = snapshot['merchants'].get(merchant) if snapshot is not None else None
+    snapshot_filters = (entry is not None and default_window and (not country or country == "All")
+                        and snapshot['params'] == {'threshold_pct': threshold_pct, 'significance': significance})
+    if snapshot_filters:
+        return entry['recommendations'][goal]
+    return generate_recommendations(segments_df, goal)
+
+def get_shipping_recommendations(merchant, shipping_df):
+    """Precomputed shipping recommendations from the snapshot, otherwise computed live"""
+    snapshot = load_snapshot()
+    entry = snapshot['merchants'].get(merchant) if snapshot is not None else None
+    if entry is not None:
+        return entry['shipping_recommendations']
+    return generate_shipping_recommendations(shipping_df)
+
+def rank_fleet_opportunities(merchants, goal, k=100, threshold_pct=DEFAULT_THRESHOLD_PCT, significance=DEFAULT_SIGNIFICANCE):
+    """Top-k opportunities across many merchants, scored together for the goal"""
+    goal_filter = goal if goal != "all" else None
+    frames = [get_data_source().fetch_segments(merchant, threshold_pct, significance, None, goal_filter) for merchant in merchants]
+    if not frames:
+        return pd.DataFrame(columns=SEGMENT_COLUMNS + ['RANK_SCORE'])
+    return rank_opportunities(pd.concat(frames, ignore_index=True), goal, k).reset_index(drop=True)
 
 # Create a helper function for tooltips
 def tooltip(text, help_text):
@@ -727,6 +2613,14 @@ def section_header(title, tooltip_text):
     </div>
     """
 
+# Only compute the selected tab on each rerun (set RECIPE_LAZY_TABS=0 to render every tab);
+# needs stateful tabs, so older Streamlit versions always render every tab
+LAZY_TABS = os.environ.get("RECIPE_LAZY_TABS", "1") != "0" and "on_change" in inspect.signature(st.tabs).parameters
+
+def tab_is_open(tab):
+    """Whether a tab's content needs computing (always true unless tabs load on demand)"""
+    return getattr(tab, "open", None) is not False
+
 # Get merchant list (use static list for local version)
 def get_merchants():
     return [
@@ -741,150 +2635,251 @@ def get_merchants():
 def get_countries():
     return ["US", "CA", "UK", "AU", "DE", "FR"]
 
-# Sidebar with PDQ branding
-st.sidebar.markdown("""
+def main(argv):
+    """Headless batch entry point: python recipe_test.py {precompute,rank,shipments,events,invalidate} [options]"""
+    parser = argparse.ArgumentParser(prog="recipe_test.py", description="CS recipe batch jobs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    precompute = subparsers.add_parser("precompute", help="materialize every merchant's recommendations into a snapshot")
+    precompute.add_argument("--output", default=SNAPSHOT_PATH, help="snapshot file to write")
+    precompute.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    precompute.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD_PCT, help="%% checkout threshold for recommendations")
+    precompute.add_argument("--significance", type=float, default=DEFAULT_SIGNIFICANCE, help="minimum absolute delta CVR for recommendations")
+    precompute.add_argument("--full", action="store_true", help="recompute every merchant instead of only changed ones")
+    rank = subparsers.add_parser("rank", help="print the top opportunities across all merchants")
+    rank.add_argument("--goal", choices=GOAL_OPTIONS, default="all", help="merchant goal used to weigh the ranking")
+    rank.add_argument("--top", type=int, default=100, help="number of opportunities to list")
+    rank.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD_PCT, help="%% checkout threshold for recommendations")
+    rank.add_argument("--significance", type=float, default=DEFAULT_SIGNIFICANCE, help="minimum absolute delta CVR for recommendations")
+    shipments = subparsers.add_parser("shipments", help="aggregate raw shipment records into shipping promise rows")
+    shipments.add_argument("paths", nargs="+", help="CSV or Parquet files with " + ", ".join(SHIPMENT_COLUMNS))
+    shipments.add_argument("--output", default=None, help="CSV file to write (default: print to stdout)")
+    shipments.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    shipments.add_argument("--chunksize", type=int, default=INGEST_CHUNK_ROWS, help="records read per chunk")
+    events = subparsers.add_parser("events", help="aggregate raw checkout events into segment rows")
+    events.add_argument(
+        "paths", nargs="+",
+        help="CSV or Parquet files with " + ", ".join(CHECKOUT_EVENT_COLUMNS) + " (DEVICE may be missing). "
+        "Untagged files may carry raw fields instead: CUSTOMER_PRIOR_ORDERS for USER_TYPE, DISCOUNT_CODE for "
+        "COUPON_STATE, and CART_VALUE with FREE_SHIPPING_THRESHOLD for THRESHOLD_SIDE"
+    )
+    events.add_argument("--output", default=None, help="CSV file to write (default: print to stdout)")
+    events.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    events.add_argument("--chunksize", type=int, default=INGEST_CHUNK_ROWS, help="events read per chunk")
+    events.add_argument("--days", type=int, default=ANALYSIS_WINDOW_DAYS, help="days of events the files cover")
+    events.add_argument("--mine", type=int, default=None, metavar="K",
+                        help="list the top K opportunities among discovered segment pairs instead of the fixed pairs")
+    events.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD_PCT, help="%% checkout threshold for --mine")
+    events.add_argument("--by", default=None, help="comma-separated dimensions to roll up by instead of segment pairs "
+                        f"(any of {', '.join(CUBE_DIMENSIONS + ['DELIVERY_COUNTRY'])})")
+    invalidate = subparsers.add_parser("invalidate", help="drop cached and stored frames, e.g. after editing the data source")
+    invalidate.add_argument("merchants", nargs="*", help="merchants to drop (default: every merchant)")
+    args = parser.parse_args(argv)
+    
+    if args.command == "invalidate":
+        if args.merchants:
+            removed = sum(invalidate_merchant_data(merchant) for merchant in args.merchants)
+        else:
+            removed = invalidate_merchant_data()
+        print(f"removed {removed} stored frames")
+        return 0
+    
+    if args.command == "events":
+        cube = build_segment_cube(args.paths, args.workers, args.chunksize)
+        if args.by:
+            result = cube.rollup(by=args.by.split(","))
+        else:
+            if args.mine:
+                segments = mine_segment_pairs(cube, args.threshold, args.mine, args.days)
+            else:
+                segments = cube.to_frame(window_days=args.days)
+            result = segments[[column for column in SEGMENT_COLUMNS if column != 'SUGGESTION_TEMPLATE']]
+        if args.output:
+            result.to_csv(args.output, index=False, float_format="%.6g")  # no float32 noise
+        else:
+            print(result.to_string(index=False))
+        return 0
+    
+    if args.command == "shipments":
+        shipping = aggregate_shipments(args.paths, args.workers, args.chunksize)
+        if args.output:
+            shipping.to_csv(args.output, index=False)
+        else:
+            print(shipping.to_string(index=False))
+        return 0
+    
+    if args.command == "rank":
+        top = rank_fleet_opportunities(get_merchants(), args.goal, args.top, args.threshold, args.significance)
+        columns = ['SHOP_NAME', 'SEGMENT', 'DELTA_CVR_ROUND', 'CHECKOUT_PERCENTAGE_ROUND', 'Revenue Potential (Annual)',
+                   'REVENUE_POTENTIAL_SHRUNK', 'RANK_SCORE']
+        print(top[columns].to_string(index=False))
+        return 0
+    
+    started = time.monotonic()
+    merchants = get_merchants()
+    previous = None if args.full else read_snapshot(args.output)
+    get_live_data_source()  # make sure the source is ready (e.g. seeded) before forking workers
+    snapshot = build_snapshot(merchants, args.workers, args.threshold, args.significance, previous)
+    write_snapshot(snapshot, args.output)
+    refresh = snapshot['refresh']
+    # Frames stored from the recomputed merchants' old data are unreachable now, so free their space
+    for merchant in refresh['merchants']:
+        invalidate_merchant_data(merchant)
+    print(f"wrote {len(merchants)} merchants to {args.output} "
+          f"({refresh['recomputed']} recomputed, {refresh['reused']} unchanged) in {time.monotonic() - started:.1f}s")
+    return 0
+
+def render_dashboard():
+    """The dashboard itself: sidebar filters and the four tabs"""
+    render_page_header()
+    
+    # Sidebar with PDQ branding
+    st.sidebar.markdown("""
 <div style="text-align: center;">
     <h2 style="color: white;">PDQ</h2>
     <p style="color: #884dff; font-weight: 500;">CS Recipe Dashboard</p>
 </div>
 """, unsafe_allow_html=True)
 
-st.sidebar.markdown("---")
+    st.sidebar.markdown("---")
 
-# Sidebar filters
-st.sidebar.header("dashboard settings")
+    # Sidebar filters
+    st.sidebar.header("dashboard settings")
 
-# Add time period information
-analysis_start = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
-analysis_end = datetime.now().strftime("%Y-%m-%d")
-st.sidebar.markdown(f"""
-    <div class="time-period" style="color: white;">
-        <strong>analysis period:</strong> {analysis_start} to {analysis_end}
-    </div>
-""", unsafe_allow_html=True)
-
-# Merchant selector
-merchants = get_merchants()
-selected_merchant = st.sidebar.selectbox(
-    "merchant name",
-    merchants
-)
+    # Analysis period: any date range inside the daily history (answered from the merchant's rollups)
+    default_window = get_analysis_window()
+    if has_daily_history():
+        selected_window = st.sidebar.date_input(
+            "analysis period",
+            value=default_window,
+            min_value=default_window[1] - timedelta(days=HISTORY_DAYS - 1),
+            max_value=default_window[1]
+        )
+    else:
+        # Sources without daily history only hold the default window
+        st.sidebar.caption(f"analysis period: {default_window[0]:%Y-%m-%d} to {default_window[1]:%Y-%m-%d}")
+        selected_window = default_window
+    # Keep the default until both ends of a new range have been picked
+    window_start, window_end = selected_window if len(selected_window) == 2 else default_window
+    is_default_window = (window_start, window_end) == default_window
 
-# Country selector with "All" option
-countries = ["All"] + get_countries()
-selected_country = st.sidebar.selectbox(
-    "delivery country",
-    countries
-)
+    # Merchant selector
+    merchants = get_merchants()
+    selected_merchant = st.sidebar.selectbox(
+        "merchant name",
+        merchants
+    )
 
-# Checkout threshold filter with tooltip
-threshold_help = "minimum percentage of checkouts a segment must have to be considered significant. higher values focus on more common customer segments."
-st.sidebar.markdown(f"""<div style="color: white;">{tooltip("% checkout threshold (min)", threshold_help)}</div>""", unsafe_allow_html=True)
-threshold_percent = st.sidebar.slider(
-    "checkout_threshold",
-    min_value=0.0,
-    max_value=1.0,
-    value=0.15,
-    step=0.01,
-    format="%.2f",
-    label_visibility="collapsed"
-)
+    # Country selector with "All" option
+    countries = ["All"] + get_countries()
+    selected_country = st.sidebar.selectbox(
+        "delivery country",
+        countries
+    )
 
-# Significance toggle with tooltip
-significance_help = "when enabled, only shows segments with statistically significant conversion differences (≥2% absolute difference)."
-st.sidebar.markdown(f"""<div style="color: white;">{tooltip("only show significant opportunities", significance_help)}</div>""", unsafe_allow_html=True)
-show_significant = st.sidebar.toggle(
-    "significant_toggle",
-    value=True,
-    label_visibility="collapsed"
-)
-significance_threshold = 0.02 if show_significant else 0.0
+    # Checkout threshold filter with tooltip
+    threshold_help = "minimum percentage of checkouts a segment must have to be considered significant. higher values focus on more common customer segments."
+    st.sidebar.markdown(f"""<div style="color: white;">{tooltip("% checkout threshold (min)", threshold_help)}</div>""", unsafe_allow_html=True)
+    threshold_percent = st.sidebar.slider(
+        "checkout_threshold",
+        min_value=0.0,
+        max_value=1.0,
+        value=DEFAULT_THRESHOLD_PCT,
+        step=0.01,
+        format="%.2f",
+        label_visibility="collapsed"
+    )
 
-# Goal alignment with tooltip
-goal_help = "filter recommendations based on the merchant's primary business goal. each goal uses different criteria to prioritize opportunities."
-st.sidebar.markdown(f"""<div style="color: white;">{tooltip("goal alignment", goal_help)}</div>""", unsafe_allow_html=True)
-goal_options = {
-    "all": "all opportunities",
-    "top-line": "increase top-line revenue",
-    "margin": "protect contribution margin",
-    "no-discount": "minimize discount usage",
-    "fast-delivery": "optimize delivery expectations"
-}
-selected_goal = st.sidebar.selectbox(
-    "goal_selector",
-    list(goal_options.keys()),
-    format_func=lambda x: goal_options[x],
-    label_visibility="collapsed"
-)
+    # Significance toggle with tooltip
+    significance_help = "when enabled, only shows segments with statistically significant conversion differences (≥2% absolute difference that holds up under false discovery rate control)."
+    st.sidebar.markdown(f"""<div style="color: white;">{tooltip("only show significant opportunities", significance_help)}</div>""", unsafe_allow_html=True)
+    show_significant = st.sidebar.toggle(
+        "significant_toggle",
+        value=True,
+        label_visibility="collapsed"
+    )
+    significance_threshold = DEFAULT_SIGNIFICANCE if show_significant else 0.0
 
-# Similar merchants feature
-st.sidebar.markdown("""<h4 style="color: white;">similar merchants</h4>""", unsafe_allow_html=True)
-st.sidebar.markdown("""<p style="color: white; font-size: 12px;">merchants with similar patterns</p>""", unsafe_allow_html=True)
-
-similar_merchants = ['similar-store.myshopify.com', 'alike-shop.myshopify.com', 'familiar-brand.myshopify.com']
-for i, merchant in enumerate(similar_merchants):
-    similarity = round(90 - i*10)
-    st.sidebar.markdown(f"""<div style="color: white;">{merchant} <span style="color: #884dff; font-weight: 500;">({similarity}% similar)</span></div>""", unsafe_allow_html=True)
-
-# Feedback section in sidebar
-st.sidebar.markdown("---")
-st.sidebar.markdown("""<h4 style="color: white;">feedback</h4>""", unsafe_allow_html=True)
-if st.sidebar.button("share feedback", use_container_width=True):
-    st.sidebar.success("Thank you for your feedback!")
-
-# Main content as tabs
-tab1, tab2, tab3, tab4 = st.tabs([
-    "Recipe Opportunities 🚀", 
-    "Shipping Promise Analysis 📦", 
-    "Tested vs. Untested Recipes 🧪",
-    "Pitch-Ready Recipes 💼"
-])
-
-# Tab 1: Recipe Opportunities
-with tab1:
-    st.markdown('<div class="tab-container">', unsafe_allow_html=True)
-    
-    # Fetch segment data using our data generation function
-    segments_df = fetch_recipe_segments(
-        selected_merchant, 
-        threshold_percent, 
-        significance_threshold, 
-        selected_country,
-        selected_goal if selected_goal != "all" else None
+    # Goal alignment with tooltip
+    goal_help = "filter recommendations based on the merchant's primary business goal. each goal uses different criteria to prioritize opportunities."
+    st.sidebar.markdown(f"""<div style="color: white;">{tooltip("goal alignment", goal_help)}</div>""", unsafe_allow_html=True)
+    goal_options = GOAL_OPTIONS
+    selected_goal = st.sidebar.selectbox(
+        "goal_selector",
+        list(goal_options.keys()),
+        format_func=lambda x: goal_options[x],
+        label_visibility="collapsed"
     )
-    
-    # Summary metrics
-    st.markdown('<h3 class="section-header">opportunity summary</h3>', unsafe_allow_html=True)
-    
-    # Count opportunities by type
-    conversion_opps = len(segments_df[segments_df['DELTA_CVR_ROUND'] < 0])
-    sensitivity_opps = len(segments_df[segments_df['DELTA_CVR_ROUND'] > 0])
-    
-    col1, col2, col3 = st.columns(3)
-    
-    with col1:
-        st.markdown(f"""
+
+    # Similar merchants feature
+    st.sidebar.markdown("""<h4 style="color: white;">similar merchants</h4>""", unsafe_allow_html=True)
+    st.sidebar.markdown("""<p style="color: white; font-size: 12px;">merchants with similar patterns</p>""", unsafe_allow_html=True)
+
+    similar_merchants = ['similar-store.myshopify.com', 'alike-shop.myshopify.com', 'familiar-brand.myshopify.com']
+    for i, merchant in enumerate(similar_merchants):
+        similarity = round(90 - i*10)
+        st.sidebar.markdown(f"""<div style="color: white;">{merchant} <span style="color: #884dff; font-weight: 500;">({similarity}% similar)</span></div>""", unsafe_allow_html=True)
+
+    # Feedback section in sidebar
+    st.sidebar.markdown("---")
+    st.sidebar.markdown("""<h4 style="color: white;">feedback</h4>""", unsafe_allow_html=True)
+    if st.sidebar.button("share feedback", use_container_width=True):
+        st.sidebar.success("Thank you for your feedback!")
+
+    # Main content as tabs (with lazy tabs, switching tabs reruns the app and only the open tab is computed)
+    tab1, tab2, tab3, tab4 = st.tabs([
+        "Recipe Opportunities 🚀", 
+        "Shipping Promise Analysis 📦", 
+        "Tested vs. Untested Recipes 🧪",
+        "Pitch-Ready Recipes 💼"
+    ], **({'key': "active_tab", 'on_change': "rerun"} if LAZY_TABS else {}))
+
+    # Tab 1: Recipe Opportunities
+    def render_recipe_opportunities():
+        st.markdown('<div class="tab-container">', unsafe_allow_html=True)
+        
+        # Slider and toggle changes are answered from the merchant's what-if index, not a refetch
+        whatif_index = get_segment_whatif_index(
+            selected_merchant, 
+            selected_country,
+            selected_goal if selected_goal != "all" else None,
+            window_start,
+            window_end
+        )
+        segments_df = whatif_index.segments(threshold_percent, significance_threshold)
+        summary = whatif_index.summary(threshold_percent, significance_threshold)
+        
+        # Summary metrics
+        st.markdown('<h3 class="section-header">opportunity summary</h3>', unsafe_allow_html=True)
+        
+        # Count opportunities by type
+        conversion_opps = int(summary['conversion'])
+        sensitivity_opps = int(summary['sensitivity'])
+        
+        col1, col2, col3 = st.columns(3)
+        
+        with col1:
+            st.markdown(f"""
         <div class="metric-card">
             <div class="kpi-container">
-                <p class="kpi-number">{len(segments_df)}</p>
+                <p class="kpi-number">{int(summary['total'])}</p>
                 <p class="kpi-label">total opportunities</p>
             </div>
         </div>
         """, unsafe_allow_html=True)
-    
-    with col2:
-        st.markdown(f"""
+        
+        with col2:
+            st.markdown(f"""
         <div class="metric-card">
             <div class="kpi-container">
                 <p class="kpi-number" style="color: #28a745;">{conversion_opps}</p>
                 <p class="kpi-label">conversion optimization</p>
-                <p style="color: #28a745; margin: 0; font-size: 0.8rem;">↑ increase revenue</p>
+                <p style="color: #28a745; margin: 0; font-size: 0.8rem;">↑ ${summary['revenue']/1000:,.0f}K revenue potential</p>
             </div>
         </div>
         """, unsafe_allow_html=True)
-        
-    with col3:
-        st.markdown(f"""
+            
+        with col3:
+            st.markdown(f"""
         <div class="metric-card">
             <div class="kpi-container">
                 <p class="kpi-number" style="color: #884dff;">{sensitivity_opps}</p>
@@ -893,143 +2888,135 @@ with tab1:
             </div>
         </div>
         """, unsafe_allow_html=True)
-    
-    # Display the segments table
-    st.markdown('<h3 class="section-header">recipe opportunities</h3>', unsafe_allow_html=True)
-    
-    # Prepare display columns
-    display_df = segments_df.copy()
-    display_df = display_df.rename(columns={
-        'SEGMENT': 'segment',
-        'OPPOSITE_SEGMENT': 'opposite segment',
-        'DELTA_CVR_ROUND': 'cvr vs opposite',
-        'CHECKOUT_PERCENTAGE_ROUND': '% of checkouts',
-        'Revenue Potential (Annual)': 'potential lift',
-        'OPTIMIZATION_SUGGESTION': 'optimization suggestion'
-    })
-    
-    # Format values for display
-    display_df['cvr vs opposite'] = display_df['cvr vs opposite'].apply(lambda x: f"{x*100:.1f}%")
-    display_df['% of checkouts'] = display_df['% of checkouts'].apply(lambda x: f"{x*100:.1f}%")
-    display_df['potential lift'] = display_df['potential lift'].apply(lambda x: f"${x:,.0f}")
-    
-    # Select and order columns for display
-    display_cols = [
-        'segment', 
-        'opposite segment', 
-        'cvr vs opposite', 
-        '% of checkouts', 
-        'potential lift', 
-        'optimization suggestion'
-    ]
-    
-    # Show data table
-    st.dataframe(display_df[display_cols], use_container_width=True)
-    
-    # Show detailed cards for top opportunities
-    st.markdown('<h3 class="section-header">top 3 opportunities</h3>', unsafe_allow_html=True)
-    
-    # Get top 3 segments with negative delta_cvr (real opportunities)
-    segments_df_neg = segments_df[segments_df['DELTA_CVR_ROUND'] < 0]
-    top_3_df = segments_df_neg.nlargest(3, 'Revenue Potential (Annual)')
-    
-    for i, (_, row) in enumerate(top_3_df.iterrows()):
-        segment = row['SEGMENT']
-        opposite = row['OPPOSITE_SEGMENT']
-        delta_cvr = row['DELTA_CVR_ROUND']
-        revenue = row['Revenue Potential (Annual)']
-        checkout_pct = row['CHECKOUT_PERCENTAGE_ROUND']
         
-        # Determine specific action based on segment
-        specific_action = "optimize checkout experience"
-        if "Coupon" in segment:
-            if "without Coupon" in segment:
-                specific_action = "add targeted discount options for this segment"
-            else:
-                specific_action = "test different discount levels"
-        elif "Threshold" in segment:
-            if "Below Threshold" in segment:
-                specific_action = "add upsell prompts showing free shipping benefits"
-            else:
-                specific_action = "highlight shipping savings"
-        elif "First Time User" in segment:
-            specific_action = "add trust signals and simplified checkout"
-        elif "Returning User" in segment:
-            specific_action = "implement one-click checkout"
+        # Display the segments table
+        st.markdown('<h3 class="section-header">recipe opportunities</h3>', unsafe_allow_html=True)
         
-        st.markdown(f"""
+        # Prepare display columns
+        display_df = segments_df.copy()
+        display_df['optimization suggestion'] = render_suggestions(segments_df)
+        display_df = display_df.rename(columns={
+            'SEGMENT': 'segment',
+            'OPPOSITE_SEGMENT': 'opposite segment',
+            'DELTA_CVR_ROUND': 'cvr vs opposite',
+            'CHECKOUT_PERCENTAGE_ROUND': '% of checkouts',
+            'Revenue Potential (Annual)': 'potential lift'
+        })
+        
+        # Format values for display
+        display_df['cvr vs opposite'] = display_df['cvr vs opposite'].apply(lambda x: f"{x*100:.1f}%")
+        display_df['% of checkouts'] = display_df['% of checkouts'].apply(lambda x: f"{x*100:.1f}%")
+        display_df['potential lift'] = display_df['potential lift'].apply(lambda x: f"${x:,.0f}")
+        display_df['likely range'] = [
+            f"${low:,.0f} - ${high:,.0f}" for low, high in zip(segments_df['REVENUE_P10'], segments_df['REVENUE_P90'])
+        ]
+        cvr_change = week_over_week_cvr(selected_merchant, window_end).reindex(segments_df['SEGMENT'].astype(str))
+        display_df['cvr week over week'] = [f"{change*100:+.1f} pts" if pd.notna(change) else "n/a" for change in cvr_change]
+        
+        # Select and order columns for display
+        display_cols = [
+            'segment', 
+            'opposite segment', 
+            'cvr vs opposite', 
+            '% of checkouts', 
+            'potential lift', 
+            'likely range', 
+            'cvr week over week', 
+            'optimization suggestion'
+        ]
+        
+        # Show data table
+        st.dataframe(display_df[display_cols], use_container_width=True)
+        
+        # Show detailed cards for top opportunities
+        st.markdown('<h3 class="section-header">top 3 opportunities</h3>', unsafe_allow_html=True)
+        
+        # Get the top 3 real opportunities (negative delta_cvr) ranked for the merchant's goal
+        top_3_df = rank_opportunities(segments_df, selected_goal, k=3)
+        
+        for i, (_, row) in enumerate(top_3_df.iterrows()):
+            segment = row['SEGMENT']
+            opposite = row['OPPOSITE_SEGMENT']
+            delta_cvr = row['DELTA_CVR_ROUND']
+            revenue = row['Revenue Potential (Annual)']
+            revenue_low, revenue_high = row['REVENUE_P10'], row['REVENUE_P90']
+            checkout_pct = row['CHECKOUT_PERCENTAGE_ROUND']
+            
+            specific_action = recipe_action(row['RECIPE_RULE'], segment, short=True)
+            
+            st.markdown(f"""
         <div class="recipe-card">
             <h4>{segment}</h4>
             <p><strong>issue:</strong> {abs(delta_cvr*100):.1f}% lower conversion vs {opposite}</p>
             <p><strong>segment size:</strong> {checkout_pct*100:.1f}% of checkouts</p>
-            <p><strong>revenue impact:</strong> ${revenue:,.0f} annually</p>
+            <p><strong>revenue impact:</strong> ${revenue:,.0f} annually (likely ${revenue_low:,.0f} - ${revenue_high:,.0f})</p>
             <p><strong>recommended action:</strong> {specific_action}</p>
         </div>
         """, unsafe_allow_html=True)
-    
-    # Segment filtering options
-    st.markdown('<h3 class="section-header">filter by segment type</h3>', unsafe_allow_html=True)
-    
-    # Initialize session state for segment filter if it doesn't exist
-    if 'segment_filter' not in st.session_state:
-        st.session_state.segment_filter = None
-    
-    # Create buttons for segment filtering
-    filter_col1, filter_col2, filter_col3, filter_col4, filter_col5 = st.columns(5)
-    
-    with filter_col1:
-        if st.button("coupon-related", key="filter_coupon", use_container_width=True):
-            st.session_state.segment_filter = 'coupon'
-            st.rerun()
-    
-    with filter_col2:
-        if st.button("shipping-related", key="filter_shipping", use_container_width=True):
-            st.session_state.segment_filter = 'shipping'
-            st.rerun()
-    
-    with filter_col3:
-        if st.button("user type", key="filter_user", use_container_width=True):
-            st.session_state.segment_filter = 'user'
-            st.rerun()
-    
-    with filter_col4:
-        if st.button("threshold", key="filter_threshold", use_container_width=True):
-            st.session_state.segment_filter = 'threshold'
-            st.rerun()
-            
-    with filter_col5:
-        if st.button("clear filter", key="filter_clear", use_container_width=True):
+        
+        # Segment filtering options
+        st.markdown('<h3 class="section-header">filter by segment type</h3>', unsafe_allow_html=True)
+        
+        # Initialize session state for segment filter if it doesn't exist
+        if 'segment_filter' not in st.session_state:
             st.session_state.segment_filter = None
-            st.rerun()
-    
-    # Apply filter if set
-    if st.session_state.segment_filter:
-        filter_type = st.session_state.segment_filter
-        
-        # Filter the dataframe
-        if filter_type == 'coupon':
-            filtered_df = display_df[display_df['segment'].str.contains('Coupon')]
-            st.markdown(f"<p>Showing {len(filtered_df)} coupon-related segments</p>", unsafe_allow_html=True)
-            st.dataframe(filtered_df, use_container_width=True)
-        elif filter_type == 'shipping':
-            filtered_df = display_df[display_df['segment'].str.contains('Threshold')]
-            st.markdown(f"<p>Showing {len(filtered_df)} shipping-related segments</p>", unsafe_allow_html=True)
-            st.dataframe(filtered_df, use_container_width=True)
-        elif filter_type == 'user':
-            filtered_df = display_df[display_df['segment'].str.contains('User')]
-            st.markdown(f"<p>Showing {len(filtered_df)} user type segments</p>", unsafe_allow_html=True)
-            st.dataframe(filtered_df, use_container_width=True)
-        elif filter_type == 'threshold':
-            filtered_df = display_df[display_df['segment'].str.contains('Threshold')]
-            st.markdown(f"<p>Showing {len(filtered_df)} threshold segments</p>", unsafe_allow_html=True)
-            st.dataframe(filtered_df, use_container_width=True)
-    
-    # Machine Learning Insights section (from the older version)
-    st.markdown('<h3 class="section-header">machine learning insights</h3>', unsafe_allow_html=True)
-    ml_col1, ml_col2 = st.columns(2)
-
-    with ml_col1:
-        st.markdown("""
+        
+        # Create buttons for segment filtering
+        filter_col1, filter_col2, filter_col3, filter_col4, filter_col5 = st.columns(5)
+        
+        with filter_col1:
+            if st.button("coupon-related", key="filter_coupon", use_container_width=True):
+                st.session_state.segment_filter = 'coupon'
+                st.rerun()
+        
+        with filter_col2:
+            if st.button("shipping-related", key="filter_shipping", use_container_width=True):
+                st.session_state.segment_filter = 'shipping'
+                st.rerun()
+        
+        with filter_col3:
+            if st.button("user type", key="filter_user", use_container_width=True):
+                st.session_state.segment_filter = 'user'
+                st.rerun()
+        
+        with filter_col4:
+            if st.button("threshold", key="filter_threshold", use_container_width=True):
+                st.session_state.segment_filter = 'threshold'
+                st.rerun()
+                
+        with filter_col5:
+            if st.button("clear filter", key="filter_clear", use_container_width=True):
+                st.session_state.segment_filter = None
+                st.rerun()
+        
+        # Apply filter if set
+        if st.session_state.segment_filter:
+            filter_type = st.session_state.segment_filter
+            
+            # Filter the dataframe
+            if filter_type == 'coupon':
+                filtered_df = display_df[display_df['COUPON_STATE'].notna()]
+                st.markdown(f"<p>Showing {len(filtered_df)} coupon-related segments</p>", unsafe_allow_html=True)
+                st.dataframe(filtered_df, use_container_width=True)
+            elif filter_type == 'shipping':
+                filtered_df = display_df[display_df['THRESHOLD_SIDE'].notna()]
+                st.markdown(f"<p>Showing {len(filtered_df)} shipping-related segments</p>", unsafe_allow_html=True)
+                st.dataframe(filtered_df, use_container_width=True)
+            elif filter_type == 'user':
+                filtered_df = display_df[display_df['USER_TYPE'].notna()]
+                st.markdown(f"<p>Showing {len(filtered_df)} user type segments</p>", unsafe_allow_html=True)
+                st.dataframe(filtered_df, use_container_width=True)
+            elif filter_type == 'threshold':
+                filtered_df = display_df[display_df['THRESHOLD_SIDE'].notna()]
+                st.markdown(f"<p>Showing {len(filtered_df)} threshold segments</p>", unsafe_allow_html=True)
+                st.dataframe(filtered_df, use_container_width=True)
+        
+        # Machine Learning Insights section (from the older version)
+        st.markdown('<h3 class="section-header">machine learning insights</h3>', unsafe_allow_html=True)
+        ml_col1, ml_col2 = st.columns(2)
+
+        with ml_col1:
+            st.markdown("""
         <div class="metric-card">
             <h4>merchant similarity analysis</h4>
             <p>this merchant shares patterns with:</p>
@@ -1042,8 +3029,8 @@ with tab1:
         </div>
         """, unsafe_allow_html=True)
 
-    with ml_col2:
-        st.markdown("""
+        with ml_col2:
+            st.markdown("""
         <div class="metric-card">
             <h4>revenue forecast</h4>
             <p>implementing all recommended recipes could result in:</p>
@@ -1054,59 +3041,68 @@ with tab1:
             </ul>
         </div>
         """, unsafe_allow_html=True)
-    
-# Tab 4: Pitch-Ready Recipes
-with tab4:
-    st.markdown('<div class="tab-container">', unsafe_allow_html=True)
-    
-    # Get segments data
-    segments_df = fetch_recipe_segments(
-        selected_merchant, 
-        threshold_percent, 
-        significance_threshold, 
-        selected_country,
-        selected_goal if selected_goal != "all" else None
-    )
-    
-    # Generate recommendations
-    recommendations = generate_recommendations(segments_df, selected_goal)
-    
-    if not recommendations:
-        st.info("no significant recommendations available with current filters. try adjusting the filters.")
-    else:
-        st.markdown('<h3 class="section-header">top recommendations for this merchant</h3>', unsafe_allow_html=True)
         
-        # Add time period information
-        analysis_start = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
-        analysis_end = datetime.now().strftime("%Y-%m-%d")
-        st.markdown(f"""
+    # Tab 4: Pitch-Ready Recipes
+    def render_pitch_ready_recipes():
+        st.markdown('<div class="tab-container">', unsafe_allow_html=True)
+        
+        # Get segments data
+        segments_df = fetch_window_segments(
+            selected_merchant, 
+            threshold_percent, 
+            significance_threshold, 
+            selected_country,
+            selected_goal if selected_goal != "all" else None,
+            window_start,
+            window_end
+        )
+        
+        # Generate recommendations
+        recommendations = get_recommendations(
+            selected_merchant,
+            segments_df,
+            selected_goal,
+            threshold_percent,
+            significance_threshold,
+            selected_country,
+            is_default_window
+        )
+        
+        if not recommendations:
+            st.info("no significant recommendations available with current filters. try adjusting the filters.")
+        else:
+            st.markdown('<h3 class="section-header">top recommendations for this merchant</h3>', unsafe_allow_html=True)
+            
+            # Add time period information
+            st.markdown(f"""
         <div class="time-period" style="margin-bottom: 20px;">
-            based on analysis of checkout data from {analysis_start} to {analysis_end}
+            based on analysis of checkout data from {window_start:%Y-%m-%d} to {window_end:%Y-%m-%d}
         </div>
         """, unsafe_allow_html=True)
-        
-        # Display each recommendation as a card
-        for i, rec in enumerate(recommendations):
-            segment = rec['segment']
-            revenue = rec['revenue']
-            delta_cvr = rec['delta_cvr']
-            explanation = rec['explanation']
-            personalization = rec['personalization']
-            message = rec['message']
-            specific_action = rec['specific_action']
             
-            st.markdown(f"### recipe {i+1}: {segment}")
-            
-            col1, col2 = st.columns([3, 1])
-            
-            with col1:
-                st.markdown(f"""
+            # Display each recommendation as a card
+            for i, rec in enumerate(recommendations):
+                segment = rec['segment']
+                revenue = rec['revenue']
+                delta_cvr = rec['delta_cvr']
+                explanation = rec['explanation']
+                personalization = rec['personalization']
+                message = rec['message']
+                specific_action = rec['specific_action']
+                
+                st.markdown(f"### recipe {i+1}: {segment}")
+                
+                col1, col2 = st.columns([3, 1])
+                
+                with col1:
+                    st.markdown(f"""
                 <div class="recipe-card {'top-recipe' if i==0 else 'medium-recipe' if i==1 else 'low-recipe'}">
                     <h4>explanation</h4>
                     <p>{explanation}</p>
                     
                     <h4>estimated annual impact</h4>
                     <p class="highlight">${revenue:,.0f}</p>
+                    <p>likely ${rec['revenue_low']:,.0f} to ${rec['revenue_high']:,.0f}</p>
                     
                     <h4>personalization</h4>
                     <p>{personalization}</p>
@@ -1120,96 +3116,96 @@ with tab4:
                     </div>
                 </div>
                 """, unsafe_allow_html=True)
-            
-            with col2:
-                st.metric(
-                    "conversion gap", 
-                    f"{abs(delta_cvr*100):.1f}%",
-                    delta=f"${revenue/1000:.0f}K opportunity"
-                )
                 
-                if st.button(f"copy message {i+1}", key=f"copy_message_{i}", use_container_width=True):
-                    st.session_state[f'copy_message_clicked_{i}'] = True
-                
-                if st.button(f"download pdf {i+1}", key=f"download_{i}", use_container_width=True):
-                    st.session_state[f'download_clicked_{i}'] = True
-                
-                # Show success messages
-                if st.session_state.get(f'copy_message_clicked_{i}', False):
-                    st.markdown("""
+                with col2:
+                    st.metric(
+                        "conversion gap", 
+                        f"{abs(delta_cvr*100):.1f}%",
+                        delta=f"${rec['revenue_low']/1000:.0f}K-${rec['revenue_high']/1000:.0f}K opportunity"
+                    )
+                    
+                    if st.button(f"copy message {i+1}", key=f"copy_message_{i}", use_container_width=True):
+                        st.session_state[f'copy_message_clicked_{i}'] = True
+                    
+                    if st.button(f"download pdf {i+1}", key=f"download_{i}", use_container_width=True):
+                        st.session_state[f'download_clicked_{i}'] = True
+                    
+                    # Show success messages
+                    if st.session_state.get(f'copy_message_clicked_{i}', False):
+                        st.markdown("""
                     <div class="success-alert">
                         message copied to clipboard!
                     </div>
                     """, unsafe_allow_html=True)
-                
-                if st.session_state.get(f'download_clicked_{i}', False):
-                    st.markdown("""
+                    
+                    if st.session_state.get(f'download_clicked_{i}', False):
+                        st.markdown("""
                     <div class="success-alert">
                         pdf report downloaded!
                     </div>
                     """, unsafe_allow_html=True)
-    
-        # Visualization of impact
-        st.markdown('<h3 class="section-header">impact visualization</h3>', unsafe_allow_html=True)
-        
-        # Create data for bar chart
-        chart_data = pd.DataFrame({
-            'Segment': [rec['segment'] for rec in recommendations],
-            'Revenue Impact': [rec['revenue'] for rec in recommendations]
-        })
-        
-        # Display bar chart
-        st.bar_chart(chart_data.set_index('Segment'))
-        
-        # Feedback section
-        st.markdown('<h3 class="section-header">was this recommendation helpful?</h3>', unsafe_allow_html=True)
         
-        feedback_col1, feedback_col2, feedback_col3 = st.columns(3)
-        
-        with feedback_col1:
-            if st.button("👍 yes", key="feedback_yes", use_container_width=True):
-                st.session_state['feedback'] = 'positive'
-        
-        with feedback_col2:
-            if st.button("👎 no", key="feedback_no", use_container_width=True):
-                st.session_state['feedback'] = 'negative'
-        
-        with feedback_col3:
-            if st.button("💬 need more info", key="feedback_more", use_container_width=True):
-                st.session_state['feedback'] = 'more_info'
-        
-        # Show feedback confirmation
-        if 'feedback' in st.session_state:
-            if st.session_state['feedback'] == 'positive':
-                st.markdown("""
+            # Visualization of impact
+            st.markdown('<h3 class="section-header">impact visualization</h3>', unsafe_allow_html=True)
+            
+            # Create data for bar chart
+            chart_data = pd.DataFrame({
+                'Segment': [rec['segment'] for rec in recommendations],
+                'Revenue Impact': [rec['revenue'] for rec in recommendations]
+            })
+            
+            # Display bar chart
+            st.bar_chart(chart_data.set_index('Segment'))
+            
+            # Feedback section
+            st.markdown('<h3 class="section-header">was this recommendation helpful?</h3>', unsafe_allow_html=True)
+            
+            feedback_col1, feedback_col2, feedback_col3 = st.columns(3)
+            
+            with feedback_col1:
+                if st.button("👍 yes", key="feedback_yes", use_container_width=True):
+                    st.session_state['feedback'] = 'positive'
+            
+            with feedback_col2:
+                if st.button("👎 no", key="feedback_no", use_container_width=True):
+                    st.session_state['feedback'] = 'negative'
+            
+            with feedback_col3:
+                if st.button("💬 need more info", key="feedback_more", use_container_width=True):
+                    st.session_state['feedback'] = 'more_info'
+            
+            # Show feedback confirmation
+            if 'feedback' in st.session_state:
+                if st.session_state['feedback'] == 'positive':
+                    st.markdown("""
                 <div class="success-alert">
                     thanks for your feedback! we'll continue to refine these recommendations.
                 </div>
                 """, unsafe_allow_html=True)
-            elif st.session_state['feedback'] == 'negative':
-                st.markdown("""
+                elif st.session_state['feedback'] == 'negative':
+                    st.markdown("""
                 <div class="success-alert">
                     thanks for your feedback. what could we improve?
                 </div>
                 """, unsafe_allow_html=True)
-                st.text_area("what could we improve?", key="feedback_improvement")
-            elif st.session_state['feedback'] == 'more_info':
-                st.markdown("""
+                    st.text_area("what could we improve?", key="feedback_improvement")
+                elif st.session_state['feedback'] == 'more_info':
+                    st.markdown("""
                 <div class="success-alert">
                     we'll reach out with more detailed information about these recommendations.
                 </div>
                 """, unsafe_allow_html=True)
-    
-    st.markdown('</div>', unsafe_allow_html=True)
+        
+        st.markdown('</div>', unsafe_allow_html=True)
 
-# Additional Resources 
-st.markdown('<div class="tab-container" style="margin-top: 20px;">', unsafe_allow_html=True)
-st.markdown('<h3 class="section-header">additional resources</h3>', unsafe_allow_html=True)
+    # Additional Resources 
+    st.markdown('<div class="tab-container" style="margin-top: 20px;">', unsafe_allow_html=True)
+    st.markdown('<h3 class="section-header">additional resources</h3>', unsafe_allow_html=True)
 
-resource_col1, resource_col2, resource_col3 = st.columns(3)
+    resource_col1, resource_col2, resource_col3 = st.columns(3)
 
-with resource_col1:
-    st.markdown("""
+    with resource_col1:
+        st.markdown("""
     <div class="metric-card">
         <h4>implementation guides</h4>
         <ul>
@@ -1220,8 +3216,8 @@ with resource_col1:
     </div>
     """, unsafe_allow_html=True)
 
-with resource_col2:
-    st.markdown("""
+    with resource_col2:
+        st.markdown("""
     <div class="metric-card">
         <h4>case studies</h4>
         <ul>
@@ -1232,8 +3228,8 @@ with resource_col2:
     </div>
     """, unsafe_allow_html=True)
 
-with resource_col3:
-    st.markdown("""
+    with resource_col3:
+        st.markdown("""
     <div class="metric-card">
         <h4>support</h4>
         <ul>
@@ -1244,192 +3240,193 @@ with resource_col3:
     </div>
     """, unsafe_allow_html=True)
 
-st.markdown('</div>', unsafe_allow_html=True)
+    st.markdown('</div>', unsafe_allow_html=True)
 
-# Add tooltips
-if "init_tooltips" not in st.session_state:
-    st.session_state.init_tooltips = True
+    # Add tooltips
+    if "init_tooltips" not in st.session_state:
+        st.session_state.init_tooltips = True
 
-# Tab 3: Tested vs. Untested Recipes
-with tab3:
-    st.markdown('<div class="tab-container">', unsafe_allow_html=True)
-    
-    # Initialize test segment filter in session state if it doesn't exist
-    if 'test_segment_filter' not in st.session_state:
-        st.session_state.test_segment_filter = None
-    
-    # Get tested recipes
-    test_history = generate_test_history(selected_merchant, st.session_state.test_segment_filter)
-    
-    # Get all recipe segments for comparison
-    all_segments_df = fetch_recipe_segments(
-        selected_merchant, 
-        0.05,  # lower threshold to include more segments 
-        0.0,   # include all segments regardless of significance
-        None,  # all countries
-        None   # all goals
-    )
-    
-    # Add time period information
-    st.markdown(f"""
+    # Tab 3: Tested vs. Untested Recipes
+    def render_tested_recipes():
+        st.markdown('<div class="tab-container">', unsafe_allow_html=True)
+        
+        # Initialize test segment filter in session state if it doesn't exist
+        if 'test_segment_filter' not in st.session_state:
+            st.session_state.test_segment_filter = None
+        
+        # Get tested recipes
+        test_history = generate_test_history(selected_merchant, st.session_state.test_segment_filter)
+        
+        # Get all recipe segments for comparison
+        all_segments_df = fetch_recipe_segments(
+            selected_merchant, 
+            0.05,  # lower threshold to include more segments 
+            0.0,   # include all segments regardless of significance
+            None,  # all countries
+            None   # all goals
+        )
+        
+        # Add time period information
+        st.markdown(f"""
     <div class="time-period">
         analysis shows recipe tests from the last 90 days and identifies untested opportunities.
     </div>
     """, unsafe_allow_html=True)
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        st.markdown('<h3 class="section-header">tested recipes</h3>', unsafe_allow_html=True)
         
-        if test_history.empty:
-            st.info("no recipe tests found for this merchant.")
-        else:
-            # Add visual indicators for test results
-            test_history['Result'] = test_history.apply(
-                lambda row: f"✅ {row['Lift']}" if row['Status'] == 'Completed' else "⏳ in progress", 
-                axis=1
-            )
-            
-            # Format the dataframe for display
-            display_cols = ['Segment', 'Test Start', 'Test End', 'Test CVR', 'Control CVR', 'Lift', 'Segment Size', 'Result']
-            st.dataframe(test_history[display_cols], use_container_width=True)
-            
-            # Create a chart of test results
-            st.markdown('<h4 style="margin-top: 20px;">test results by lift</h4>', unsafe_allow_html=True)
-            
-            # Extract lift values for chart
-            lift_values = []
-            for lift_str in test_history['Lift']:
-                try:
-                    lift_values.append(float(lift_str.strip('%').strip('+').strip('-')))
-                except:
-                    lift_values.append(0)
-                    
-            test_history['Lift Value'] = lift_values
-            
-            # Create chart data
-            lift_chart_data = pd.DataFrame({
-                'Segment': test_history['Segment'],
-                'Lift (%)': test_history['Lift Value']
-            })
-            
-            # Display chart
-            st.markdown('<div class="chart-container">', unsafe_allow_html=True)
-            st.bar_chart(lift_chart_data.set_index('Segment'))
-            st.markdown('</div>', unsafe_allow_html=True)
-    
-    with col2:
-        st.markdown('<h3 class="section-header">untested opportunities</h3>', unsafe_allow_html=True)
+        col1, col2 = st.columns(2)
         
-        if all_segments_df.empty:
-            st.info("no untested opportunities found.")
-        else:
-            # Find untested segments (those not in test_history)
-            tested_segments = test_history['Segment'].tolist() if not test_history.empty else []
-            untested_df = all_segments_df[~all_segments_df['SEGMENT'].isin(tested_segments)]
+        with col1:
+            st.markdown('<h3 class="section-header">tested recipes</h3>', unsafe_allow_html=True)
             
-            # Filter for actual opportunities (negative delta_cvr)
-            untested_df = untested_df[untested_df['DELTA_CVR_ROUND'] < 0]
-            
-            # Sort by revenue potential
-            untested_df = untested_df.sort_values('Revenue Potential (Annual)', ascending=False)
-            
-            if untested_df.empty:
-                st.info("all significant opportunities have already been tested. good job!")
+            if test_history.empty:
+                st.info("no recipe tests found for this merchant.")
             else:
-                # Prepare display dataframe
-                untested_display = untested_df[['SEGMENT', 'DELTA_CVR_ROUND', 'CHECKOUT_PERCENTAGE_ROUND', 'Revenue Potential (Annual)']].copy()
-                untested_display = untested_display.rename(columns={
-                    'SEGMENT': 'segment',
-                    'DELTA_CVR_ROUND': 'cvr opportunity',
-                    'CHECKOUT_PERCENTAGE_ROUND': 'segment size',
-                    'Revenue Potential (Annual)': 'revenue potential'
+                # Add visual indicators for test results
+                test_history['Result'] = test_history.apply(
+                    lambda row: f"✅ {row['Lift']}" if row['Status'] == 'Completed' else "⏳ in progress", 
+                    axis=1
+                )
+                
+                # Format the dataframe for display
+                display_cols = ['Segment', 'Test Start', 'Test End', 'Test CVR', 'Control CVR', 'Lift', 'Segment Size', 'Result']
+                st.dataframe(test_history[display_cols], use_container_width=True)
+                
+                # Create a chart of test results
+                st.markdown('<h4 style="margin-top: 20px;">test results by lift</h4>', unsafe_allow_html=True)
+                
+                # Extract lift values for chart
+                lift_values = []
+                for lift_str in test_history['Lift']:
+                    try:
+                        lift_values.append(float(lift_str.strip('%').strip('+').strip('-')))
+                    except:
+                        lift_values.append(0)
+                        
+                test_history['Lift Value'] = lift_values
+                
+                # Create chart data
+                lift_chart_data = pd.DataFrame({
+                    'Segment': test_history['Segment'],
+                    'Lift (%)': test_history['Lift Value']
                 })
                 
-                # Format values
-                untested_display['cvr opportunity'] = untested_display['cvr opportunity'].apply(lambda x: f"{abs(x*100):.1f}%")
-                untested_display['segment size'] = untested_display['segment size'].apply(lambda x: f"{x*100:.1f}%")
-                untested_display['revenue potential'] = untested_display['revenue potential'].apply(lambda x: f"${x:,.0f}")
+                # Display chart
+                st.markdown('<div class="chart-container">', unsafe_allow_html=True)
+                st.bar_chart(lift_chart_data.set_index('Segment'))
+                st.markdown('</div>', unsafe_allow_html=True)
+        
+        with col2:
+            st.markdown('<h3 class="section-header">untested opportunities</h3>', unsafe_allow_html=True)
+            
+            if all_segments_df.empty:
+                st.info("no untested opportunities found.")
+            else:
+                # Find untested segments (those not in test_history)
+                tested_segments = test_history['Segment'].tolist() if not test_history.empty else []
+                untested_df = all_segments_df[~all_segments_df['SEGMENT'].isin(tested_segments)]
+                
+                # Filter for actual opportunities (negative delta_cvr)
+                untested_df = untested_df[untested_df['DELTA_CVR_ROUND'] < 0]
                 
-                st.dataframe(untested_display.head(10), use_container_width=True)
+                # Sort by revenue potential
+                untested_df = untested_df.sort_values('Revenue Potential (Annual)', ascending=False)
                 
-                # Show top untested opportunity
-                if len(untested_df) > 0:
-                    st.markdown('<h4 style="margin-top: 20px;">top untested opportunity</h4>', unsafe_allow_html=True)
+                if untested_df.empty:
+                    st.info("all significant opportunities have already been tested. good job!")
+                else:
+                    # Prepare display dataframe
+                    untested_display = untested_df[['SEGMENT', 'DELTA_CVR_ROUND', 'CHECKOUT_PERCENTAGE_ROUND', 'Revenue Potential (Annual)']].copy()
+                    untested_display = untested_display.rename(columns={
+                        'SEGMENT': 'segment',
+                        'DELTA_CVR_ROUND': 'cvr opportunity',
+                        'CHECKOUT_PERCENTAGE_ROUND': 'segment size',
+                        'Revenue Potential (Annual)': 'revenue potential'
+                    })
                     
-                    top_untested = untested_df.iloc[0]
-                    segment = top_untested['SEGMENT']
-                    delta_cvr = top_untested['DELTA_CVR_ROUND']
-                    revenue = top_untested['Revenue Potential (Annual)']
+                    # Format values
+                    untested_display['cvr opportunity'] = untested_display['cvr opportunity'].apply(lambda x: f"{abs(x*100):.1f}%")
+                    untested_display['segment size'] = untested_display['segment size'].apply(lambda x: f"{x*100:.1f}%")
+                    untested_display['revenue potential'] = untested_display['revenue potential'].apply(lambda x: f"${x:,.0f}")
                     
-                    st.markdown(f"""
+                    st.dataframe(untested_display.head(10), use_container_width=True)
+                    
+                    # Show top untested opportunity
+                    if len(untested_df) > 0:
+                        st.markdown('<h4 style="margin-top: 20px;">top untested opportunity</h4>', unsafe_allow_html=True)
+                        
+                        top_untested = untested_df.iloc[0]
+                        segment = top_untested['SEGMENT']
+                        delta_cvr = top_untested['DELTA_CVR_ROUND']
+                        revenue = top_untested['Revenue Potential (Annual)']
+                        
+                        st.markdown(f"""
                     <div class="recipe-card">
                         <h4>{segment}</h4>
                         <p><strong>opportunity:</strong> {abs(delta_cvr*100):.1f}% cvr improvement potential</p>
                         <p><strong>revenue impact:</strong> ${revenue:,.0f} annual potential</p>
                     </div>
                     """, unsafe_allow_html=True)
-                    
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        if st.button("set up test", key="setup_test", use_container_width=True):
-                            st.session_state['setup_test_clicked'] = True
-                    
-                    with col2:
-                        if st.button("schedule discussion", key="schedule_discussion", use_container_width=True):
-                            st.session_state['schedule_discussion_clicked'] = True
-                            
-                    # Show success message if button was clicked
-                    if st.session_state.get('setup_test_clicked', False):
-                        st.markdown("""
+                        
+                        col1, col2 = st.columns(2)
+                        
+                        with col1:
+                            if st.button("set up test", key="setup_test", use_container_width=True):
+                                st.session_state['setup_test_clicked'] = True
+                        
+                        with col2:
+                            if st.button("schedule discussion", key="schedule_discussion", use_container_width=True):
+                                st.session_state['schedule_discussion_clicked'] = True
+                                
+                        # Show success message if button was clicked
+                        if st.session_state.get('setup_test_clicked', False):
+                            st.markdown("""
                         <div class="success-alert">
                             test setup initiated! check your email for details.
                         </div>
                         """, unsafe_allow_html=True)
-                        
-                    if st.session_state.get('schedule_discussion_clicked', False):
-                        st.markdown("""
+                            
+                        if st.session_state.get('schedule_discussion_clicked', False):
+                            st.markdown("""
                         <div class="success-alert">
                             discussion scheduled with merchant for next week.
                         </div>
                         """, unsafe_allow_html=True)
-    
-    st.markdown('</div>', unsafe_allow_html=True)
+        
+        st.markdown('</div>', unsafe_allow_html=True)
 
-# Tab 2: Shipping Promise Analysis
-with tab2:
-    st.markdown('<div class="tab-container">', unsafe_allow_html=True)
-    
-    # Display shipping promise explanation
-    st.markdown("""
+    # Tab 2: Shipping Promise Analysis
+    def render_shipping_analysis():
+        st.markdown('<div class="tab-container">', unsafe_allow_html=True)
+        
+        # Display shipping promise explanation
+        st.markdown("""
     <div style="background-color: #f5f3ff; padding: 15px; border-radius: 5px; margin-bottom: 20px; border-left: 4px solid #6c2cef;">
         <h4 style="margin-top: 0; color: #6c2cef;">about shipping promises</h4>
         <p>this analysis compares actual delivery times with merchant-set promises to identify optimization opportunities. 
         adjusting delivery promises to match reality can improve conversion rates and customer satisfaction.</p>
     </div>
     """, unsafe_allow_html=True)
-    
-    # Fetch shipping data
-    shipping_df = fetch_shipping_promises(selected_merchant)
-    
-    # Generate recommendations
-    shipping_recs = generate_shipping_recommendations(shipping_df)
-    
-    # Count metrics
-    opportunities = sum(1 for rec in shipping_recs if rec['status'] == 'opportunity')
-    on_time = sum(1 for rec in shipping_recs if rec['status'] == 'accurate')
-    missing_promises = sum(1 for rec in shipping_recs if rec['status'] == 'missing')
-    warnings = sum(1 for rec in shipping_recs if rec['status'] == 'warning')
-    
-    # Display metrics
-    st.markdown('<h3 class="section-header">shipping performance overview</h3>', unsafe_allow_html=True)
-    
-    col1, col2, col3, col4 = st.columns(4)
-    
-    with col1:
-        st.markdown(f"""
+        
+        # Fetch shipping data
+        shipping_df = fetch_shipping_promises(selected_merchant)
+        
+        # Generate recommendations
+        shipping_recs = get_shipping_recommendations(selected_merchant, shipping_df)
+        
+        # Count metrics
+        status_counts = shipping_recs['SHIPPING_STATUS'].value_counts()
+        opportunities = status_counts['opportunity']
+        on_time = status_counts['accurate']
+        missing_promises = status_counts['missing']
+        warnings = status_counts['warning']
+        
+        # Display metrics
+        st.markdown('<h3 class="section-header">shipping performance overview</h3>', unsafe_allow_html=True)
+        
+        col1, col2, col3, col4 = st.columns(4)
+        
+        with col1:
+            st.markdown(f"""
         <div class="metric-card">
             <div class="kpi-container">
                 <p class="kpi-number" style="color: #28a745;">{opportunities}</p>
@@ -1438,9 +3435,9 @@ with tab2:
             </div>
         </div>
         """, unsafe_allow_html=True)
-    
-    with col2:
-        st.markdown(f"""
+        
+        with col2:
+            st.markdown(f"""
         <div class="metric-card">
             <div class="kpi-container">
                 <p class="kpi-number">{on_time}</p>
@@ -1449,9 +3446,9 @@ with tab2:
             </div>
         </div>
         """, unsafe_allow_html=True)
-    
-    with col3:
-        st.markdown(f"""
+        
+        with col3:
+            st.markdown(f"""
         <div class="metric-card">
             <div class="kpi-container">
                 <p class="kpi-number" style="color: #884dff;">{missing_promises}</p>
@@ -1460,9 +3457,9 @@ with tab2:
             </div>
         </div>
         """, unsafe_allow_html=True)
-        
-    with col4:
-        st.markdown(f"""
+            
+        with col4:
+            st.markdown(f"""
         <div class="metric-card">
             <div class="kpi-container">
                 <p class="kpi-number" style="color: #ff7b54;">{warnings}</p>
@@ -1471,26 +3468,29 @@ with tab2:
             </div>
         </div>
         """, unsafe_allow_html=True)
-    
-    # Show detailed recommendation cards
-    st.markdown('<h3 class="section-header">shipping recommendations</h3>', unsafe_allow_html=True)
-    
-    if shipping_recs:
-        opportunity_recs = [rec for rec in shipping_recs if rec['status'] == 'opportunity']
-        missing_recs = [rec for rec in shipping_recs if rec['status'] == 'missing']
-        warning_recs = [rec for rec in shipping_recs if rec['status'] == 'warning']
         
-        # First show opportunities
-        if opportunity_recs:
-            st.markdown("""<h4 style="color: #28a745;">🚀 opportunities to tighten promises</h4>""", unsafe_allow_html=True)
+        # Show detailed recommendation cards
+        st.markdown('<h3 class="section-header">shipping recommendations</h3>', unsafe_allow_html=True)
+        
+        if not shipping_recs.empty:
+            # Only the displayed cards get their text rendered
+            def top_recs(status):
+                recs = shipping_recs[shipping_recs['SHIPPING_STATUS'] == status].head(3)
+                return zip(
+                    recs['O_SHIPPING_METHOD_TITLE'], recs['TP80_DIFF'],
+                    render_shipping_text(recs, 'action'), render_shipping_text(recs, 'explanation')
+                )
             
-            for i, rec in enumerate(opportunity_recs[:3]):
-                method = rec['method']
-                tp80 = rec.get('tp80_diff', 0)
-                action = rec['action']
-                explanation = rec['explanation']
+            opportunity_recs = list(top_recs('opportunity'))
+            missing_recs = list(top_recs('missing'))
+            warning_recs = list(top_recs('warning'))
+            
+            # First show opportunities
+            if opportunity_recs:
+                st.markdown("""<h4 style="color: #28a745;">🚀 opportunities to tighten promises</h4>""", unsafe_allow_html=True)
                 
-                st.markdown(f"""
+                for method, tp80, action, explanation in opportunity_recs:
+                    st.markdown(f"""
                 <div class="shipping-card" style="border-left-color: #28a745;">
                     <h4>{method}</h4>
                     <p><strong>opportunity:</strong> {explanation}</p>
@@ -1498,78 +3498,101 @@ with tab2:
                     <p><strong>recommendation:</strong> {action}</p>
                 </div>
                 """, unsafe_allow_html=True)
-        
-        # Then show missing promises
-        if missing_recs:
-            st.markdown("""<h4 style="color: #884dff;">📦 methods needing delivery promises</h4>""", unsafe_allow_html=True)
             
-            for i, rec in enumerate(missing_recs[:3]):
-                method = rec['method']
-                action = rec['action']
-                explanation = rec['explanation']
+            # Then show missing promises
+            if missing_recs:
+                st.markdown("""<h4 style="color: #884dff;">📦 methods needing delivery promises</h4>""", unsafe_allow_html=True)
                 
-                st.markdown(f"""
+                for method, _, action, explanation in missing_recs:
+                    st.markdown(f"""
                 <div class="shipping-card" style="border-left-color: #884dff;">
                     <h4>{method}</h4>
                     <p><strong>issue:</strong> {explanation}</p>
                     <p><strong>recommendation:</strong> {action}</p>
                 </div>
                 """, unsafe_allow_html=True)
-        
-        # Finally show warnings
-        if warning_recs:
-            st.markdown("""<h4 style="color: #ff7b54;">⚠️ promises that need adjustment</h4>""", unsafe_allow_html=True)
             
-            for i, rec in enumerate(warning_recs[:3]):
-                method = rec['method']
-                tp80 = rec.get('tp80_diff', 0)
-                action = rec['action']
-                explanation = rec['explanation']
+            # Finally show warnings
+            if warning_recs:
+                st.markdown("""<h4 style="color: #ff7b54;">⚠️ promises that need adjustment</h4>""", unsafe_allow_html=True)
                 
-                st.markdown(f"""
+                for method, _, action, explanation in warning_recs:
+                    st.markdown(f"""
                 <div class="shipping-card" style="border-left-color: #ff7b54;">
                     <h4>{method}</h4>
                     <p><strong>issue:</strong> {explanation}</p>
                     <p><strong>recommendation:</strong> {action}</p>
                 </div>
                 """, unsafe_allow_html=True)
-    else:
-        st.info("no shipping optimization opportunities found.")
-    
-    # Add a section for the shipping methods table
-    st.markdown('<h3 class="section-header">all shipping methods</h3>', unsafe_allow_html=True)
-    
-    # Create a display dataframe
-    shipping_display = shipping_df.copy()
-    
-    # Calculate percentages
-    total_records = shipping_display['RECORD_COUNT'].sum()
-    shipping_display['PERCENTAGE'] = (shipping_display['RECORD_COUNT'] / total_records) * 100 if total_records > 0 else 0
-    
-    # Rename columns for display
-    shipping_display = shipping_display.rename(columns={
-        'O_SHIPPING_METHOD_TITLE': 'shipping method',
-        'TP80_DIFF': 'tp80 diff',
-        'MEDIAN_DIFF': 'median diff',
-        'RECORD_COUNT': 'records',
-        'PERCENTAGE': '%total',
-        'CALCULATED_PROMISES_VAL': 'promise (days)'
-    })
-    
-    # Format values
-    shipping_display['%total'] = shipping_display['%total'].apply(lambda x: f"{x:.1f}%")
-    
-    # Select columns for display
-    display_cols = [
-        'shipping method', 
-        'promise (days)',
-        'tp80 diff', 
-        'median diff', 
-        'records', 
-        '%total'
-    ]
-    
-    # Show the table
-    st.dataframe(shipping_display[display_cols], use_container_width=True)
-    
-    st.markdown('</div>', unsafe_allow_html=True)
\ No newline at end of file
+        else:
+            st.info("no shipping optimization opportunities found.")
+        
+        # Add a section for the shipping methods table
+        st.markdown('<h3 class="section-header">all shipping methods</h3>', unsafe_allow_html=True)
+        
+        # Create a display dataframe (from the recommendations, so suggested promises match the cards)
+        shipping_display = shipping_recs.copy()
+        
+        # Calculate percentages
+        total_records = shipping_display['RECORD_COUNT'].sum()
+        shipping_display['PERCENTAGE'] = (shipping_display['RECORD_COUNT'] / total_records) * 100 if total_records > 0 else 0
+        
+        # Rename columns for display
+        shipping_display = shipping_display.rename(columns={
+            'O_SHIPPING_METHOD_TITLE': 'shipping method',
+            'TP80_DIFF': 'tp80 diff',
+            'MEDIAN_DIFF': 'median diff',
+            'RECORD_COUNT': 'records',
+            'PERCENTAGE': '%total',
+            'CALCULATED_PROMISES_VAL': 'promise (days)',
+            'ON_TIME_RATE': 'on time',
+            'SUGGESTED_PROMISE': 'suggested promise (days)'
+        })
+        
+        # Format values
+        shipping_display['%total'] = shipping_display['%total'].apply(lambda x: f"{x:.1f}%")
+        shipping_display['on time'] = shipping_display['on time'].apply(lambda x: f"{x:.0%}" if pd.notna(x) else "")
+        
+        # Select columns for display
+        display_cols = [
+            'shipping method', 
+            'promise (days)',
+            'on time',
+            'suggested promise (days)',
+            'tp80 diff', 
+            'median diff', 
+            'records', 
+            '%total'
+        ]
+        
+        # Show the table
+        st.dataframe(shipping_display[display_cols], use_container_width=True)
+        
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    # Render tab contents (when tabs load on demand, hidden tabs are skipped entirely)
+    for tab, render_tab in [
+        (tab1, render_recipe_opportunities),
+        (tab2, render_shipping_analysis),
+        (tab3, render_tested_recipes),
+        (tab4, render_pitch_ready_recipes),
+    ]:
+        if tab_is_open(tab):
+            with tab:
+                render_tab()
+
+    # Frame cache diagnostics, read after the tabs so this run's lookups are counted
+    with st.sidebar.expander("cache diagnostics"):
+        cache_stats = get_frame_cache().stats()
+        st.caption(
+            f"{cache_stats['entries']} frames, {cache_stats['bytes'] / 1024 / 1024:.1f} MB of {CACHE_MAX_BYTES / 1024 / 1024:.0f} MB  \n"
+            f"hit rate {cache_stats['hit_rate']:.0%} ({cache_stats['hits']} hits, {cache_stats['misses']} misses)  \n"
+            f"{cache_stats['evictions']} evictions"
+        )
+
+# Run the dashboard under streamlit run, and batch jobs when invoked directly with python. Anything else
+# (process pool workers re-importing this module, tests) only loads the functions above
+if st.runtime.exists():
+    render_dashboard()
+elif __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,240 @@
+"""Checks of the recipe engine's fast paths against straightforward reference computations"""
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Generated data only: no frame store or snapshot on disk
+os.environ["RECIPE_DATA_SOURCE"] = "generated"
+os.environ["RECIPE_FRAME_STORE_DIR"] = ""
+os.environ["RECIPE_SNAPSHOT_PATH"] = os.path.join(os.path.dirname(__file__), "missing_snapshot.json.gz")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import recipe_test as recipe  # noqa: E402
+
+MERCHANTS = recipe.get_merchants()
+THRESHOLDS = [0.0, 0.01, 0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.5, 0.57, 0.8, 1.0]
+SIGNIFICANCES = [0.0, 0.01, 0.02, 0.03, 0.05, 0.1, 0.15, 0.3]
+
+
+@pytest.fixture(autouse=True)
+def empty_frame_cache():
+    recipe.get_frame_cache().invalidate()
+    yield
+    recipe.get_frame_cache().invalidate()
+
+
+@pytest.fixture(scope="module")
+def all_segments():
+    return {merchant: recipe.GeneratedDataSource().fetch_segments(merchant, 0.0, 0.0, None, None) for merchant in MERCHANTS}
+
+
+@pytest.mark.parametrize("merchant", MERCHANTS)
+def test_whatif_index_matches_filter_segments(merchant, all_segments):
+    df = all_segments[merchant]
+    index = recipe.SegmentWhatIfIndex(df)
+    # The stored share levels themselves are where float32 rounding would bite
+    thresholds = THRESHOLDS + [float(level) for level in np.unique(df['CHECKOUT_PERCENTAGE_ROUND'])]
+    for threshold in thresholds:
+        for significance in SIGNIFICANCES:
+            expected = recipe.filter_segments(df, threshold, significance)
+            pd.testing.assert_frame_equal(index.segments(threshold, significance), expected)
+
+            delta = expected['DELTA_CVR_ROUND']
+            summary = index.summary(threshold, significance)
+            assert summary['total'] == len(expected)
+            assert summary['conversion'] == (delta < 0).sum()
+            assert summary['sensitivity'] == (delta > 0).sum()
+            assert summary['revenue'] == pytest.approx(expected['Revenue Potential (Annual)'].astype(np.float64).sum())
+
+
+def test_subsumed_filters_match_direct_fetches():
+    countries = [None, "All", "US", "UK"]
+    goals = [None] + list(recipe.GOAL_FILTERS)
+    filters = [
+        (threshold, significance, country, goal)
+        for threshold in [0.0, 0.1, 0.2] for significance in [0.0, 0.02, 0.05]
+        for country in countries for goal in goals
+    ]
+    merchant = MERCHANTS[0]
+    source = recipe.GeneratedDataSource()
+    checked = 0
+    for broader in filters:
+        narrower = [narrow for narrow in filters if narrow != broader and recipe.filters_subsume(broader, narrow)]
+        for narrow in narrower[::7]:
+            recipe.get_frame_cache().invalidate()
+            recipe.fetch_recipe_segments(merchant, *broader)
+            derived = recipe.fetch_recipe_segments(merchant, *narrow)
+            pd.testing.assert_frame_equal(derived, source.fetch_segments(merchant, *narrow))
+            checked += 1
+    assert checked > 100
+
+
+def test_filters_subsume_rejects_narrower_broad_filters():
+    assert not recipe.filters_subsume((0.2, 0.0, None, None), (0.1, 0.0, None, None))
+    assert not recipe.filters_subsume((0.0, 0.05, None, None), (0.0, 0.02, None, None))
+    assert not recipe.filters_subsume((0.0, 0.02, None, None), (0.0, 0.0, None, None))
+    assert not recipe.filters_subsume((0.0, 0.0, "US", None), (0.0, 0.0, "All", None))
+    assert not recipe.filters_subsume((0.0, 0.0, None, "margin"), (0.0, 0.0, None, "top-line"))
+
+
+def reference_benjamini_hochberg(p_values):
+    """Textbook BH q-values for one family of tests"""
+    m = len(p_values)
+    order = sorted(range(m), key=lambda i: p_values[i])
+    q_values = [0.0] * m
+    running = 1.0
+    for rank in range(m, 0, -1):
+        i = order[rank - 1]
+        running = min(running, p_values[i] * m / rank)
+        q_values[i] = running
+    return np.array(q_values)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_benjamini_hochberg_matches_reference_per_group(seed):
+    rng = np.random.default_rng(seed)
+    n = 500
+    # Ties, exact zeros and ones, and groups of very different sizes
+    p_values = np.round(rng.beta(0.5, 2, n), 2)
+    p_values[:5] = [0.0, 1.0, 0.0, 1.0, 0.5]
+    groups = rng.choice(7, size=n, p=[0.4, 0.2, 0.15, 0.1, 0.1, 0.04, 0.01])
+
+    q_values = recipe.benjamini_hochberg(p_values, groups)
+    for group in np.unique(groups):
+        members = groups == group
+        np.testing.assert_allclose(q_values[members], reference_benjamini_hochberg(list(p_values[members])), rtol=1e-12)
+
+
+def test_benjamini_hochberg_single_group():
+    p_values = np.array([0.01, 0.04, 0.03, 0.2])
+    np.testing.assert_allclose(
+        recipe.benjamini_hochberg(p_values, np.zeros(4, dtype=np.int64)), reference_benjamini_hochberg(list(p_values))
+    )
+
+
+def synthetic_shipments(rng, n, shops=40, methods=12):
+    promised = rng.integers(0, 12, n).astype(np.float64)
+    # Some deliveries far later than the sketch range, some records without a promise or delivery
+    actual = promised + rng.normal(-0.5, 2.0, n) + np.where(rng.random(n) < 0.02, 60.0, 0.0)
+    promised[rng.random(n) < 0.05] = np.nan
+    actual[rng.random(n) < 0.02] = np.nan
+    return pd.DataFrame({
+        'S_SHOP_NAME': [f"shop-{i}" for i in rng.integers(0, shops, n)],
+        'O_SHIPPING_METHOD_TITLE': [f"method-{i}" for i in rng.integers(0, methods, n)],
+        'PROMISED_DAYS': promised,
+        'ACTUAL_DAYS': actual,
+    })
+
+
+def chunks(df, size):
+    return (df.iloc[start:start + size] for start in range(0, len(df), size))
+
+
+def test_delivery_sketch_shards_merge_to_single_pass():
+    records = synthetic_shipments(np.random.default_rng(1), 20000)
+    single = recipe.DeliverySketches().update(records)
+
+    merged = recipe.DeliverySketches()
+    for shard_records in np.array_split(np.arange(len(records)), 4):
+        shard = recipe.DeliverySketches()
+        # Small chunks make every shard grow its buffers many times
+        for chunk in chunks(records.iloc[shard_records], 37):
+            shard.update(chunk)
+        merged.merge(shard)
+
+    assert list(merged.index) == list(single.index)
+    np.testing.assert_array_equal(merged.lateness, single.lateness)
+    np.testing.assert_array_equal(merged.promises, single.promises)
+    np.testing.assert_array_equal(merged.records, single.records)
+    pd.testing.assert_frame_equal(merged.to_frame(), single.to_frame())
+
+
+def synthetic_events(rng, n, shops=30, countries=15):
+    def attribute(values, unknown_rate):
+        picked = rng.choice(np.array(values, dtype=object), n)
+        picked[rng.random(n) < unknown_rate] = "bogus"
+        return picked
+
+    device = attribute(recipe.SEGMENT_ATTRIBUTE_CATEGORIES['DEVICE'], 0.03)
+    device[rng.random(n) < 0.05] = None
+    converted = rng.random(n) < 0.6
+    return pd.DataFrame({
+        'SHOP_NAME': [f"shop-{i}" for i in rng.integers(0, shops, n)],
+        'USER_TYPE': attribute(recipe.SEGMENT_ATTRIBUTE_CATEGORIES['USER_TYPE'], 0.02),
+        'COUPON_STATE': attribute(recipe.SEGMENT_ATTRIBUTE_CATEGORIES['COUPON_STATE'], 0.0),
+        'THRESHOLD_SIDE': attribute(recipe.SEGMENT_ATTRIBUTE_CATEGORIES['THRESHOLD_SIDE'], 0.0),
+        'DEVICE': device,
+        'DELIVERY_COUNTRY': [f"C{i}" for i in rng.integers(0, countries, n)],
+        'CONVERTED': converted,
+        'ORDER_VALUE': np.round(rng.gamma(4, 30, n), 2),
+        'SHIPPING_REVENUE': np.round(rng.gamma(2, 4, n), 2),
+    })[recipe.CHECKOUT_EVENT_COLUMNS]
+
+
+def test_segment_cube_shards_merge_to_single_pass():
+    events = synthetic_events(np.random.default_rng(2), 30000)
+    single = recipe.SegmentCube().update(events)
+
+    merged = recipe.SegmentCube()
+    for shard_events in np.array_split(np.arange(len(events)), 5):
+        shard = recipe.SegmentCube()
+        for chunk in chunks(events.iloc[shard_events], 53):
+            shard.update(chunk)
+        merged.merge(shard)
+
+    assert list(merged.shops) == list(single.shops)
+    assert list(merged.countries) == list(single.countries)
+    for name, values in single.measures.items():
+        np.testing.assert_allclose(merged.measures[name], values, rtol=1e-9)
+    pd.testing.assert_frame_equal(merged.to_frame(), single.to_frame(), rtol=1e-6)
+    for by in [(), ('USER_TYPE',), ('DEVICE', 'DELIVERY_COUNTRY')]:
+        pd.testing.assert_frame_equal(merged.rollup(by), single.rollup(by), rtol=1e-9)
+
+
+def test_segment_cube_rollup_matches_groupby():
+    events = synthetic_events(np.random.default_rng(3), 5000)
+    cube = recipe.SegmentCube()
+    for chunk in chunks(events, 101):
+        cube.update(chunk)
+
+    # Events with an unknown user type are skipped; an unknown or missing device is kept
+    known = events[events['USER_TYPE'] != "bogus"]
+    expected = known.groupby(['SHOP_NAME', 'USER_TYPE']).agg(
+        CHECKOUTS=('CONVERTED', 'size'), CONVERSIONS=('CONVERTED', 'sum')
+    )
+    rollup = cube.rollup(['USER_TYPE']).set_index(['SHOP_NAME', 'USER_TYPE'])
+    rollup = rollup[rollup['CHECKOUTS'] > 0]
+    assert rollup['CHECKOUTS'].sum() == len(known)
+    for key, row in expected.iterrows():
+        assert rollup.loc[key, 'CHECKOUTS'] == row['CHECKOUTS']
+        assert rollup.loc[key, 'CONVERSIONS'] == row['CONVERSIONS']
+
+
+def snapshot_round_trip(value):
+    encoded = json.dumps(value, default=recipe._encode_snapshot_value)
+    return json.loads(encoded, object_hook=recipe._decode_snapshot_value)
+
+
+def test_snapshot_round_trip_keeps_frames():
+    df = pd.DataFrame({
+        'SHOP': pd.Categorical(["a", "b", "a", None], categories=["b", "a", "unused"]),
+        'FLOAT32': np.array([0.57, np.nan, 1.5, -0.0], dtype=np.float32),
+        'FLOAT64': [0.1, np.nan, np.inf, 2.5],
+        'INT': np.array([1, 2, 3, 4], dtype=np.int32),
+        'SMALL': np.array([0, 1, 2, 3], dtype=np.int8),
+        'FLAG': [True, False, True, False],
+    }, index=[3, 1, 7, 0])
+    decoded = snapshot_round_trip({'frame': df, 'count': np.int64(4), 'rate': np.float32(0.25)})
+
+    pd.testing.assert_frame_equal(decoded['frame'], df)
+    assert list(decoded['frame']['SHOP'].cat.categories) == ["b", "a", "unused"]
+    assert decoded['count'] == 4 and decoded['rate'] == 0.25
+
+
+def test_snapshot_round_trip_keeps_segment_frames(all_segments):
+    df = all_segments[MERCHANTS[1]]
+    pd.testing.assert_frame_equal(snapshot_round_trip({'segments': df})['segments'], df)